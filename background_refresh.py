@@ -0,0 +1,62 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+
+class BackgroundRefresher:
+    """
+    Runs cache refreshes on background threads.
+
+    Used for stale-while-revalidate: a page is served the expired cached data
+    right away while the sheet is downloaded again in the background. At most
+    one refresh per sheet is in flight; asking for a sheet that is already
+    being refreshed does nothing.
+    """
+
+    def __init__(self, max_workers:int=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sheet-refresh")
+        self._lock = threading.Lock()
+        self._in_flight = set()
+
+    def submit(self, sheet_names:List[str], refresh:Callable[[List[str]], None]) -> List[str]:
+        """
+        Refresh sheets in the background.
+
+        Args:
+            sheet_names (List[str]): The sheets to refresh
+            refresh (Callable[[List[str]], None]): Function that downloads the
+                given sheets and stores them in the cache
+
+        Returns:
+            sheet_names (List[str]): The sheets that were scheduled, i.e.
+                sheet_names without the ones that were already in flight
+        """
+        with self._lock:
+            sheet_names = [name for name in dict.fromkeys(sheet_names) if name not in self._in_flight]
+            self._in_flight.update(sheet_names)
+        if not sheet_names:
+            return []
+
+        def run():
+            try:
+                refresh(sheet_names)
+            except Exception:
+                print(f"Background refresh of {', '.join(sheet_names)} failed:")
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._in_flight.difference_update(sheet_names)
+
+        self._executor.submit(run)
+        return sheet_names
+
+    def in_flight(self, sheet_name:str) -> bool:
+        """
+        Whether a refresh of sheet_name is currently scheduled or running.
+        """
+        with self._lock:
+            return sheet_name in self._in_flight
+
+
+refresher = BackgroundRefresher()
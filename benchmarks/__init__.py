@@ -0,0 +1,9 @@
+"""
+Benchmarks of the computations behind the pages.
+
+Synthetic sheets (see synthetic.py) are served by an in-memory stand-in for
+GoogleSheetsInterface (see fake_sheets.py), so no network or credentials
+are needed. Run all benchmarks and write the results as json with:
+
+    python -m benchmarks.run --output results.json
+"""
@@ -0,0 +1,50 @@
+from collections import Counter
+from typing import Dict, List
+import pandas as pd
+from storage import StorageBackend
+
+
+class FakeSheetsInterface(StorageBackend):
+    """
+    In-memory stand-in for GoogleSheetsInterface.
+
+    Serves a dict of DataFrames through the same methods the pages use, so
+    page code can run without network access or credentials. Every load
+    returns a copy, as the sheet cache does, and calls counts how often
+    each method was used.
+    """
+
+    def __init__(self, sheets:Dict[str, pd.DataFrame]):
+        self.sheets = {sheet_name: data.reset_index(drop=True) for sheet_name, data in sheets.items()}
+        self.calls = Counter()
+        self.writes = Counter()
+
+    def load_google_sheet_data(self, sheet_name:str) -> pd.DataFrame:
+        self.calls["load"] += 1
+        return self.sheets[sheet_name].copy()
+
+    def version(self, sheet_name:str) -> tuple:
+        return (id(self), self.writes[sheet_name])
+
+    def update_google_sheet(self, sheet_name:str, updated_data:pd.DataFrame) -> None:
+        self.calls["update"] += 1
+        self.writes[sheet_name] += 1
+        self.sheets[sheet_name] = updated_data.reset_index(drop=True)
+
+    def append_rows(self, sheet_name:str, new_rows:pd.DataFrame) -> None:
+        self.calls["append"] += 1
+        self.writes[sheet_name] += 1
+        new_rows = new_rows.reindex(columns=self.sheets[sheet_name].columns)
+        self.sheets[sheet_name] = pd.concat([self.sheets[sheet_name], new_rows], ignore_index=True)
+
+    def update_rows(self, sheet_name:str, rows:pd.DataFrame) -> None:
+        self.calls["update_rows"] += 1
+        self.writes[sheet_name] += 1
+        data = self.sheets[sheet_name].astype(object)
+        data.loc[rows.index, rows.columns] = rows.astype(object).values
+        self.sheets[sheet_name] = data.infer_objects()
+
+    def delete_rows(self, sheet_name:str, indices:List[int]) -> None:
+        self.calls["delete"] += 1
+        self.writes[sheet_name] += 1
+        self.sheets[sheet_name] = self.sheets[sheet_name].drop(index=list(indices)).reset_index(drop=True)
@@ -0,0 +1,105 @@
+"""
+Time the workloads at several data sizes and report the results as json.
+
+    python -m benchmarks.run [--sizes 1000 100000 1000000] [--foods 10000]
+                             [--repeat 5] [--workloads food_day ...]
+                             [--output results.json]
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import List
+import numpy as np
+import pandas as pd
+import scipy
+from benchmarks import synthetic
+from benchmarks.fake_sheets import FakeSheetsInterface
+from benchmarks.workloads import WORKLOADS
+
+
+def time_workload(name:str, storage:FakeSheetsInterface, repeat:int) -> dict:
+    """
+    Run a workload repeat times (after one warm-up run) and summarize the
+    durations in seconds.
+    """
+    workload = WORKLOADS[name]
+    workload(storage)
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        workload(storage)
+        durations.append(time.perf_counter() - start)
+    return {
+        "min_s": min(durations),
+        "median_s": statistics.median(durations),
+        "mean_s": statistics.fmean(durations),
+        "max_s": max(durations),
+    }
+
+
+def run(sizes:List[int], n_foods:int, repeat:int, workloads:List[str], seed:int=0) -> dict:
+    """
+    Time every workload at every size.
+
+    Returns:
+        report (dict): environment (versions and machine) and results (one
+            entry per workload and size)
+    """
+    results = []
+    for size in sizes:
+        start = time.perf_counter()
+        storage = FakeSheetsInterface(synthetic.sheets(log_rows=size, n_foods=n_foods, seed=seed))
+        print(f"Generated {size} log rows in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        for name in workloads:
+            timing = time_workload(name, storage, repeat)
+            print(f"  {name}: {timing['median_s']*1000:.1f} ms", file=sys.stderr)
+            results.append({
+                "workload": name,
+                "log_rows": size,
+                "weight_log_rows": min(size, synthetic.MAX_WEIGHT_LOG_ROWS),
+                "foods": n_foods,
+                "repeat": repeat,
+                **timing,
+            })
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "machine": platform.machine(),
+            "system": platform.system(),
+        },
+        "results": results,
+    }
+
+
+def main(argv:List[str]=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the page computations on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000],
+                        help="number of rows of each food log and weight log")
+    parser.add_argument("--foods", type=int, default=10_000, help="number of rows of food_data")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per workload and size")
+    parser.add_argument("--workloads", nargs="+", choices=sorted(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the json report to (default: stdout)")
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.foods, args.repeat, args.workloads, args.seed)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Check the cold-start and first-render time of every page against the
+budgets in instrumentation.BUDGETS_MS.
+
+Each page is run once in a fresh Python process (with Streamlit's AppTest),
+in offline mode on synthetic data, with startup profiling on. Exits with
+status 1 if a page is over budget, so it can be used as a CI check:
+
+    python -m benchmarks.startup [--log-rows 1000] [--foods 1000] [--recipes 20]
+                                 [--output startup.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import List
+from benchmarks import synthetic
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = [
+    "streamlit_app.py",
+    "pages/Overview - Food 🥦.py",
+    "pages/Overview - Weight 🐖.py",
+    "pages/Recipes 📖.py",
+    "pages/Manage📋.py",
+    "pages/Set Target 🎯.py",
+    "pages/Admin 🛠️.py",
+]
+
+RUN_PAGE = """
+import sys
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=120).run()
+for exception in app.exception:
+    print(exception.message, file=sys.stderr)
+sys.exit(1 if app.exception else 0)
+"""
+
+
+def seed(directory:str, log_rows:int, n_foods:int, n_recipes:int) -> None:
+    """
+    Store synthetic sheets in the Google Sheets cache of directory, which
+    offline mode imports them from.
+    """
+    sys.path.insert(0, REPOSITORY)
+    from sheet_cache import SheetCache
+    cache = SheetCache(f"{directory}/cache/gsheets")
+    os.makedirs(cache.cache_path, exist_ok=True)
+    for sheet_name, data in synthetic.sheets(log_rows=log_rows, n_foods=n_foods, n_recipes=n_recipes).items():
+        cache.write(sheet_name, data)
+
+
+def run_page(page:str, directory:str) -> dict:
+    """
+    Run a page in a fresh process and return the report of its first run.
+    """
+    report_path = f"{directory}/report.jsonl"
+    if os.path.exists(report_path):
+        os.remove(report_path)
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [REPOSITORY, os.environ.get("PYTHONPATH")])),
+        HEALTH_TRACKER_STORAGE="offline",
+        HEALTH_TRACKER_STARTUP_PROFILE="1",
+        HEALTH_TRACKER_STARTUP_REPORT=report_path,
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", RUN_PAGE, f"{REPOSITORY}/{page}"],
+        cwd=directory, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{page} failed:\n{result.stderr}")
+    with open(report_path) as file:
+        return json.loads(file.readline())
+
+
+def main(argv:List[str]=None) -> None:
+    parser = argparse.ArgumentParser(description="Check page startup times against their budgets.")
+    parser.add_argument("--log-rows", type=int, default=1_000, help="number of rows of each log")
+    parser.add_argument("--foods", type=int, default=1_000, help="number of rows of food_data")
+    parser.add_argument("--recipes", type=int, default=20, help="number of recipes (all are shown on the Recipes page)")
+    parser.add_argument("--output", help="file to write the json reports to")
+    args = parser.parse_args(argv)
+
+    from instrumentation import BUDGETS_MS
+    reports = []
+    with tempfile.TemporaryDirectory() as directory:
+        seed(directory, args.log_rows, args.foods, args.recipes)
+        for page in PAGES:
+            report = run_page(page, directory)
+            reports.append(report)
+            status = "OVER BUDGET: " + ", ".join(report["over_budget"]) if report["over_budget"] else "ok"
+            print(
+                f"{report['page']:<12} cold start {report['total_ms']:>7.0f} ms"
+                f"  first render {report['render_ms']:>7.0f} ms  {status}",
+                file=sys.stderr,
+            )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"budgets_ms": BUDGETS_MS, "pages": reports}, file, indent=2)
+    if any(report["over_budget"] for report in reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
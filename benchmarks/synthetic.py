@@ -0,0 +1,134 @@
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+
+USERS = ["bela", "marleen"]
+MEALS = ["Breakfast", "Lunch", "Dinner", "Snack"]
+FOOD_TYPES = ["Fruit", "Vegetable", "Dairy", "Meat", "Fish", "Grain", "Snack", "Drink"]
+SERVING_NAMES = ["portion(s)", "piece(s)", "slice(s)", "cup(s)", "tbsp"]
+TAGS = ["breakfast", "lunch", "dinner", "vegetarian", "vegan", "quick", "high protein", "low carb", "soup", "pasta"]
+
+# entries per day in a food log, and the oldest date pandas can represent
+# is in 1677, so one row per day is the most a weight log can hold
+FOOD_LOG_ENTRIES_PER_DAY = 10
+MAX_WEIGHT_LOG_ROWS = 100_000
+
+
+def food_data(n_foods:int, rng:np.random.Generator) -> pd.DataFrame:
+    """
+    Food/nutrition database with the columns of the food_data sheet.
+    """
+    fat = rng.uniform(0, 40, n_foods).round(1)
+    carbs = rng.uniform(0, 80, n_foods).round(1)
+    protein = rng.uniform(0, 30, n_foods).round(1)
+    return pd.DataFrame({
+        "Name": [f"Food {i:05d}" for i in range(n_foods)],
+        "Fat (g)": fat,
+        "Carbs (g)": carbs,
+        "Protein (g)": protein,
+        "Calories (kcal)": (9*fat + 4*carbs + 4*protein).round(0),
+        "Serving Name": rng.choice(SERVING_NAMES, n_foods),
+        "Single Serving (g)": rng.integers(10, 400, n_foods),
+        "Type": rng.choice(FOOD_TYPES, n_foods),
+    })
+
+
+def food_log(n_rows:int, food_names:List[str], rng:np.random.Generator) -> pd.DataFrame:
+    """
+    Food log with about FOOD_LOG_ENTRIES_PER_DAY entries per day, ending today.
+    """
+    days = _dates(max(1, n_rows // FOOD_LOG_ENTRIES_PER_DAY))
+    dates = np.sort(rng.choice(days, n_rows))
+    in_grams = rng.random(n_rows) < 0.3
+    return pd.DataFrame({
+        "date": dates,
+        "meal": rng.choice(MEALS, n_rows),
+        "name": rng.choice(food_names, n_rows),
+        "quantity": np.where(in_grams, rng.integers(5, 500, n_rows), rng.integers(1, 8, n_rows) / 2),
+        "serving": np.where(in_grams, "g", "portion(s)"),
+    })
+
+
+def weight_log(n_rows:int, rng:np.random.Generator) -> pd.DataFrame:
+    """
+    Weight log with one entry per day (at most MAX_WEIGHT_LOG_ROWS), ending
+    today, losing 8 kg over the whole log with some day-to-day noise.
+    """
+    n_rows = min(n_rows, MAX_WEIGHT_LOG_ROWS)
+    start = rng.uniform(60, 100)
+    weight = start - 8 * np.linspace(0, 1, n_rows) + rng.normal(0, 0.5, n_rows)
+    return pd.DataFrame({
+        "date": _dates(n_rows),
+        "weight": np.clip(weight, 40, 150).round(1),
+    })
+
+
+def recipes(n_recipes:int, food_names:List[str], rng:np.random.Generator) -> Dict[str, pd.DataFrame]:
+    """
+    The recipe_* sheets and available_tags.
+    """
+    names = [f"Recipe {i:04d}" for i in range(n_recipes)]
+    n_tags = rng.integers(1, 5, n_recipes)
+    n_ingredients = rng.integers(2, 12, n_recipes)
+    n_instructions = rng.integers(2, 8, n_recipes)
+
+    tags = [rng.choice(TAGS, n, replace=False) for n in n_tags]
+    return {
+        "recipe_info": pd.DataFrame({
+            "name": names,
+            "description": [f"Description of {name}" for name in names],
+        }),
+        "recipe_tags": pd.DataFrame({
+            "name": np.repeat(names, n_tags),
+            "tag": np.concatenate(tags),
+        }),
+        "recipe_ingredients": pd.DataFrame({
+            "name": np.repeat(names, n_ingredients),
+            "ingredient": rng.choice(food_names, n_ingredients.sum()),
+            "quantity": rng.integers(1, 8, n_ingredients.sum()) / 2,
+            "serving": rng.choice(["g", "portion(s)"], n_ingredients.sum()),
+        }),
+        "recipe_instructions": pd.DataFrame({
+            "name": np.repeat(names, n_instructions),
+            "instruction": [f"Step {i}" for n in n_instructions for i in range(1, n + 1)],
+        }),
+        "available_tags": pd.DataFrame({"tag": TAGS}),
+    }
+
+
+def sheets(log_rows:int, n_foods:int, n_recipes:int=500, seed:int=0) -> Dict[str, pd.DataFrame]:
+    """
+    A complete set of sheets, as the app expects them in Google Sheets.
+
+    Args:
+        log_rows (int): Number of rows of every food log and weight log
+        n_foods (int): Number of rows of food_data
+        n_recipes (int): Number of recipes
+        seed (int): Seed of the random generator, the same arguments always
+            give the same sheets
+
+    Returns:
+        sheets (Dict[str, pd.DataFrame]): The data of each sheet, by sheet name
+    """
+    rng = np.random.default_rng(seed)
+    data = {"food_data": food_data(n_foods, rng)}
+    food_names = data["food_data"]["Name"].to_list()
+    data.update(recipes(n_recipes, food_names, rng))
+    for user in USERS:
+        data[f"food_log_{user}"] = food_log(log_rows, food_names, rng)
+        data[f"weight_log_{user}"] = weight_log(log_rows, rng)
+        data[f"info_{user}"] = pd.DataFrame({
+            "height": [rng.integers(155, 195)],
+            "birthday": ["1990-01-01"],
+            "sex": [rng.choice(["M", "F"])],
+        })
+        data[f"target_{user}"] = pd.DataFrame({"target": [500]})
+    return data
+
+
+def _dates(n_days:int) -> np.ndarray:
+    """
+    The last n_days dates up to today, oldest first, as "%Y-%m-%d" strings.
+    """
+    end = pd.Timestamp.today().normalize()
+    return pd.date_range(end=end, periods=n_days, freq="D").strftime("%Y-%m-%d").to_numpy()
@@ -0,0 +1,153 @@
+"""
+The computations the pages do, as functions of a storage backend.
+
+Each workload mirrors the code of a page (loading included) so its timing
+tracks what a page rerun costs. Keep them in step when the pages change.
+"""
+from datetime import datetime
+from typing import Callable, Dict
+import pandas as pd
+from scipy.interpolate import splrep, splev
+from daily_aggregates import aggregates
+from energy import allowances
+from food_catalog import food_catalog
+from food_search import food_counts, search_index
+from nutrition import nutrition_facts
+from storage import StorageBackend
+
+USER = "bela"
+
+
+def food_day(storage:StorageBackend) -> pd.DataFrame:
+    """
+    Food page: the calories of one day, by meal.
+    """
+    date = datetime.today().strftime("%Y-%m-%d")
+    catalog = food_catalog(storage)
+    df_day = storage.query(f"food_log_{USER}", date=date)
+
+    facts = nutrition_facts(df_day, catalog)
+    df_day["weight"] = facts["grams"]
+    df_day["total_calories"] = facts["kcal"].round(0)
+    return df_day.groupby("meal")["total_calories"].sum()
+
+
+def food_log_calories(storage:StorageBackend) -> pd.DataFrame:
+    """
+    The Food page calculation applied to a whole food log: the calories of
+    every day, by meal. Shows how the calculation scales with the log.
+    """
+    catalog = food_catalog(storage)
+    df_log = storage.load_google_sheet_data(f"food_log_{USER}")
+
+    facts = nutrition_facts(df_log, catalog)
+    df_log["weight"] = facts["grams"]
+    df_log["total_calories"] = facts["kcal"].round(0)
+    return df_log.groupby(["date", "meal"])["total_calories"].sum()
+
+
+def food_history(storage:StorageBackend) -> pd.DataFrame:
+    """
+    The calories and macros of every day of a food log, from the
+    materialized daily aggregates.
+    """
+    return aggregates.totals(storage, USER, food_catalog(storage))
+
+
+def food_range(storage:StorageBackend) -> tuple:
+    """
+    Food page: the daily totals, meals and deficits of the last 365 days.
+    """
+    end = pd.Timestamp.today().normalize()
+    date_range = ((end - pd.Timedelta(days=364)).strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+    sheets = storage.load_many([f"weight_log_{USER}", f"info_{USER}", f"target_{USER}"])
+    df_range = aggregates.daily(storage, USER, food_catalog(storage), date_range)
+    df_days = df_range.groupby(level="date").sum()
+    df_days["allowed"] = allowances(
+        df_days.index, sheets[f"weight_log_{USER}"], sheets[f"info_{USER}"],
+        sheets[f"target_{USER}"]["target"].values[0], exercise_level=2,
+    )
+    df_days["deficit"] = df_days["allowed"] - df_days["kcal"]
+    df_meals = df_range["kcal"].unstack("meal")
+    return df_days, df_meals
+
+
+def food_picker(storage:StorageBackend) -> list:
+    """
+    Food page: the food search and selectbox of each meal, with the serving
+    and calories of the selected food.
+    """
+    catalog = food_catalog(storage)
+    counts = food_counts(storage, USER)
+    query = str(catalog.sorted_names[len(catalog) // 2])[:4]
+    picks = []
+    for meal in ["Breakfast", "Lunch", "Dinner", "Snack"]:
+        options = search_index(catalog).search(query, counts) or search_index(catalog).search("", counts)
+        name = options[0]
+        picks.append((meal, catalog.serving_name(name), catalog.per_100g(name)["kcal"]))
+    return picks
+
+
+def recipe_tag_filter(storage:StorageBackend) -> pd.Series:
+    """
+    Recipes page: the recipes that have all selected tags.
+    """
+    df_tags = storage.load_google_sheet_data("recipe_tags")
+    tags = ["vegetarian", "quick"]
+    df_names = df_tags.groupby("name").filter(lambda x: set(tags).issubset(set(x["tag"])))
+    return df_names["name"].unique()
+
+
+def recipe_calories(storage:StorageBackend) -> pd.Series:
+    """
+    Recipes page: the weight and calories of the ingredients of every
+    recipe, and the calories per recipe.
+    """
+    df_ingredients = storage.load_google_sheet_data("recipe_ingredients")
+    facts = nutrition_facts(df_ingredients, food_catalog(storage), food_column="ingredient")
+    return facts["kcal"].groupby(df_ingredients["name"]).sum()
+
+
+def weight_spline(storage:StorageBackend) -> pd.Series:
+    """
+    Weight page: moving average and smoothing spline of the weight log.
+    """
+    df_weight_log = storage.load_google_sheet_data(f"weight_log_{USER}")
+    df_weight_log["moving_average"] = df_weight_log["weight"].rolling(window=3, min_periods=1).mean()
+
+    df_weight_log_plot = df_weight_log.sort_values(by="date")
+    # nanoseconds, which splrep converts to floats (pandas 3 defaults to microseconds)
+    x = pd.to_datetime(df_weight_log_plot["date"]).astype("datetime64[ns]")
+    y_avg = df_weight_log_plot["moving_average"]
+
+    tck = splrep(x, y_avg, s=3)
+    return splev(x, tck, der=0)
+
+
+def weight_challenge(storage:StorageBackend) -> pd.DataFrame:
+    """
+    Home page: both weight logs merged on date and forward-filled.
+    """
+    sheets = storage.load_many(["weight_log_bela", "weight_log_marleen"])
+
+    weight_log_bela = sheets["weight_log_bela"].sort_values(by="date")
+    weight_log_bela["delta"] = weight_log_bela["weight"] - weight_log_bela["weight"].values[0]
+
+    weight_log_marleen = sheets["weight_log_marleen"].sort_values(by="date")
+    weight_log_marleen["delta"] = weight_log_marleen["weight"] - weight_log_marleen["weight"].values[0]
+
+    df = weight_log_bela.merge(weight_log_marleen, on="date", suffixes=("_bela", "_marleen"), how="outer")
+    return df.ffill()
+
+
+WORKLOADS: Dict[str, Callable[[StorageBackend], object]] = {
+    "food_day": food_day,
+    "food_log_calories": food_log_calories,
+    "food_history": food_history,
+    "food_picker": food_picker,
+    "food_range": food_range,
+    "recipe_tag_filter": recipe_tag_filter,
+    "recipe_calories": recipe_calories,
+    "weight_spline": weight_spline,
+    "weight_challenge": weight_challenge,
+}
@@ -0,0 +1,279 @@
+import threading
+from typing import Dict, Hashable, Optional, Set, Tuple
+import numpy as np
+import pandas as pd
+from food_catalog import FoodCatalog
+from nutrition import nutrition_facts
+from storage import StorageBackend
+
+COLUMNS = ["entries", "grams", "kcal", "fat", "carbs", "protein"]
+
+
+class _UserAggregates:
+    """
+    The aggregates of one user, and what they were computed from. Not
+    changed once shared, updates build a new one (see DailyAggregates).
+    """
+
+    def __init__(
+        self,
+        daily:pd.DataFrame,
+        log_version:Optional[Hashable],
+        catalog:FoodCatalog,
+        partitions:Optional[Dict[str, Hashable]],
+    ):
+        self.daily = daily
+        self.log_version = log_version
+        self.catalog = catalog
+        # versions of the log's partitions daily was built from, see
+        # StorageBackend.partitions
+        self.partitions = partitions
+
+
+class DailyAggregates:
+    """
+    Materialized nutrition totals per user, day and meal.
+
+    For every (date, meal) of a user's food log the table holds the number
+    of entries and the sum of their grams, kcal, fat, carbs and protein, so
+    daily totals and history charts read a few rows per day instead of
+    merging the whole log with food_data again.
+
+    The table of a user is built from the whole log once, and then kept up
+    to date incrementally:
+
+    * entries added or removed through append_rows and delete_rows are
+      added to or subtracted from their (date, meal) row
+    * when food_data changes (a new FoodCatalog), only the log entries of
+      the foods whose serving or nutrients changed are looked at, and the
+      difference is applied to their rows
+    * any other change to the log (another process, the raw data editor, a
+      download of new rows) changes its version (see
+      StorageBackend.version), and the table is built again. For logs the
+      backend stores in monthly partitions (see StorageBackend.partitions)
+      only the rows of the months whose partition changed are read and
+      aggregated again, so a new row costs a read of its month, not of the
+      whole log.
+
+    Backends that cannot tell the version of the log get a rebuild on every
+    read. The tables are kept in memory and shared by all sessions. Every
+    update builds a new table, which replaces the shared one only if that
+    is still the table it was built from, so two sessions that update at
+    the same time never apply the same change twice.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users: Dict[str, _UserAggregates] = {}
+
+    def daily(
+        self,
+        storage:StorageBackend,
+        user:str,
+        catalog:FoodCatalog,
+        date_range:Tuple[str, str]=None,
+    ) -> pd.DataFrame:
+        """
+        The totals of a user per day and meal.
+
+        Args:
+            storage (StorageBackend): The backend with the food log
+            user (str): The user, e.g. "bela"
+            catalog (FoodCatalog): The foods, see food_catalog
+            date_range (Tuple[str, str]): First and last date ("%Y-%m-%d")
+                to return, both inclusive. All dates if None.
+
+        Returns:
+            daily (pd.DataFrame): entries, grams, kcal, fat, carbs and
+                protein, indexed by date ("%Y-%m-%d") and meal, sorted.
+                Days without entries are left out.
+        """
+        sheet_name = f"food_log_{user}"
+        version = storage.version(sheet_name)
+        with self._lock:
+            aggregates = self._users.get(user)
+        if aggregates is None or version is None or aggregates.log_version != version:
+            updated = self._build(storage, sheet_name, catalog, version, aggregates)
+        elif aggregates.catalog is not catalog:
+            updated = self._update_foods(storage, sheet_name, aggregates, catalog)
+        else:
+            updated = aggregates
+
+        with self._lock:
+            # otherwise another session updated them first, keep theirs
+            if self._users.get(user) is aggregates:
+                self._users[user] = updated
+            daily = updated.daily
+        if date_range is not None:
+            # a binary search, the index is sorted
+            daily = daily.loc[date_range[0]:date_range[1]]
+        return daily.copy()
+
+    def totals(
+        self,
+        storage:StorageBackend,
+        user:str,
+        catalog:FoodCatalog,
+        date_range:Tuple[str, str]=None,
+    ) -> pd.DataFrame:
+        """
+        The totals of a user per day, all meals together.
+
+        Returns:
+            totals (pd.DataFrame): The columns of daily, indexed by date
+        """
+        return self.daily(storage, user, catalog, date_range).groupby(level="date").sum()
+
+    def append_rows(self, storage:StorageBackend, user:str, new_rows:pd.DataFrame) -> None:
+        """
+        Append rows to a user's food log and add them to the aggregates.
+        """
+        self._write(storage, user, new_rows, 1, lambda sheet_name: storage.append_rows(sheet_name, new_rows))
+
+    def delete_rows(self, storage:StorageBackend, user:str, rows:pd.DataFrame) -> None:
+        """
+        Delete rows from a user's food log and subtract them from the
+        aggregates.
+
+        Args:
+            rows (pd.DataFrame): The rows to delete, as loaded (indexed by
+                their position in the sheet)
+        """
+        self._write(storage, user, rows, -1, lambda sheet_name: storage.delete_rows(sheet_name, rows.index))
+
+    def invalidate(self, user:str=None) -> None:
+        """
+        Drop the aggregates of a user (all users if None), so they are built
+        again on their next read.
+        """
+        with self._lock:
+            if user is None:
+                self._users.clear()
+            else:
+                self._users.pop(user, None)
+
+    def _write(self, storage:StorageBackend, user:str, rows:pd.DataFrame, sign:int, write) -> None:
+        sheet_name = f"food_log_{user}"
+        before = storage.version(sheet_name)
+        write(sheet_name)
+        after = storage.version(sheet_name)
+        with self._lock:
+            aggregates = self._users.get(user)
+            if aggregates is None:
+                return
+            # the aggregates were not of the log the rows were written to
+            if before is None or after is None or aggregates.log_version != before:
+                del self._users[user]
+                return
+            delta = _aggregate(rows, aggregates.catalog)
+            self._users[user] = _UserAggregates(
+                _combine(aggregates.daily, delta, sign),
+                after,
+                aggregates.catalog,
+                None if aggregates.partitions is None else storage.partitions(sheet_name),
+            )
+
+    @staticmethod
+    def _build(
+        storage:StorageBackend,
+        sheet_name:str,
+        catalog:FoodCatalog,
+        version:Optional[Hashable],
+        previous:Optional[_UserAggregates],
+    ) -> _UserAggregates:
+        """
+        Build the aggregates of a log, reusing the months of previous whose
+        partition did not change.
+        """
+        partitions = storage.partitions(sheet_name)
+        if partitions is None:
+            daily = _aggregate(storage.load_google_sheet_data(sheet_name), catalog)
+            # known once the log is loaded, if the backend partitions it
+            partitions = storage.partitions(sheet_name)
+        elif previous is None or previous.partitions is None or previous.catalog is not catalog:
+            daily = _aggregate(storage.load_partitions(sheet_name, list(partitions)), catalog)
+        else:
+            from sheet_cache import SheetCache
+            changed = {
+                key for key in partitions.keys() | previous.partitions.keys()
+                if partitions.get(key) != previous.partitions.get(key)
+            }
+            log = storage.load_partitions(sheet_name, sorted(changed & partitions.keys()))
+            dates = previous.daily.index.get_level_values("date").to_series()
+            kept = previous.daily[~np.isin(SheetCache.partition_of(dates), list(changed))]
+            daily = _combine(kept, _aggregate(log, catalog), 1)
+        # changed while it was loaded, so it is not known which version log is
+        if storage.version(sheet_name) != version:
+            version, partitions = None, None
+        return _UserAggregates(daily, version, catalog, partitions)
+
+    @staticmethod
+    def _update_foods(
+        storage:StorageBackend,
+        sheet_name:str,
+        aggregates:_UserAggregates,
+        catalog:FoodCatalog,
+    ) -> _UserAggregates:
+        """
+        Apply a new version of food_data: recompute the entries of the foods
+        that changed and apply the difference.
+        """
+        changed = _changed_foods(aggregates.catalog, catalog)
+        if not changed:
+            return _UserAggregates(aggregates.daily, aggregates.log_version, catalog, aggregates.partitions)
+        if aggregates.partitions is None:
+            log = storage.load_google_sheet_data(sheet_name)
+        else:
+            log = storage.load_partitions(sheet_name, list(aggregates.partitions))
+        rows = log[log["name"].isin(changed)]
+        delta = _aggregate(rows, catalog).sub(_aggregate(rows, aggregates.catalog), fill_value=0)
+        version = aggregates.log_version
+        # changed while it was loaded, the next read builds the changed part again
+        if storage.version(sheet_name) != version:
+            version = None
+        return _UserAggregates(_combine(aggregates.daily, delta, 1), version, catalog, aggregates.partitions)
+
+
+def _aggregate(log:pd.DataFrame, catalog:FoodCatalog) -> pd.DataFrame:
+    """
+    The totals of log entries per date and meal. Entries of unknown foods
+    count as entries without nutrients.
+    """
+    facts = nutrition_facts(log, catalog).fillna(0)
+    facts.insert(0, "entries", 1)
+    if log.empty:
+        index = pd.MultiIndex.from_arrays([[], []], names=["date", "meal"])
+        return pd.DataFrame(columns=COLUMNS, index=index, dtype=float).astype({"entries": int})
+    keys = [log["date"].astype(str).rename("date"), log["meal"].astype(str).rename("meal")]
+    return facts[COLUMNS].groupby(keys).sum()
+
+
+def _combine(daily:pd.DataFrame, delta:pd.DataFrame, sign:int) -> pd.DataFrame:
+    """
+    Add (sign 1) or subtract (sign -1) delta from daily, dropping the
+    (date, meal) rows that are left without entries.
+    """
+    combined = daily.add(delta * sign, fill_value=0)
+    combined["entries"] = combined["entries"].round().astype(int)
+    return combined[combined["entries"] > 0].sort_index()
+
+
+def _changed_foods(old:FoodCatalog, new:FoodCatalog) -> Set[str]:
+    """
+    The foods whose serving weight or nutrients differ between two
+    catalogs, including foods that are only in one of them.
+    """
+    names = pd.Index(old.names).union(pd.Index(new.names))
+
+    def values(catalog:FoodCatalog) -> np.ndarray:
+        positions = catalog.positions(names)
+        columns = [catalog.serving_weights, *catalog.nutrients.values()]
+        table = np.column_stack([np.append(column, np.nan) for column in columns])
+        return table[np.where(positions >= 0, positions, len(catalog))]
+
+    before, after = values(old), values(new)
+    same = (before == after) | (np.isnan(before) & np.isnan(after))
+    return set(names[~same.all(axis=1)])
+
+
+aggregates = DailyAggregates()
@@ -0,0 +1,89 @@
+from datetime import datetime
+from typing import Iterable
+import numpy as np
+import pandas as pd
+
+# BMR multiplication factor per exercise level, see the Food page
+EXERCISE_FACTORS = {
+    0: 1.2,
+    1: 1.375,
+    2: 1.4625,
+    3: 1.55,
+    4: 1.725,
+    5: 1.9
+}
+SEX_CORRECTION = {
+    "M": 5,
+    "F": -161
+}
+
+
+def energy_burned(weight, height:float, birthday:pd.Timestamp, exercise_level:int, sex:str, on=None):
+    """
+    Energy burned per day (Mifflin-St Jeor BMR times the exercise factor),
+    in kcal.
+
+    Works on single values and on arrays: weight and on can be arrays of
+    the same length, to get the energy of many days at once.
+
+    Args:
+        weight (float | np.ndarray): Body weight in kg
+        height (float): Height in cm
+        birthday (pd.Timestamp): Date of birth
+        exercise_level (int): 0 (sedentary) to 5 (very intense exercise daily)
+        sex (str): "M" or "F"
+        on (datetime | pd.DatetimeIndex): The day(s) to compute the age
+            at, today if None
+
+    Returns:
+        energy (float | np.ndarray): kcal per day
+    """
+    on = datetime.today() if on is None else on
+    age = (on - birthday).days / 365
+    bmr = 10 * weight + 6.25 * height - 5 * np.asarray(age)
+    return (bmr + SEX_CORRECTION[sex]) * EXERCISE_FACTORS[exercise_level]
+
+
+def allowances(
+    dates:Iterable[str],
+    weight_log:pd.DataFrame,
+    info:pd.DataFrame,
+    target:float,
+    exercise_level:int,
+) -> pd.Series:
+    """
+    The kcal a user may eat on each of a number of days: the energy burned
+    on the day minus the target deficit.
+
+    The energy of a day uses the last weight logged on or before it (the
+    first weight for days before the first weigh-in) and the age on that
+    day, for all days in one vectorized pass.
+
+    Args:
+        dates (Iterable[str]): The days ("%Y-%m-%d"), sorted
+        weight_log (pd.DataFrame): The weight_log_<user> sheet
+        info (pd.DataFrame): The info_<user> sheet
+        target (float): The target deficit in kcal per day
+        exercise_level (int): See energy_burned
+
+    Returns:
+        allowances (pd.Series): kcal per day, indexed by the dates
+    """
+    dates = pd.Index(dates, name="date")
+    days = pd.DataFrame({"date": pd.to_datetime(dates).astype("datetime64[ns]")})
+    weights = pd.DataFrame({
+        "date": pd.to_datetime(weight_log["date"]).astype("datetime64[ns]"),
+        "weight": pd.to_numeric(weight_log["weight"], errors="coerce"),
+    }).dropna().sort_values("date")
+    weight = pd.merge_asof(days, weights, on="date", direction="backward")["weight"]
+    weight = weight.fillna(weights["weight"].iloc[0] if not weights.empty else np.nan)
+
+    energy = energy_burned(
+        weight.to_numpy(),
+        info["height"].values[0],
+        pd.to_datetime(info["birthday"].values[0]),
+        exercise_level,
+        info["sex"].values[0],
+        on=pd.DatetimeIndex(days["date"]),
+    )
+    return pd.Series(energy - target, index=dates)
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from typing import Dict
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Exclusive lock backed by a lock file, shared by threads and processes.
+
+    Streamlit can serve the app from several worker processes that share the
+    cache directory, so a threading lock alone does not keep them from
+    writing the same cache entry at the same time. The operating system lock
+    on the lock file does; it is released automatically if the process dies.
+
+    The lock is reentrant for the thread that holds it. Use file_lock() to
+    get the instance for a path, so that all threads of a process share it.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def acquire(self, blocking:bool=True, timeout:float=None) -> bool:
+        """
+        Acquire the lock.
+
+        Args:
+            blocking (bool): Wait for the lock if another thread or process
+                holds it
+            timeout (float): Maximum number of seconds to wait, use None to
+                wait as long as it takes
+
+        Returns:
+            acquired (bool): Whether the lock was acquired
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._lock.acquire(blocking, -1 if timeout is None or not blocking else timeout):
+            return False
+        if self._depth == 0:
+            try:
+                file = open(self.path, "a+b")
+            except OSError:
+                self._lock.release()
+                raise
+            while not self._try_lock(file):
+                if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                    file.close()
+                    self._lock.release()
+                    return False
+                time.sleep(0.05)
+            self._file = file
+        self._depth += 1
+        return True
+
+    def release(self) -> None:
+        """
+        Release the lock.
+        """
+        self._depth -= 1
+        if self._depth == 0:
+            self._unlock(self._file)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    @staticmethod
+    def _try_lock(file) -> bool:
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _unlock(file) -> None:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+_locks: Dict[str, FileLock] = {}
+_locks_lock = threading.Lock()
+
+
+def file_lock(path:str) -> FileLock:
+    """
+    Get the lock for a lock file, shared by all threads of the process.
+    """
+    path = os.path.abspath(path)
+    with _locks_lock:
+        if path not in _locks:
+            _locks[path] = FileLock(path)
+        return _locks[path]
@@ -0,0 +1,142 @@
+import threading
+from typing import Dict, Iterable, Optional
+import numpy as np
+import pandas as pd
+from storage import StorageBackend
+
+# columns of the food_data sheet with the nutrients per 100 g, by the names
+# the catalog (and nutrition_facts) gives them
+NUTRIENTS = {
+    "kcal": "Calories (kcal)",
+    "fat": "Fat (g)",
+    "carbs": "Carbs (g)",
+    "protein": "Protein (g)",
+}
+
+
+class FoodCatalog:
+    """
+    The food_data sheet, indexed for lookups by food name.
+
+    The pages look foods up on every rerun (the serving of the selected
+    food, its calories, the sorted names for a selectbox). Masks such as
+    df_food_data[df_food_data["Name"] == name] scan the whole sheet each
+    time; the catalog is built once per version of the sheet (see
+    food_catalog) and answers them from a name -> position dict and arrays.
+
+    Every food has a position, the order in which the foods first appear in
+    the sheet. If a name is in the sheet more than once, its first row is
+    used for the serving and nutrients. The arrays (serving_names,
+    serving_weights and nutrients) are indexed by position.
+
+    Attributes:
+        data (pd.DataFrame): The food_data sheet the catalog was built from,
+            do not modify it
+        names (np.ndarray): The food names, by position
+        sorted_names (List[str]): The food names in alphabetical order
+        serving_names (np.ndarray): The name of a serving of each food
+        serving_weights (np.ndarray): The grams in a serving of each food
+        nutrients (Dict[str, np.ndarray]): kcal, fat, carbs and protein per
+            100 g of each food
+        types (List[str]): The food types, in order of first appearance
+    """
+
+    def __init__(self, food_data:pd.DataFrame):
+        self.data = food_data
+        first = ~food_data["Name"].duplicated().to_numpy()
+        self.names = food_data["Name"].to_numpy(dtype=object)[first]
+        self.sorted_names = sorted(self.names, key=str)
+        self._index = pd.Index(self.names)
+        self._positions = {name: position for position, name in enumerate(self.names)}
+        # positions in the sheet of every row of each food, duplicates included
+        self._rows = {
+            name: rows for name, rows in food_data.groupby("Name", sort=False).indices.items()
+        }
+
+        def column(name:str) -> np.ndarray:
+            values = pd.to_numeric(food_data[name], errors="coerce").to_numpy(dtype=float)[first]
+            return np.ascontiguousarray(values)
+
+        self.serving_names = food_data["Serving Name"].to_numpy(dtype=object)[first]
+        self.serving_weights = column("Single Serving (g)")
+        self.nutrients = {nutrient: column(source) for nutrient, source in NUTRIENTS.items()}
+        self.types = list(food_data["Type"].dropna().unique()) if "Type" in food_data else []
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name:str) -> bool:
+        return name in self._positions
+
+    def position(self, name:str) -> int:
+        """
+        The position of a food.
+
+        Raises:
+            KeyError: If the food is not in the catalog
+        """
+        return self._positions[name]
+
+    def positions(self, names:Iterable[str]) -> np.ndarray:
+        """
+        The positions of many foods at once, -1 for foods that are not in
+        the catalog.
+        """
+        return self._index.get_indexer(names)
+
+    def serving_name(self, name:str) -> str:
+        """
+        The name of a serving of a food, e.g. "slice(s)".
+        """
+        return self.serving_names[self._positions[name]]
+
+    def serving_weight(self, name:str) -> float:
+        """
+        The grams in one serving of a food.
+        """
+        return self.serving_weights[self._positions[name]]
+
+    def per_100g(self, name:str) -> Dict[str, float]:
+        """
+        The kcal, fat, carbs and protein in 100 g of a food.
+        """
+        position = self._positions[name]
+        return {nutrient: values[position] for nutrient, values in self.nutrients.items()}
+
+    def rows(self, name:str) -> pd.DataFrame:
+        """
+        The rows of the sheet with a food, indexed by their position in the
+        sheet (so they can be passed to delete_rows). Empty if there are none.
+        """
+        return self.data.iloc[self._rows.get(name, [])]
+
+
+_lock = threading.Lock()
+_latest: Optional[tuple] = None # (version, catalog)
+
+
+def food_catalog(storage:StorageBackend) -> FoodCatalog:
+    """
+    Get the catalog of the food_data sheet.
+
+    The sheet is still loaded on every call, so the backend keeps it fresh
+    (e.g. refreshes it when it expired), but the catalog of its latest
+    version (see StorageBackend.version) is kept in memory and shared by all
+    sessions; it is only built again after the sheet changed. Backends that
+    cannot tell the version get a new catalog every time.
+    """
+    global _latest
+    version = storage.version("food_data")
+    data = storage.load_google_sheet_data("food_data")
+    # the sheet was downloaded or changed while it was loaded, so it is not
+    # known which version data is
+    if version is None or storage.version("food_data") != version:
+        return FoodCatalog(data)
+
+    with _lock:
+        if _latest is not None and _latest[0] == version:
+            return _latest[1]
+    catalog = FoodCatalog(data)
+    with _lock:
+        _latest = (version, catalog)
+    return catalog
@@ -0,0 +1,275 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Hashable, List, Mapping, Optional
+import numpy as np
+import pandas as pd
+from food_catalog import FoodCatalog
+from storage import StorageBackend
+
+
+class FoodSearchIndex:
+    """
+    Search index over the food names and types of a FoodCatalog.
+
+    The food pickers used to send every food name to the browser on each
+    rerun. With the index the page asks for the few foods that match what
+    the user typed, and only sends those.
+
+    A query is split in words (lowercase), and a food matches:
+
+    * by prefix, when every query word starts one of the words of its name
+      or type ("gr yog" finds "Greek Yoghurt"), looked up with a binary
+      search in the sorted list of all words
+    * fuzzily, when it shares enough trigrams with the query, so typos
+      ("yoghrt") still find it
+
+    Foods whose whole name starts with the query come first, then foods
+    matching every word, then partial and fuzzy matches. Within that order,
+    the foods a user logs most often rank higher (see food_counts).
+
+    Scoring works on arrays with one element per food of the catalog, so a
+    search over thousands of foods takes well under a millisecond.
+    """
+
+    min_similarity = 0.35 # share of the query's trigrams a fuzzy match needs
+    popularity_slots = 8 # counts whose popularity is kept, e.g. per user and for the recipes
+
+    def __init__(self, catalog:FoodCatalog):
+        self.catalog = catalog
+        self.names = [str(name) for name in catalog.names]
+        lower = [name.lower() for name in self.names]
+        data = catalog.data.drop_duplicates("Name")
+        types = data["Type"].fillna("").astype(str).tolist() if "Type" in data else [""] * len(lower)
+
+        # every word of every name and type, sorted, with the food it belongs to
+        words = []
+        for position, (name, food_type) in enumerate(zip(lower, types)):
+            for word in set(_words(name)) | set(_words(food_type)):
+                words.append((word, position))
+        words.sort()
+        self._words = [word for word, _ in words]
+        self._word_foods = np.array([position for _, position in words], dtype=np.int64)
+
+        # the lowercase names, sorted, to find the names that start with the query
+        order = np.argsort(np.array(lower, dtype=object), kind="stable")
+        self._sorted_names = [lower[position] for position in order]
+        self._sorted_positions = order.astype(np.int64)
+
+        # trigram -> the foods with it in their name
+        postings = defaultdict(list)
+        for position, name in enumerate(lower):
+            for trigram in _trigrams(name):
+                postings[trigram].append(position)
+        self._trigrams = {trigram: np.array(foods, dtype=np.int64) for trigram, foods in postings.items()}
+
+        self._alphabetical = np.empty(len(lower), dtype=np.float64)
+        self._alphabetical[order] = np.arange(len(lower))
+        self._lock = threading.Lock()
+        self._popularity_of: Dict[int, tuple] = {} # id(counts) -> (counts, popularity)
+
+    def search(self, query:str, counts:Mapping[str, int]=None, k:int=20) -> List[str]:
+        """
+        Find the foods that best match a query.
+
+        Args:
+            query (str): What the user typed, may be empty
+            counts (Mapping[str, int]): How often each food was logged or
+                used (see food_counts and ingredient_counts), used to rank
+                foods that match equally well
+            k (int): Maximum number of foods to return
+
+        Returns:
+            names (List[str]): At most k food names, best match first. For
+                an empty query the most logged foods, then alphabetically.
+        """
+        n = len(self.names)
+        if n == 0 or k <= 0:
+            return []
+        words = _words(query)
+        popularity = self._popularity(counts)
+
+        if not words:
+            score = popularity
+            candidates = np.arange(n)
+        else:
+            matched = np.zeros(n, dtype=np.int64)
+            for word in words:
+                matched += self._prefix_matches(word)
+            start = bisect_left(self._sorted_names, query.strip().lower())
+            end = bisect_left(self._sorted_names, query.strip().lower() + "\uffff")
+            name_prefix = np.zeros(n, dtype=bool)
+            name_prefix[self._sorted_positions[start:end]] = True
+
+            similarity = self._similarity(query.lower())
+            score = (
+                4. * name_prefix
+                + 2. * (matched == len(words))
+                + matched / len(words)
+                + similarity
+                + popularity
+            )
+            candidates = np.flatnonzero((matched > 0) | (similarity >= self.min_similarity))
+            if len(candidates) == 0:
+                return []
+
+        # ties are broken alphabetically
+        candidate_score = score[candidates] - self._alphabetical[candidates] / (n + 1) * 1e-6
+        if len(candidates) > k:
+            top = np.argpartition(-candidate_score, k - 1)[:k]
+            candidates, candidate_score = candidates[top], candidate_score[top]
+        ranked = candidates[np.argsort(-candidate_score, kind="stable")]
+        return [self.names[position] for position in ranked]
+
+    def _prefix_matches(self, word:str) -> np.ndarray:
+        """
+        1 for the foods with a word of their name or type starting with
+        word, 0 for all others.
+        """
+        start = bisect_left(self._words, word)
+        end = bisect_left(self._words, word + "\uffff")
+        matches = np.zeros(len(self.names), dtype=np.int64)
+        matches[self._word_foods[start:end]] = 1
+        return matches
+
+    def _similarity(self, query:str) -> np.ndarray:
+        """
+        The share of the query's trigrams that each food's name has.
+        """
+        trigrams = _trigrams(query)
+        postings = [self._trigrams[trigram] for trigram in trigrams if trigram in self._trigrams]
+        if not postings:
+            return np.zeros(len(self.names))
+        shared = np.bincount(np.concatenate(postings), minlength=len(self.names))
+        return shared / len(trigrams)
+
+    def _popularity(self, counts:Optional[Mapping[str, int]]) -> np.ndarray:
+        """
+        A boost between 0 and 1 for each food, growing with the log of how
+        often it was logged.
+        """
+        if not counts:
+            return np.zeros(len(self.names))
+        with self._lock:
+            cached = self._popularity_of.get(id(counts))
+        if cached is not None and cached[0] is counts:
+            return cached[1]
+        popularity = np.zeros(len(self.names))
+        series = pd.Series(counts, dtype=float)
+        positions = self.catalog.positions(series.index)
+        found = positions >= 0
+        popularity[positions[found]] = np.log1p(series.to_numpy()[found])
+        top = popularity.max()
+        if top > 0:
+            popularity /= top
+        # food_counts and ingredient_counts return the same dict until their
+        # sheet changes; several are in use at once (the users, the recipes)
+        with self._lock:
+            self._popularity_of[id(counts)] = (counts, popularity)
+            while len(self._popularity_of) > self.popularity_slots:
+                del self._popularity_of[next(iter(self._popularity_of))]
+        return popularity
+
+
+def _words(text:str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def _trigrams(text:str) -> set:
+    text = f"  {' '.join(_words(text))} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+_lock = threading.Lock()
+_index: Optional[FoodSearchIndex] = None
+_counts: Dict[str, "_Counts"] = {} # sheet name -> counts of its latest version
+
+
+def search_index(catalog:FoodCatalog) -> FoodSearchIndex:
+    """
+    Get the search index of a catalog, built once per catalog (so once per
+    version of food_data, see food_catalog) and shared by all sessions.
+    """
+    global _index
+    with _lock:
+        if _index is not None and _index.catalog is catalog:
+            return _index
+    index = FoodSearchIndex(catalog)
+    with _lock:
+        _index = index
+    return index
+
+
+class _Counts:
+    """
+    How often each value of a column occurs in a sheet, and what it was
+    counted from.
+    """
+
+    def __init__(
+        self,
+        counts:Dict[str, int],
+        version:Hashable,
+        partitions:Optional[Dict[str, Hashable]],
+        by_partition:Optional[Dict[str, pd.Series]],
+    ):
+        self.counts = counts
+        self.version = version
+        # versions of the sheet's partitions and the counts of each, see
+        # StorageBackend.partitions
+        self.partitions = partitions
+        self.by_partition = by_partition
+
+
+def food_counts(storage:StorageBackend, user:str) -> Dict[str, int]:
+    """
+    How often a user logged each food, counted again only when their food
+    log changed (see StorageBackend.version), and then only in the months
+    that changed if the backend stores the log in partitions.
+    """
+    return _value_counts(storage, f"food_log_{user}", "name")
+
+
+def ingredient_counts(storage:StorageBackend) -> Dict[str, int]:
+    """
+    How often each food is used as a recipe ingredient, counted again only
+    when recipe_ingredients changed.
+    """
+    return _value_counts(storage, "recipe_ingredients", "ingredient")
+
+
+def _value_counts(storage:StorageBackend, sheet_name:str, column:str) -> Dict[str, int]:
+    """
+    The counts of the values of a column of a sheet. The same dict is
+    returned until the sheet changes, see FoodSearchIndex._popularity.
+    """
+    version = storage.version(sheet_name)
+    with _lock:
+        cached = _counts.get(sheet_name)
+    if version is not None and cached is not None and cached.version == version:
+        return cached.counts
+
+    partitions = storage.partitions(sheet_name)
+    if partitions is None:
+        by_partition = None
+        counts = storage.load_google_sheet_data(sheet_name)[column].value_counts().to_dict()
+    else:
+        from sheet_cache import SheetCache
+        known = cached.by_partition if cached is not None and cached.by_partition is not None else {}
+        changed = [
+            key for key in partitions
+            if key not in known or partitions[key] != cached.partitions.get(key)
+        ]
+        by_partition = {key: counts for key, counts in known.items() if key in partitions and key not in changed}
+        rows = storage.load_partitions(sheet_name, changed)
+        # only the food logs are partitioned, by date
+        for key, partition in rows.groupby(SheetCache.partition_of(rows["date"])):
+            by_partition[key] = partition[column].value_counts()
+        total = pd.concat(list(by_partition.values())) if by_partition else pd.Series(dtype=int)
+        counts = total.groupby(level=0).sum().astype(int).to_dict()
+
+    if version is not None and storage.version(sheet_name) == version:
+        with _lock:
+            _counts[sheet_name] = _Counts(counts, version, partitions, by_partition)
+    return counts
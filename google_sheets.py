@@ -1,21 +1,176 @@
+from __future__ import annotations
 import streamlit as st
 import pandas as pd
-import gspread
-from gspread import Client
-import oauth2client
-from oauth2client import crypt
-from typing import List
-from oauth2client.service_account import ServiceAccountCredentials
+import numpy as np
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 import os
+import threading
+import time
+from instrumentation import lazy_import, step
+from metrics import metrics
+from sheet_cache import SheetCache
+from storage import StaleRowsError, StorageBackend
+from background_refresh import refresher
+from quota import api_error, governor
+from write_behind import write_queue
 
+# gspread and oauth2client take a while to import and are only needed for
+# API calls, so they are imported on first use (see lazy_import)
+if TYPE_CHECKING:
+    from gspread import Client, Spreadsheet, Worksheet
+    from oauth2client.service_account import ServiceAccountCredentials
 
-class GoogleSheetsInterface:
+
+class SheetHandles:
+    """
+    Process-wide registry of Google Sheets handles.
+
+    Streamlit re-runs every page script on each interaction, but imported
+    modules are only loaded once per process. Keeping the authorized client,
+    the opened spreadsheet and the worksheet objects here means they are
+    created once and then shared by every session and rerun, so a read or
+    write only costs the API call that moves the data.
+    """
+
+    def __init__(self):
+        # only held to read and store handles, never during an API call, so
+        # a slow or throttled request does not block sessions whose handles
+        # are already cached
+        self._lock = threading.Lock()
+        self._client = None
+        self._spreadsheets: Dict[str, Spreadsheet] = {}
+        self._worksheets: Dict[str, Dict[str, Worksheet]] = {}
+        self._revisions: Dict[str, Tuple[float, str]] = {}
+
+    def client(self, factory:Callable[[], Client]) -> Client:
+        """
+        Get the shared client, creating it with factory on first use.
+
+        The client keeps its credentials and access token, and its session
+        only requests a new token when the current one is about to expire,
+        so the credentials are parsed and authorized once per process.
+
+        Threads that miss at the same time each create a client, and the
+        first one stored is kept (and returned to all of them).
+        """
+        with self._lock:
+            if self._client is not None:
+                return self._client
+        with step("authorize"):
+            client = factory()
+        with self._lock:
+            if self._client is None:
+                self._client = client
+            return self._client
+
+    def spreadsheet(self, client:Client, url:str) -> Spreadsheet:
+        """
+        Get the opened spreadsheet for url (one metadata call on first use).
+        """
+        with self._lock:
+            if url in self._spreadsheets:
+                return self._spreadsheets[url]
+        spreadsheet = governor.call(lambda: client.open_by_url(url), key=("open", url))
+        with self._lock:
+            return self._spreadsheets.setdefault(url, spreadsheet)
+
+    def worksheet(self, client:Client, url:str, sheet_name:str) -> Worksheet:
+        """
+        Get the worksheet called sheet_name.
+
+        On a miss all worksheets of the spreadsheet are listed at once, so
+        the other sheets of the document are resolved by the same call.
+
+        Raises:
+            WorksheetNotFound: If the spreadsheet has no sheet called sheet_name
+        """
+        with self._lock:
+            worksheets = self._worksheets.get(url, {})
+            if sheet_name in worksheets:
+                return worksheets[sheet_name]
+
+        spreadsheet = self.spreadsheet(client, url)
+        listed = {sheet.title: sheet for sheet in governor.call(spreadsheet.worksheets, key=("worksheets", url))}
+        with self._lock:
+            worksheets = self._worksheets.setdefault(url, {})
+            # keep handles another thread stored in the meantime
+            for title, sheet in listed.items():
+                worksheets.setdefault(title, sheet)
+            if sheet_name not in worksheets:
+                raise lazy_import("gspread.exceptions").WorksheetNotFound(sheet_name)
+            return worksheets[sheet_name]
+
+    def revision(self, client:Client, url:str, max_age:float) -> str:
+        """
+        Get the revision of a spreadsheet: its modifiedTime in Drive.
+
+        The result is reused for max_age seconds, so the sheets loaded by
+        one page run share a single check.
+        """
+        with self._lock:
+            checked_at, revision = self._revisions.get(url, (None, None))
+        if checked_at is not None and time.monotonic() - checked_at <= max_age:
+            return revision
+
+        spreadsheet = self.spreadsheet(client, url)
+        revision = governor.call(spreadsheet.get_lastUpdateTime, key=("revision", url))
+        with self._lock:
+            self._revisions[url] = (time.monotonic(), revision)
+        return revision
+
+    def invalidate(self, sheet_name:str=None) -> None:
+        """
+        Forget cached worksheet handles.
+
+        Args:
+            sheet_name (str): Only forget this worksheet. If None, all
+                worksheet handles and revisions are dropped (the client is
+                kept).
+        """
+        with self._lock:
+            if sheet_name is None:
+                self._worksheets.clear()
+                self._revisions.clear()
+                return
+            for worksheets in self._worksheets.values():
+                worksheets.pop(sheet_name, None)
+
+
+handles = SheetHandles()
+
+
+class GoogleSheetsInterface(StorageBackend):
 
     cache_path = "cache/gsheets"
+    cache_ttl = 60 # 1 minute, expired sheets are revalidated (see _revalidate)
+    cache_max_stale = 60*60*24 # 1 day
+    revision_ttl = 10 # seconds a revision check is reused for
+    # sheets that only grow at the end, refreshed by downloading new rows only
+    append_only_prefixes = ("food_log_", "weight_log_")
+    tail_rows = 5 # rows compared to detect edits in append-only sheets
+    # edits to earlier rows are not seen by incremental refreshes, so
+    # append-only sheets are downloaded in full again after this long
+    full_refresh_interval = 60*60 # 1 hour
+    # queue writes and flush them in the background (see write_behind.py)
+    write_behind = os.environ.get("HEALTH_TRACKER_WRITE_BEHIND", "0") == "1"
 
     def __init__(self):
-        self.client = self._get_client()
         self.url = st.secrets["connections"]["gsheets"]["spreadsheet"]
+        self.cache = SheetCache(self.cache_path)
+        # also started without write-behind, to flush ops left in the journal
+        # by earlier processes. A sheet with an op that was given up on is
+        # downloaded again, its cached copy still has the op applied.
+        write_queue.start(self._send_ops, on_dead_letter=self.cache.remove)
+
+    @property
+    def client(self) -> Client:
+        """
+        The authorized client, shared by the whole process.
+
+        It is only created on the first API call, so reruns that are served
+        from the cache do not parse the private key or authorize at all.
+        """
+        return handles.client(self._get_client)
 
     def load_google_sheet_data(self, sheet_name:str) -> pd.DataFrame:
         """
@@ -24,8 +179,13 @@ class GoogleSheetsInterface:
         The Google Sheets API has a limit of 60 requests per minute. Each time
         a dropdown is changed in the Streamlit app, this method is called for
         each dataset. This can cause the limit to be reached. To prevent this
-        the data is stored in a csv file and only downloaded again if the file
-        is older than 3 minutes.
+        the data is stored in the cache (see SheetCache) and only downloaded
+        again if it is older than cache_ttl.
+
+        Expired data is still returned right away (stale-while-revalidate) and
+        the sheet is downloaded again on a background thread. Only data that
+        is older than cache_max_stale, or not cached at all, is downloaded
+        while the caller waits.
 
         Args:
             sheet_name (str): The name of the sheet in the Google Sheet document
@@ -33,29 +193,105 @@ class GoogleSheetsInterface:
         Returns:
             data(pd.DataFrame): The data from the Google Sheet as a pandas DataFrame
         """
-        # check if file exists
-        if os.path.exists(f"{self.cache_path}/{sheet_name}.csv"):
-            # check how old the file is
-            file_creation_time = os.path.getctime(f"{self.cache_path}/{sheet_name}.csv")
-            current_time = pd.Timestamp.now().timestamp()
-            elapsed_time = current_time - file_creation_time # miliseconds
+        data = self._load_from_cache([sheet_name])
+        if sheet_name in data:
+            return data[sheet_name]
+
+        start = time.perf_counter()
+        # queued writes have to reach the sheet before it is downloaded
+        write_queue.flush(sheet_name)
+        # if the file is too old, download the data from Google Sheets
+        data = self._fill([sheet_name])[sheet_name]
+        self._record_load(sheet_name, "miss", start, len(data))
+        return data
+
+    def load_many(self, sheet_names:List[str]) -> Dict[str, pd.DataFrame]:
+        """
+        Load data from several Google Sheets at once.
 
-            limit = 60*5 # 5 minutes
-            limit += 3600 # 1 hour (daylight saving time or timezone difference)
+        Sheets that are cached are read from the cache (expired ones are
+        refreshed in the background, see load_google_sheet_data), all others
+        are downloaded with a single batched request. A page that needs five
+        sheets therefore costs one API call (and one round-trip) on a cold
+        cache instead of five.
 
-            # if the file is not too old, use return data from file
-            if  elapsed_time < limit:
-                return pd.read_csv(f"{self.cache_path}/{sheet_name}.csv")
+        Args:
+            sheet_names (List[str]): The names of the sheets in the Google Sheet document
 
-        print(f"API Call: {sheet_name}")
-        # if the file is too old, download the data from Google Sheets
-        sheet = self.client.open_by_url(self.url).worksheet(sheet_name)
-        data = pd.DataFrame(sheet.get_all_records())
+        Returns:
+            data (Dict[str, pd.DataFrame]): The data of each sheet, by sheet name
+        """
+        data = self._load_from_cache(sheet_names)
+        missing = [sheet_name for sheet_name in dict.fromkeys(sheet_names) if sheet_name not in data]
+
+        if missing:
+            start = time.perf_counter()
+            # queued writes have to reach the sheets before they are downloaded
+            for sheet_name in missing:
+                write_queue.flush(sheet_name)
+            data.update(self._fill(missing))
+            for sheet_name in missing:
+                self._record_load(sheet_name, "miss", start, len(data[sheet_name]))
 
-        # store the data in a csv file
-        if os.path.exists(f"{self.cache_path}/{sheet_name}.csv"):
-            os.remove(f"{self.cache_path}/{sheet_name}.csv")
-        data.to_csv(f"{self.cache_path}/{sheet_name}.csv", index=False)
+        return data
+
+    def query(self, sheet_name:str, date_range:Tuple[str, str]=None, **filters) -> pd.DataFrame:
+        """
+        Load the rows of a sheet that match the filters (see
+        StorageBackend.query).
+
+        For sheets the cache stores in monthly partitions (the food logs),
+        a date or date_range filter only reads the months it covers, so
+        selecting one day does not depend on the length of the log.
+
+        Args:
+            sheet_name (str): The name of the sheet in the Google Sheet document
+            date_range (Tuple[str, str]): First and last date to select
+            **filters: Column names and the values to select
+
+        Returns:
+            data (pd.DataFrame): The matching rows, indexed by position
+        """
+        partitions = None
+        if date_range is not None:
+            partitions = self.cache.partition_keys(*date_range)
+        elif "date" in filters:
+            partitions = self.cache.partition_keys(filters["date"], filters["date"])
+
+        data = self._load_from_cache([sheet_name], partitions=partitions).get(sheet_name)
+        if data is None:
+            start = time.perf_counter()
+            write_queue.flush(sheet_name)
+            data = self._fill([sheet_name])[sheet_name]
+            self._record_load(sheet_name, "miss", start, len(data))
+        return self._filter(data, date_range, filters)
+
+    def version(self, sheet_name:str) -> Optional[int]:
+        """
+        The version of the cached data of a sheet (see SheetCache), which
+        changes with every download and write.
+        """
+        return (self.cache.metadata(sheet_name) or {}).get("version")
+
+    def partitions(self, sheet_name:str) -> Optional[Dict[str, int]]:
+        """
+        The version of each partition of a cached sheet (see SheetCache),
+        which changes with every download and every write to the partition.
+        """
+        metadata = self.cache.metadata(sheet_name)
+        if metadata is None or "partitions" not in metadata:
+            return None
+        return {key: partition["version"] for key, partition in metadata["partitions"].items()}
+
+    def load_partitions(self, sheet_name:str, keys:List[str]) -> pd.DataFrame:
+        """
+        Load the rows of some partitions of a sheet (see partitions). Only
+        those partitions are read from the cache, like query does.
+        """
+        data = self._load_from_cache([sheet_name], partitions=keys).get(sheet_name)
+        if data is None:
+            data = self.load_google_sheet_data(sheet_name)
+            data = data[np.isin(self.cache.partition_of(data[self.cache.partition_column(sheet_name)]), keys)]
         return data
 
     def update_google_sheet(self, sheet_name:str, updated_data:pd.DataFrame) -> None:
@@ -78,13 +314,633 @@ class GoogleSheetsInterface:
             updated_data (pd.DataFrame): The updated data (old data + new data)
                 to be uploaded to the Google Sheet
         """
-        sheet = self.client.open_by_url(self.url).worksheet(sheet_name)
-        sheet.clear()
-        sheet.update([updated_data.columns.values.tolist()] + updated_data.values.tolist())
+        start = time.perf_counter()
+        # queued writes first, they are already part of updated_data
+        write_queue.flush(sheet_name)
+
+        values = [updated_data.columns.values.tolist()] + updated_data.values.tolist()
+        def write(sheet):
+            sheet.clear()
+            sheet.update(values)
+        self._call(sheet_name, write)
+
+        # remove the cached sheet to force download from Google Sheets
+        self.cache.remove(sheet_name)
+        self._record_write(sheet_name, "replace", start, values)
+
+    def append_rows(self, sheet_name:str, new_rows:pd.DataFrame) -> None:
+        """
+        Append rows to the end of a Google Sheet.
+
+        Only the new rows are sent, in a single append call, so the cost of
+        logging an item does not grow with the length of the sheet. The
+        columns of new_rows are put in the same order as the cached sheet.
+
+        Args:
+            sheet_name (str): The name of the sheet in the Google Sheet document
+            new_rows (pd.DataFrame): The rows to add to the sheet
+        """
+        start = time.perf_counter()
+        columns = self._cached_columns(sheet_name)
+        if columns is not None:
+            new_rows = new_rows.reindex(columns=columns)
+
+        values = self._to_values(new_rows)
+        if self.write_behind:
+            write_queue.enqueue(sheet_name, {"op": "append", "rows": values})
+        else:
+            self._call(sheet_name, lambda sheet: sheet.append_rows(values))
+
+        self.cache.append(sheet_name, new_rows)
+        self._record_write(sheet_name, "append", start, values)
+
+    def update_rows(self, sheet_name:str, rows:pd.DataFrame) -> None:
+        """
+        Overwrite existing rows of a Google Sheet.
+
+        The index of rows is the position of each row in the DataFrame
+        returned by load_google_sheet_data (so index 0 is the first row below
+        the header). All changed rows are sent in a single batch update,
+        after checking the positions are still valid (see _check_positions).
+
+        Args:
+            sheet_name (str): The name of the sheet in the Google Sheet document
+            rows (pd.DataFrame): The changed rows with all columns, indexed by
+                row position
+        """
+        if rows.empty:
+            return
+        start = time.perf_counter()
+        self._check_positions(sheet_name, list(rows.index))
+        columns = self._cached_columns(sheet_name)
+        if columns is not None:
+            rows = rows.reindex(columns=columns)
+
+        values = self._to_values(rows)
+        if self.write_behind:
+            write_queue.enqueue(sheet_name, {
+                "op": "update",
+                "indices": [int(index) for index in rows.index],
+                "rows": values,
+            })
+        else:
+            last_column = lazy_import("gspread.utils").rowcol_to_a1(1, len(rows.columns)).rstrip("1")
+            data = [
+                {
+                    "range": f"A{index + 2}:{last_column}{index + 2}",
+                    "values": [row_values],
+                }
+                for index, row_values in zip(rows.index, values)
+            ]
+            self._call(sheet_name, lambda sheet: sheet.batch_update(data))
+
+        self.cache.update_rows(sheet_name, rows)
+        self._record_write(sheet_name, "update", start, values)
+
+    def delete_rows(self, sheet_name:str, indices:List[int]) -> None:
+        """
+        Delete rows from a Google Sheet.
+
+        The indices are row positions in the DataFrame returned by
+        load_google_sheet_data. All rows are removed in a single batch
+        update (see _op_requests), after checking the positions are still
+        valid (see _check_positions).
+
+        Args:
+            sheet_name (str): The name of the sheet in the Google Sheet document
+            indices (List[int]): Positions of the rows to delete
+        """
+        indices = sorted(set(int(index) for index in indices), reverse=True)
+        if not indices:
+            return
+        start = time.perf_counter()
+        self._check_positions(sheet_name, indices)
+
+        op = {"op": "delete", "indices": indices}
+        if self.write_behind:
+            write_queue.enqueue(sheet_name, op)
+        else:
+            self._send_ops(sheet_name, [op])
+
+        self.cache.delete_rows(sheet_name, indices)
+        self._record_write(sheet_name, "delete", start)
+
+    def pending_writes(self) -> dict:
+        """
+        Status of the write-behind queue, see WriteBehindQueue.status.
+        """
+        return write_queue.status()
+
+    def _check_positions(self, sheet_name:str, indices:List[int]) -> None:
+        """
+        Make sure the rows at the given positions of the cached sheet are
+        still at those positions in Google Sheets, before writing to them
+        by position.
+
+        Cached data can be up to cache_max_stale old. If the spreadsheet did
+        not change since the sheet was downloaded (same revision, see
+        _revalidate), the positions are valid. Otherwise (usually because of
+        an earlier write) queued writes are flushed and the rows are read
+        from Google Sheets and compared with the cached ones. If they
+        differ, rows were added, removed or changed by someone else: the
+        cached sheet is removed, so it is downloaded again, and
+        StaleRowsError is raised. If the revision cannot be read the write
+        goes ahead unchecked, as it did before the check existed.
+        """
+        metadata = self.cache.metadata(sheet_name)
+        if metadata is None:
+            raise StaleRowsError(f"{sheet_name} is no longer cached, load it again")
+        revision = self._revision()
+        if revision is None or revision == metadata["revision"]:
+            return
+
+        write_queue.flush(sheet_name)
+        cached = self.cache.read(sheet_name)
+        if cached is None:
+            raise StaleRowsError(f"{sheet_name} is no longer cached, load it again")
+        utils = lazy_import("gspread.utils")
+        last_column = utils.rowcol_to_a1(1, max(len(cached.columns), 1)).rstrip("1")
+        ranges = [utils.absolute_range_name(sheet_name, f"A{index + 2}:{last_column}{index + 2}") for index in indices]
+        spreadsheet = handles.spreadsheet(self.client, self.url)
+        response = governor.call(lambda: spreadsheet.values_batch_get(ranges), key=("batch_get", tuple(ranges)))
+        rows = [value_range.get("values", [[]])[0] for value_range in response["valueRanges"]]
+        current = self._values_to_frame([[str(column) for column in cached.columns]] + rows)
+
+        expected = cached.reindex(pd.Index(indices, dtype="int64"))
+        if len(current) != len(expected) or SheetCache.rows_checksum(current) != SheetCache.rows_checksum(expected):
+            self.cache.remove(sheet_name)
+            raise StaleRowsError(f"Rows of {sheet_name} changed in Google Sheets since it was loaded")
 
-        # remove sheet_name.csv file to force download from Google Sheets
-        if os.path.exists(f"{self.cache_path}/{sheet_name}.csv"):
-            os.remove(f"{self.cache_path}/{sheet_name}.csv")
+    def _send_ops(self, sheet_name:str, ops:List[dict]) -> None:
+        """
+        Write a list of queued ops (see WriteBehindQueue) to a sheet in a
+        single batch update.
+        """
+        def send(sheet):
+            requests = []
+            for op in ops:
+                requests.extend(self._op_requests(sheet.id, op))
+            sheet.spreadsheet.batch_update({"requests": requests})
+        self._call(sheet_name, send)
+
+    @classmethod
+    def _op_requests(cls, sheet_id:int, op:dict) -> List[dict]:
+        """
+        Translate an op into batch update requests for the Sheets API.
+
+        Deleted rows are grouped into contiguous ranges, which are removed
+        bottom-up so earlier deletions do not shift the rows of later ones.
+        """
+        if op["op"] == "append":
+            return [{
+                "appendCells": {
+                    "sheetId": sheet_id,
+                    "rows": [cls._row_data(values) for values in op["rows"]],
+                    "fields": "userEnteredValue",
+                }
+            }]
+
+        if op["op"] == "update":
+            return [
+                {
+                    "updateCells": {
+                        "start": {"sheetId": sheet_id, "rowIndex": index + 1, "columnIndex": 0},
+                        "rows": [cls._row_data(values)],
+                        "fields": "userEnteredValue",
+                    }
+                }
+                for index, values in zip(op["indices"], op["rows"])
+            ]
+
+        # group into contiguous runs, e.g. [9, 8, 7, 3] -> [(7, 10), (3, 4)]
+        runs = []
+        for index in sorted(op["indices"], reverse=True):
+            if runs and runs[-1][0] == index + 1:
+                runs[-1][0] = index
+            else:
+                runs.append([index, index + 1])
+        return [
+            {
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": sheet_id,
+                        "dimension": "ROWS",
+                        "startIndex": start + 1, # skip header row
+                        "endIndex": end + 1,
+                    }
+                }
+            }
+            for start, end in runs
+        ]
+
+    @staticmethod
+    def _row_data(values:list) -> dict:
+        """
+        Convert a row of values to the RowData format of the Sheets API.
+        """
+        cells = []
+        for value in values:
+            if isinstance(value, bool):
+                cells.append({"userEnteredValue": {"boolValue": value}})
+            elif isinstance(value, (int, float)):
+                cells.append({"userEnteredValue": {"numberValue": value}})
+            elif value == "" or value is None:
+                cells.append({})
+            else:
+                cells.append({"userEnteredValue": {"stringValue": str(value)}})
+        return {"values": cells}
+
+    def _call(self, sheet_name:str, request:Callable[[Worksheet], object], key=None):
+        """
+        Run an API request against the cached handle of a worksheet.
+
+        The request goes through the shared rate governor (see quota.py),
+        which keeps within the API quota and retries on 429 errors.
+
+        If the sheet was renamed or deleted since its handle was cached, the
+        request fails on the stale handle. In that case the handle is
+        resolved again and the request is retried once, which raises
+        WorksheetNotFound if the sheet no longer exists.
+
+        Args:
+            sheet_name (str): The name of the sheet in the Google Sheet document
+            request (Callable[[Worksheet], object]): The API request to run
+            key (Hashable): Key to coalesce concurrent identical reads on,
+                None for writes
+
+        Returns:
+            The return value of request
+        """
+        sheet = handles.worksheet(self.client, self.url, sheet_name)
+        try:
+            return governor.call(lambda: request(sheet), key=key)
+        except api_error() as e:
+            # 400 "Unable to parse range" / "No grid with id": stale handle
+            if e.response.status_code != 400:
+                raise
+        handles.invalidate(sheet_name)
+        sheet = handles.worksheet(self.client, self.url, sheet_name)
+        return governor.call(lambda: request(sheet), key=key)
+
+    @staticmethod
+    def _values_to_frame(values:List[list]) -> pd.DataFrame:
+        """
+        Convert raw sheet values (header row + data rows) to a DataFrame.
+
+        Numbers are parsed the same way gspread's get_all_records does, but
+        without the extra header request that get_all_records makes.
+        """
+        if not values:
+            return pd.DataFrame()
+        utils = lazy_import("gspread.utils")
+        header, rows = values[0], values[1:]
+        rows = utils.fill_gaps(rows, cols=len(header)) if rows else []
+        records = [utils.numericise_all(row[:len(header)]) for row in rows]
+        return pd.DataFrame(records, columns=header)
+
+    def _load_from_cache(self, sheet_names:List[str], partitions:List[str]=None) -> Dict[str, pd.DataFrame]:
+        """
+        Read the sheets that can be served from the cache.
+
+        Sheets older than cache_ttl (but not older than cache_max_stale) are
+        returned as well, and scheduled for a background refresh. Sheets
+        older than cache_max_stale are only returned if the spreadsheet has
+        not changed since they were downloaded (see _revalidate). Sheets with
+        queued writes are always served from the cache, since it already
+        contains those writes and the sheet does not yet.
+
+        Args:
+            sheet_names (List[str]): The names of the sheets in the Google Sheet document
+            partitions (List[str]): Only read these partitions of partitioned
+                sheets (see SheetCache.read)
+
+        Returns:
+            data (Dict[str, pd.DataFrame]): The cached data, by sheet name.
+                Sheets that have to be downloaded first are left out.
+        """
+        data = {}
+        expired = []
+        for sheet_name in dict.fromkeys(sheet_names):
+            start = time.perf_counter()
+            metadata = self.cache.metadata(sheet_name)
+            if metadata is None:
+                continue
+            age = self.cache.age(metadata)
+            pending = write_queue.has_pending(sheet_name)
+            if age > self.cache_max_stale and not pending:
+                if not self._revalidate([sheet_name]):
+                    continue
+                age = 0
+            cached = self.cache.read(sheet_name, partitions=partitions)
+            if cached is None:
+                continue
+            stale = age > self.cache_ttl and not pending
+            if stale:
+                expired.append(sheet_name)
+            data[sheet_name] = cached
+            self._record_load(sheet_name, "stale" if stale else "hit", start, metadata["rows"])
+
+        if expired:
+            refresher.submit(expired, self._refresh)
+        return data
+
+    def _fill(self, sheet_names:List[str]) -> Dict[str, pd.DataFrame]:
+        """
+        Download sheets that are missing from the cache (or too stale to use).
+
+        Only one thread or process downloads a sheet at a time (see
+        SheetCache.fill_lock). If another one is already downloading it, its
+        stale copy is used if there is one; otherwise this waits for the
+        download and reads the result from the cache.
+
+        Returns:
+            data (Dict[str, pd.DataFrame]): The data of each sheet, by sheet name
+        """
+        data = {}
+        locks = []
+        try:
+            # sorted, so two callers never wait for each other's locks
+            for sheet_name in sorted(sheet_names):
+                lock = self.cache.fill_lock(sheet_name)
+                if not lock.acquire(blocking=False):
+                    stale = self.cache.read(sheet_name)
+                    if stale is not None:
+                        data[sheet_name] = stale
+                        continue
+                    lock.acquire()
+                locks.append(lock)
+
+            missing = []
+            for sheet_name in sheet_names:
+                if sheet_name in data:
+                    continue
+                # downloaded by someone else while waiting for the lock
+                cached = self.cache.read(sheet_name, max_age=self.cache_ttl)
+                if cached is not None:
+                    data[sheet_name] = cached
+                else:
+                    missing.append(sheet_name)
+
+            if missing:
+                print(f"API Call: {', '.join(missing)}")
+                revision, frames = self._fetch_many(missing)
+                for sheet_name, frame in frames.items():
+                    data[sheet_name] = self.cache.write(sheet_name, frame, revision=revision)
+        finally:
+            for lock in locks:
+                lock.release()
+        return data
+
+    def _refresh(self, sheet_names:List[str]) -> None:
+        """
+        Download sheets again and swap them into the cache.
+
+        Runs on a background thread. Sheets are only downloaded if the
+        spreadsheet changed since they were cached (see _revalidate). A sheet
+        that was changed locally (e.g. by append_rows) while it was
+        downloading is not overwritten, since the downloaded data could be
+        missing that change.
+
+        Sheets that another thread or process is already downloading are
+        skipped, as are sheets it refreshed in the meantime.
+
+        Append-only sheets (the logs) are refreshed incrementally, see
+        _fetch_tails, unless they were last downloaded in full more than
+        full_refresh_interval ago.
+        """
+        locks = {}
+        for sheet_name in sorted(sheet_names):
+            lock = self.cache.fill_lock(sheet_name)
+            if lock.acquire(blocking=False):
+                locks[sheet_name] = lock
+        try:
+            sheet_names = [
+                sheet_name for sheet_name in sheet_names
+                if sheet_name in locks and self._expired(sheet_name)
+            ]
+            unchanged = self._revalidate(sheet_names)
+            for sheet_name in unchanged:
+                metrics.inc("health_tracker_sheet_refreshes_total", sheet=sheet_name, result="unchanged")
+            sheet_names = [sheet_name for sheet_name in sheet_names if sheet_name not in unchanged]
+            if not sheet_names:
+                return
+
+            versions = {
+                sheet_name: (self.cache.metadata(sheet_name) or {}).get("version", 0)
+                for sheet_name in sheet_names
+            }
+            full = [sheet_name for sheet_name in sheet_names if not self._incremental(sheet_name)]
+            incremental = [sheet_name for sheet_name in sheet_names if sheet_name not in full]
+
+            if incremental:
+                revision, tails = self._fetch_tails(incremental)
+                for sheet_name, new_rows in tails.items():
+                    if new_rows is None:
+                        full.append(sheet_name)
+                        continue
+                    metrics.inc("health_tracker_sheet_refreshes_total", sheet=sheet_name, result="incremental")
+                    if new_rows.empty:
+                        self.cache.touch(sheet_name, if_version=versions[sheet_name], revision=revision)
+                    else:
+                        # only rewrites the partitions of the new rows (see SheetCache.append)
+                        version = self.cache.append(sheet_name, new_rows, if_version=versions[sheet_name])
+                        if version is not None:
+                            self.cache.touch(sheet_name, if_version=version, revision=revision)
+
+            if full:
+                revision, frames = self._fetch_many(full)
+                for sheet_name, frame in frames.items():
+                    metrics.inc("health_tracker_sheet_refreshes_total", sheet=sheet_name, result="full")
+                    self.cache.write(sheet_name, frame, revision=revision, if_version=versions[sheet_name])
+        finally:
+            for lock in locks.values():
+                lock.release()
+
+    def _incremental(self, sheet_name:str) -> bool:
+        """
+        Whether a sheet can be refreshed by downloading new rows only.
+        """
+        if not sheet_name.startswith(self.append_only_prefixes):
+            return False
+        metadata = self.cache.metadata(sheet_name)
+        return metadata is not None and self.cache.download_age(metadata) <= self.full_refresh_interval
+
+    def _expired(self, sheet_name:str) -> bool:
+        metadata = self.cache.metadata(sheet_name)
+        return metadata is None or self.cache.age(metadata) > self.cache_ttl
+
+    def _revalidate(self, sheet_names:List[str]) -> List[str]:
+        """
+        Mark cached sheets as fresh if the spreadsheet did not change.
+
+        Asking Drive for the modification time of the spreadsheet is much
+        cheaper than downloading a sheet, and does not count against the
+        Sheets quota. If it still matches the revision stored with a cached
+        sheet, the sheet cannot have changed and its fetch time is reset
+        instead of downloading it again.
+
+        Note that the revision covers the whole spreadsheet, so a change to
+        any sheet (e.g. a new food log entry) means all sheets are downloaded
+        again on their next refresh.
+
+        Returns:
+            sheet_names (List[str]): The sheets that are unchanged
+        """
+        revision = self._revision()
+        if revision is None:
+            return []
+        unchanged = []
+        for sheet_name in sheet_names:
+            metadata = self.cache.metadata(sheet_name)
+            if metadata is not None and metadata["revision"] == revision:
+                self.cache.touch(sheet_name, if_version=metadata["version"])
+                unchanged.append(sheet_name)
+        return unchanged
+
+    def _revision(self) -> Optional[str]:
+        """
+        Get the revision (Drive modifiedTime) of the spreadsheet.
+
+        Returns:
+            revision (str | None): The revision, or None if it could not be read
+        """
+        try:
+            return handles.revision(self.client, self.url, max_age=self.revision_ttl)
+        except api_error() as e:
+            print(f"Could not read spreadsheet revision: {e}")
+            return None
+
+    def _fetch_many(self, sheet_names:List[str]) -> Tuple[Optional[str], Dict[str, pd.DataFrame]]:
+        """
+        Download several sheets with a single batched request.
+
+        Returns:
+            revision (str | None): The revision of the spreadsheet, read
+                before the download so it is never newer than the data
+            data (Dict[str, pd.DataFrame]): The data of each sheet, by sheet name
+        """
+        revision = self._revision()
+        spreadsheet = handles.spreadsheet(self.client, self.url)
+        response = governor.call(
+            lambda: spreadsheet.values_batch_get(
+                [lazy_import("gspread.utils").absolute_range_name(sheet_name) for sheet_name in sheet_names]
+            ),
+            key=("batch_get", tuple(sheet_names))
+        )
+        data = {}
+        for sheet_name, value_range in zip(sheet_names, response["valueRanges"]):
+            values = value_range.get("values", [])
+            metrics.inc("health_tracker_api_bytes_total", self._values_bytes(values), sheet=sheet_name, direction="download")
+            data[sheet_name] = self._values_to_frame(values)
+        return revision, data
+
+    def _fetch_tails(self, sheet_names:List[str]) -> Tuple[Optional[str], Dict[str, Optional[pd.DataFrame]]]:
+        """
+        Download the rows that were added to cached sheets since they were
+        cached, with a single batched request.
+
+        For each sheet the header and every row from the last tail_rows
+        cached rows onwards are read. If the header and those overlapping
+        rows still match the cache (compared by checksum, see
+        SheetCache.rows_checksum), the rows after them are new. If they do
+        not match, rows were edited or deleted and the sheet has to be
+        downloaded again in full. Edits to rows before the overlap are not
+        detected; they are picked up by the next full download (see
+        full_refresh_interval).
+
+        Returns:
+            revision (str | None): The revision of the spreadsheet, read
+                before the download so it is never newer than the data
+            new_rows (Dict[str, pd.DataFrame | None]): The new rows of each
+                sheet (can be empty), or None if the sheet has to be
+                downloaded again
+        """
+        utils = lazy_import("gspread.utils")
+        revision = self._revision()
+        # the last cached rows, indexed by position
+        cached = {sheet_name: self.cache.tail(sheet_name, self.tail_rows) for sheet_name in sheet_names}
+
+        ranges = []
+        overlaps = {}
+        for sheet_name, data in cached.items():
+            overlaps[sheet_name] = len(data)
+            first_row = (data.index[0] if len(data) else 0) + 2 # 1-based, below the header
+            last_column = utils.rowcol_to_a1(1, max(len(data.columns), 1)).rstrip("1")
+            ranges.append(utils.absolute_range_name(sheet_name, "1:1"))
+            ranges.append(utils.absolute_range_name(sheet_name, f"A{first_row}:{last_column}"))
+
+        spreadsheet = handles.spreadsheet(self.client, self.url)
+        response = governor.call(
+            lambda: spreadsheet.values_batch_get(ranges),
+            key=("batch_get", tuple(ranges))
+        )
+
+        new_rows = {}
+        value_ranges = response["valueRanges"]
+        for i, (sheet_name, data) in enumerate(cached.items()):
+            header = value_ranges[2*i].get("values", [[]])[0]
+            rows = value_ranges[2*i + 1].get("values", [])
+            metrics.inc(
+                "health_tracker_api_bytes_total", self._values_bytes([header] + rows),
+                sheet=sheet_name, direction="download",
+            )
+            overlap = overlaps[sheet_name]
+            if header != [str(column) for column in data.columns] or len(rows) < overlap:
+                new_rows[sheet_name] = None
+                continue
+
+            tail = self._values_to_frame([header] + rows)
+            if SheetCache.rows_checksum(tail.iloc[:overlap]) != SheetCache.rows_checksum(data):
+                new_rows[sheet_name] = None
+                continue
+            new_rows[sheet_name] = tail.iloc[overlap:].reset_index(drop=True)
+        return revision, new_rows
+
+    def _cached_columns(self, sheet_name:str):
+        """
+        Get the column order of a sheet from the cache, if any.
+        """
+        return self.cache.columns(sheet_name)
+
+    @staticmethod
+    def _record_load(sheet_name:str, result:str, start:float, rows:int) -> None:
+        """
+        Record a sheet load in the metrics, see metrics.py.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            result (str): hit (fresh cached data), stale (expired cached
+                data, refreshed in the background) or miss (downloaded)
+            start (float): time.perf_counter() at the start of the load
+            rows (int): Number of rows of the sheet
+        """
+        labels = {"sheet": sheet_name, "result": result}
+        metrics.inc("health_tracker_cache_requests_total", **labels)
+        metrics.observe("health_tracker_sheet_load_seconds", time.perf_counter() - start, **labels)
+        metrics.set("health_tracker_sheet_rows", rows, sheet=sheet_name)
+
+    @classmethod
+    def _record_write(cls, sheet_name:str, op:str, start:float, values:List[list]=None) -> None:
+        """
+        Record a write in the metrics, with the size of the values sent.
+        """
+        metrics.observe("health_tracker_sheet_write_seconds", time.perf_counter() - start, sheet=sheet_name, op=op)
+        if values:
+            metrics.inc("health_tracker_api_bytes_total", cls._values_bytes(values), sheet=sheet_name, direction="upload")
+
+    @staticmethod
+    def _values_bytes(values:List[list]) -> int:
+        """
+        Size of the cell values of a range, as sent over the API.
+        """
+        return sum(len(str(value)) for row in values for value in row)
+
+    @staticmethod
+    def _to_values(data:pd.DataFrame) -> List[list]:
+        """
+        Convert a DataFrame to a JSON serializable list of rows (NaN -> "").
+        """
+        return data.astype(object).where(data.notna(), "").values.tolist()
 
     def _get_client(self) -> Client:
         """
@@ -98,7 +954,7 @@ class GoogleSheetsInterface:
             "https://www.googleapis.com/auth/drive"
         ]
         creds = self._get_credentials(scopes)
-        client = gspread.authorize(creds)
+        client = lazy_import("gspread").authorize(creds)
         return client
 
     def _get_credentials(
@@ -119,6 +975,9 @@ class GoogleSheetsInterface:
             ServiceAccountCredentials: A credentials object that can be used to authenticate
                 with the Google Sheets API
         """
+        oauth2client = lazy_import("oauth2client")
+        crypt = lazy_import("oauth2client.crypt")
+        service_account = lazy_import("oauth2client.service_account")
         keyfile_dict = st.secrets["connections"]["gsheets"]
 
         service_account_email = keyfile_dict['client_email']
@@ -129,7 +988,7 @@ class GoogleSheetsInterface:
         revoke_uri = keyfile_dict.get('revoke_uri', oauth2client.GOOGLE_REVOKE_URI)
         signer = crypt.Signer.from_string(private_key_pkcs8_pem)
 
-        credentials = ServiceAccountCredentials(
+        credentials = service_account.ServiceAccountCredentials(
             service_account_email,
             signer,
             scopes=scopes,
@@ -146,6 +1005,5 @@ class GoogleSheetsInterface:
         """
         Clear the cache of downloaded Google Sheets data
         """
-        for file in os.listdir(self.cache_path):
-            if file.endswith(".csv"):
-                os.remove(f"{self.cache_path}/{file}")
+        handles.invalidate()
+        self.cache.clear()
@@ -0,0 +1,273 @@
+import builtins
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Iterator, List, Optional, Tuple
+import profiling
+from metrics import metrics
+
+# report import and step timings of every page run
+enabled = os.environ.get("HEALTH_TRACKER_STARTUP_PROFILE", "0") == "1"
+# file to append the report of every page run to, as json lines
+report_path = os.environ.get("HEALTH_TRACKER_STARTUP_REPORT")
+
+# budgets in milliseconds. cold_start is the first run of a page in a fresh
+# process, including the imports it triggers; first_render is the same run
+# without the imports.
+BUDGETS_MS = {
+    "cold_start": float(os.environ.get("HEALTH_TRACKER_COLD_START_BUDGET_MS", 4000)),
+    "first_render": float(os.environ.get("HEALTH_TRACKER_FIRST_RENDER_BUDGET_MS", 1500)),
+}
+
+
+class PageRun:
+    """
+    Timings of one run of a page script.
+
+    imports are the modules imported during the run (only the outermost
+    import of a chain is listed, with the time of its dependencies), steps
+    are the parts of the run timed with step().
+    """
+
+    def __init__(self, page_name:str, first:bool, imports:List[Tuple[str, float]]):
+        self.page_name = page_name
+        self.first = first
+        self.imports = imports
+        self.steps: List[Tuple[str, float]] = []
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def report(self) -> dict:
+        """
+        The timings in milliseconds, and the budgets that were exceeded.
+        """
+        import_ms = sum(duration for _, duration in self.imports) * 1000
+        render_ms = self.duration * 1000
+        report = {
+            "page": self.page_name,
+            "first": self.first,
+            "imports_ms": {name: round(duration * 1000, 1) for name, duration in self.imports},
+            "steps_ms": {name: round(duration * 1000, 1) for name, duration in self.steps},
+            "render_ms": round(render_ms, 1),
+            "total_ms": round(import_ms + render_ms, 1),
+            "over_budget": [],
+        }
+        if self.first:
+            if import_ms + render_ms > BUDGETS_MS["cold_start"]:
+                report["over_budget"].append("cold_start")
+            if render_ms > BUDGETS_MS["first_render"]:
+                report["over_budget"].append("first_render")
+        return report
+
+
+_local = threading.local()
+_seen_pages = set()
+# the last run of a session, in its session state
+_SESSION_KEY = "_instrumentation_page_run"
+_original_import = builtins.__import__
+
+
+class _OpenRun:
+    """
+    A page run between page_start and page_finish, and its reports.
+    """
+
+    def __init__(self, page_name:str, profile:Optional[profiling.PageProfile], run:Optional[PageRun]):
+        self.page_name = page_name
+        self.profile = profile
+        self.run = run
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.report = None # see PageRun.report
+        self.summary = None # see PageProfile.save
+        self._lock = threading.Lock()
+        self._finished = False
+        self._shown = False
+
+    def finish(self, show:bool) -> None:
+        """
+        Record the run (only the first call has an effect).
+
+        Args:
+            show (bool): Show the reports on the page, only possible from
+                the run itself (or the next run of its session, see show)
+        """
+        with self._lock:
+            if not self._finished:
+                self._finished = True
+                if self.run is not None:
+                    self.run.duration = time.perf_counter() - self.run.started
+                    if threading.get_ident() == self.thread_id:
+                        self.run.imports += _take_imports()
+                        _local.run = None
+                    self.report = _report(self.run)
+                if self.profile is not None:
+                    self.summary = profiling.finish(self.profile)
+                metrics.observe(
+                    "health_tracker_page_run_seconds", time.perf_counter() - self.started, page=self.page_name
+                )
+            if show:
+                self._show()
+
+    def show(self) -> None:
+        """
+        Show the reports on the page, if they were not shown yet.
+        """
+        with self._lock:
+            self._show()
+
+    def _show(self) -> None:
+        if self._shown:
+            return
+        self._shown = True
+        if self.report is not None:
+            _show_report(self.run, self.report)
+        if self.summary is not None:
+            profiling.show(self.summary)
+
+
+def page_start(page_name:str) -> None:
+    """
+    Start timing a run of a page. Call it at the top of every page, after
+    the imports, and page_finish at the bottom:
+
+        page_start("Food")
+        ...
+        page_finish()
+
+    The duration of every run is recorded in the
+    health_tracker_page_run_seconds metric (see metrics.py). The import
+    and step timings are only collected if HEALTH_TRACKER_STARTUP_PROFILE
+    is set to 1; the imports done by the page script before page_start are
+    attributed to the run as well. With ?profile=1 in the url (or
+    HEALTH_TRACKER_PROFILE=1) the run is also profiled, see profiling.py.
+
+    A run that does not get to page_finish is finished by the next run on
+    its script thread, or when the thread ends, whichever is first. Most
+    of those runs ended normally, with st.rerun (e.g. after a button saved
+    something) or st.stop, and their output is replaced by the next run of
+    the session; so that run shows their reports, at the top of the
+    sidebar. Runs that ended with an error are reported the same way.
+    """
+    import streamlit as st
+    previous = getattr(_local, "open_run", None)
+    if previous is not None:
+        previous.finish(show=False)
+    # before profiling.requested, showing a profile removes ?profile=1
+    last = st.session_state.get(_SESSION_KEY)
+    if last is not None:
+        last.finish(show=False)
+        last.show()
+
+    profile = profiling.start(page_name) if profiling.requested() else None
+    run = None
+    if enabled:
+        run = PageRun(page_name, first=page_name not in _seen_pages, imports=_take_imports())
+        _seen_pages.add(page_name)
+        _local.run = run
+    open_run = _OpenRun(page_name, profile, run)
+    _local.open_run = open_run
+    st.session_state[_SESSION_KEY] = open_run
+
+    # Streamlit runs a page on a thread that ends when no rerun follows
+    script_thread = threading.current_thread()
+    if script_thread is not threading.main_thread():
+        threading.Thread(
+            target=_finish_after, args=(script_thread, open_run), name="page-run-watcher", daemon=True,
+        ).start()
+
+
+def page_finish() -> None:
+    """
+    Finish the run started by page_start, and show its reports.
+    """
+    open_run = getattr(_local, "open_run", None)
+    if open_run is None:
+        return
+    _local.open_run = None
+    open_run.finish(show=True)
+
+
+def _finish_after(thread:threading.Thread, open_run:_OpenRun) -> None:
+    thread.join()
+    open_run.finish(show=False)
+
+
+@contextmanager
+def step(name:str) -> Iterator[None]:
+    """
+    Time part of a page run, e.g. creating the storage backend.
+    """
+    run = getattr(_local, "run", None)
+    if run is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.steps.append((name, time.perf_counter() - start))
+
+
+def lazy_import(module_name:str) -> ModuleType:
+    """
+    Import a module the first time it is needed.
+
+    Used for heavy dependencies (gspread, oauth2client, scipy, plotly) that
+    only some code paths need, so pages that do not take those paths do not
+    pay for the import.
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    return _timed(module_name, lambda: importlib.import_module(module_name))
+
+
+def _timed(name:str, load):
+    if not enabled or getattr(_local, "importing", False):
+        return load()
+    _local.importing = True
+    start = time.perf_counter()
+    try:
+        return load()
+    finally:
+        _local.importing = False
+        _local.__dict__.setdefault("imports", []).append((name, time.perf_counter() - start))
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level != 0 or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    return _timed(name, lambda: _original_import(name, globals, locals, fromlist, level))
+
+
+def _take_imports() -> List[Tuple[str, float]]:
+    imports = getattr(_local, "imports", [])
+    _local.imports = []
+    return imports
+
+
+def _report(run:PageRun) -> dict:
+    report = run.report()
+    print(f"Page run: {json.dumps(report)}")
+    if report_path:
+        with open(report_path, "a") as file:
+            file.write(json.dumps(report) + "\n")
+    return report
+
+
+def _show_report(run:PageRun, report:dict) -> None:
+    import streamlit as st
+    with st.sidebar.expander("Startup profile"):
+        st.write(report)
+    for budget in report["over_budget"]:
+        st.sidebar.warning(f"{run.page_name}: {budget} over budget ({BUDGETS_MS[budget]:.0f} ms)")
+
+
+if enabled:
+    builtins.__import__ = _timed_import
@@ -1,7 +1,242 @@
+import hashlib
+import math
 import os
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Tuple
 import pandas as pd
 
+
+class DraftStore:
+    """
+    Drafts (e.g. a recipe that is being built on the Manage page), kept in
+    memory per session and backed by an append-only journal per session.
+
+    Each change is appended to the journal as one binary record, so adding
+    a row costs the same no matter how long the draft is, and the journal
+    is replayed the first time a session is used after a restart. Records
+    are:
+
+        length (uint32) | op (uint8) | sheet name | row count (uint32) | rows
+
+    with op APPEND (add the rows) or REPLACE (replace all rows of the sheet,
+    so clearing a sheet is a REPLACE without rows). A row is a value count
+    (uint16) followed by the values, each a type byte and its data: N (none),
+    I (int64), F (float64) or S (uint32 length and utf-8 bytes). A record
+    that was cut short (e.g. by a crash while writing) is dropped when the
+    journal is replayed.
+
+    Journals that are replayed with many overwritten rows are compacted, and
+    journals that were not changed for max_age seconds are removed. Sessions
+    that were not used for idle_time seconds are dropped from memory, as are
+    the least recently used ones beyond max_sessions; their journal is
+    replayed if they are used again.
+    """
+
+    APPEND = 0
+    REPLACE = 1
+
+    def __init__(
+        self,
+        journal_path:str,
+        max_age:float=60*60*24*30,
+        idle_time:float=60*60,
+        max_sessions:int=1000,
+    ):
+        self.journal_path = journal_path
+        self.max_age = max_age
+        self.idle_time = idle_time
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # session id -> (time of last use, drafts), least recently used first
+        self._sessions = OrderedDict()
+
+        os.makedirs(self.journal_path, exist_ok=True)
+        for file in os.listdir(self.journal_path):
+            path = f"{self.journal_path}/{file}"
+            try:
+                if time.time() - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def rows(self, session_id:str, sheet_name:str) -> List[list]:
+        """
+        Get a copy of the rows of a draft sheet.
+        """
+        with self._lock:
+            return list(self._session(session_id).get(sheet_name, []))
+
+    def append(self, session_id:str, sheet_name:str, rows:List[list]) -> None:
+        """
+        Add rows to a draft sheet, appending one record to the journal.
+        """
+        with self._lock:
+            sheets = self._session(session_id)
+            self._write(session_id, self._record(self.APPEND, sheet_name, rows))
+            sheets.setdefault(sheet_name, []).extend(rows)
+
+    def replace(self, session_id:str, sheet_name:str, rows:List[list]) -> None:
+        """
+        Replace all rows of a draft sheet, appending one record to the journal.
+        """
+        with self._lock:
+            sheets = self._session(session_id)
+            self._write(session_id, self._record(self.REPLACE, sheet_name, rows))
+            sheets[sheet_name] = list(rows)
+
+    def remove(self, session_id:str) -> None:
+        """
+        Remove all drafts of a session.
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            try:
+                os.remove(self._journal_file(session_id))
+            except FileNotFoundError:
+                pass
+
+    def _session(self, session_id:str) -> Dict[str, List[list]]:
+        """
+        The drafts of a session, replaying its journal on first use.
+        """
+        now = time.monotonic()
+        entry = self._sessions.pop(session_id, None)
+        sheets = self._replay(session_id) if entry is None else entry[1]
+        self._sessions[session_id] = (now, sheets)
+
+        # evict idle sessions, the journal has all their changes
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        while now - next(iter(self._sessions.values()))[0] > self.idle_time:
+            self._sessions.popitem(last=False)
+        return sheets
+
+    def _replay(self, session_id:str) -> Dict[str, List[list]]:
+        try:
+            with open(self._journal_file(session_id), "rb") as journal:
+                data = journal.read()
+        except FileNotFoundError:
+            return {}
+
+        sheets = {}
+        offset = 0
+        records = 0
+        while offset + 4 <= len(data):
+            (length,) = struct.unpack_from("<I", data, offset)
+            if offset + 4 + length > len(data):
+                break
+            op, sheet_name, rows = self._parse(data[offset + 4:offset + 4 + length])
+            if op == self.REPLACE:
+                sheets[sheet_name] = rows
+            else:
+                sheets.setdefault(sheet_name, []).extend(rows)
+            offset += 4 + length
+            records += 1
+
+        # compact journals with a cut off record or many overwritten rows
+        if offset < len(data) or records > len(sheets) + sum(len(rows) for rows in sheets.values()):
+            self._compact(session_id, sheets)
+        return sheets
+
+    def _compact(self, session_id:str, sheets:Dict[str, List[list]]) -> None:
+        """
+        Rewrite a journal with a single REPLACE record per sheet.
+        """
+        temp_path = f"{self._journal_file(session_id)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as journal:
+            for sheet_name, rows in sheets.items():
+                journal.write(self._record(self.REPLACE, sheet_name, rows))
+        os.replace(temp_path, self._journal_file(session_id))
+
+    def _write(self, session_id:str, record:bytes) -> None:
+        # flushed to the OS with the file closed, which is enough to survive
+        # a restart of the server; drafts are not worth an fsync per click
+        with open(self._journal_file(session_id), "ab") as journal:
+            journal.write(record)
+
+    @classmethod
+    def _record(cls, op:int, sheet_name:str, rows:List[list]) -> bytes:
+        parts = [struct.pack("<B", op), _pack_string(sheet_name), struct.pack("<I", len(rows))]
+        for row in rows:
+            parts.append(struct.pack("<H", len(row)))
+            parts.extend(_pack_value(value) for value in row)
+        payload = b"".join(parts)
+        return struct.pack("<I", len(payload)) + payload
+
+    @staticmethod
+    def _parse(payload:bytes) -> Tuple[int, str, List[list]]:
+        op = payload[0]
+        sheet_name, offset = _unpack_string(payload, 1)
+        (n_rows,) = struct.unpack_from("<I", payload, offset)
+        offset += 4
+        rows = []
+        for _ in range(n_rows):
+            (n_values,) = struct.unpack_from("<H", payload, offset)
+            offset += 2
+            row = []
+            for _ in range(n_values):
+                value, offset = _unpack_value(payload, offset)
+                row.append(value)
+            rows.append(row)
+        return op, sheet_name, rows
+
+    def _journal_file(self, session_id:str) -> str:
+        return f"{self.journal_path}/{session_id}.drafts"
+
+
+def _pack_string(value:str) -> bytes:
+    data = value.encode()
+    return struct.pack("<I", len(data)) + data
+
+
+def _unpack_string(payload:bytes, offset:int) -> Tuple[str, int]:
+    (length,) = struct.unpack_from("<I", payload, offset)
+    offset += 4
+    return payload[offset:offset + length].decode(), offset + length
+
+
+def _pack_value(value) -> bytes:
+    if hasattr(value, "item"):
+        value = value.item() # numpy scalars
+    if value is None or value is pd.NA or (isinstance(value, float) and math.isnan(value)):
+        return b"N"
+    if isinstance(value, (bool, int)):
+        return b"I" + struct.pack("<q", int(value))
+    if isinstance(value, float):
+        return b"F" + struct.pack("<d", value)
+    return b"S" + _pack_string(str(value))
+
+
+def _unpack_value(payload:bytes, offset:int):
+    tag = payload[offset:offset + 1]
+    offset += 1
+    if tag == b"N":
+        return None, offset
+    if tag == b"I":
+        return struct.unpack_from("<q", payload, offset)[0], offset + 8
+    if tag == b"F":
+        return struct.unpack_from("<d", payload, offset)[0], offset + 8
+    return _unpack_string(payload, offset)
+
+
+drafts = DraftStore(journal_path="cache/local/drafts")
+
+
 class LocalCacheInterface:
+    """
+    Drafts of the current session, see DraftStore.
+
+    Every browser session has its own drafts, so users building a recipe at
+    the same time do not see or overwrite each other's ingredients. Drafts
+    are keyed by the logged in user if authentication is configured (see
+    st.login), and then survive reloading the page and restarting the
+    server. Otherwise they are keyed by a random id kept in the session
+    state, which never leaves the server, and last as long as the session.
+    """
 
     cache_path = "cache/local"
     empty_dfs = {
@@ -11,14 +246,49 @@ class LocalCacheInterface:
         "new_recipe_instructions": pd.DataFrame(columns=["instruction"]),
     }
 
-    def __init__(self):
-        pass
+    def __init__(self, session_id:str=None):
+        self.session_id = session_id or self.current_session_id()
+
+    @staticmethod
+    def current_session_id() -> str:
+        """
+        Get the draft id of the logged in user or of the current Streamlit
+        session, creating one on first use.
+        """
+        import streamlit as st
+        # the draft id of older versions of the app, which anyone with the url could use
+        if "draft" in st.query_params:
+            del st.query_params["draft"]
+
+        if st.user.get("is_logged_in"):
+            user = st.user.get("sub") or st.user.get("email")
+            return hashlib.sha256(f"user:{user}".encode()).hexdigest()[:32]
+        if "draft_id" not in st.session_state:
+            st.session_state["draft_id"] = uuid.uuid4().hex
+        return st.session_state["draft_id"]
 
     def load_from_local_cache(self, sheet_name: str) -> pd.DataFrame:
-        file_path = f"{self.cache_path}/{sheet_name}.csv"
-        if not os.path.exists(file_path):
-            return self.empty_dfs[sheet_name]
-        return pd.read_csv(file_path)
+        """
+        Get a draft sheet of the current session.
+
+        Args:
+            sheet_name (str): The name of the sheet in the local cache
+
+        Returns:
+            data (pd.DataFrame): The draft, empty if there is none
+        """
+        columns = self.empty_dfs[sheet_name].columns
+        return pd.DataFrame(drafts.rows(self.session_id, sheet_name), columns=columns)
+
+    def append_to_local_cache(self, sheet_name: str, new_rows: pd.DataFrame) -> None:
+        """
+        Add rows to a draft sheet, without rewriting the rows it already has.
+
+        Args:
+            sheet_name (str): The name of the sheet in the local cache
+            new_rows (pd.DataFrame): The rows to add
+        """
+        drafts.append(self.session_id, sheet_name, self._to_rows(sheet_name, new_rows))
 
     def update_local_cache(self, sheet_name: str, df: pd.DataFrame) -> None:
         """
@@ -29,8 +299,7 @@ class LocalCacheInterface:
             df (pd.DataFrame): The updated data (old data + new data)
                 to be stored in the local cache
         """
-        file_path = f"{self.cache_path}/{sheet_name}.csv"
-        df.to_csv(file_path, index=False)
+        drafts.replace(self.session_id, sheet_name, self._to_rows(sheet_name, df))
 
     def clear_local_cache(self, sheet_name: str) -> None:
         """
@@ -39,14 +308,20 @@ class LocalCacheInterface:
         Args:
             sheet_name (str): The name of the sheet in the local cache to be removed
         """
-        file_path = f"{self.cache_path}/{sheet_name}.csv"
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        drafts.replace(self.session_id, sheet_name, [])
 
     def clear_cache(self):
         """
-        Clear the cache of downloaded Google Sheets data
+        Remove all drafts of the current session, and the shared csv drafts
+        of older versions of the app.
         """
+        drafts.remove(self.session_id)
         for file in os.listdir(self.cache_path):
             if file.endswith(".csv"):
-                os.remove(f"{self.cache_path}/{file}")
+                try:
+                    os.remove(f"{self.cache_path}/{file}")
+                except FileNotFoundError:
+                    pass
+
+    def _to_rows(self, sheet_name:str, data:pd.DataFrame) -> List[list]:
+        return data.reindex(columns=self.empty_dfs[sheet_name].columns).astype(object).values.tolist()
@@ -0,0 +1,109 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+import pandas as pd
+
+
+class MemoryCache:
+    """
+    In-process LRU cache of parsed DataFrames.
+
+    Streamlit re-runs the page script on every widget interaction, and each
+    rerun used to parse the cached csv files again. This cache keeps the
+    parsed DataFrames in memory, shared by every session of the process.
+
+    Entries are keyed by sheet name and data version. The version changes
+    whenever the data behind the entry changes (for example a new download),
+    so an entry can never be served for newer data. Partitions of a sheet
+    (see SheetCache.read) are stored under "<sheet name>/<keys>" and are
+    invalidated with their sheet. Once the total size of the entries exceeds
+    max_bytes, the least recently used ones are evicted.
+    """
+
+    def __init__(self, max_bytes:int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, sheet_name:str, version:Hashable) -> Optional[pd.DataFrame]:
+        """
+        Get a copy of a cached DataFrame.
+
+        A copy is returned because pages add columns to the frames they load,
+        which must not leak into the shared entry.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            version (Hashable): The version of the data
+
+        Returns:
+            data (pd.DataFrame | None): The cached data, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get((sheet_name, version))
+            if entry is None:
+                return None
+            self._entries.move_to_end((sheet_name, version))
+            return entry[0].copy()
+
+    def put(self, sheet_name:str, version:Hashable, data:pd.DataFrame) -> None:
+        """
+        Store a DataFrame, replacing any older version of the same sheet.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            version (Hashable): The version of the data
+            data (pd.DataFrame): The parsed data
+        """
+        nbytes = int(data.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            self._remove(sheet_name)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[(sheet_name, version)] = (data.copy(), nbytes)
+            self._bytes += nbytes
+
+            # evict least recently used entries until within budget
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+
+    def invalidate(self, sheet_name:str=None) -> None:
+        """
+        Remove a sheet from the cache, including the entries of its
+        partitions.
+
+        Args:
+            sheet_name (str): The sheet to remove. If None, the whole cache
+                is cleared.
+        """
+        with self._lock:
+            if sheet_name is None:
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                self._remove(sheet_name, partitions=True)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Total size of the cached DataFrames in bytes.
+        """
+        return self._bytes
+
+    def _remove(self, sheet_name:str, partitions:bool=False) -> None:
+        prefix = f"{sheet_name}/"
+        for key in [
+            key for key in self._entries
+            if key[0] == sheet_name or (partitions and key[0].startswith(prefix))
+        ]:
+            _, nbytes = self._entries.pop(key)
+            self._bytes -= nbytes
+
+
+# budget can be changed with the HEALTH_TRACKER_MEMORY_CACHE_MB environment variable
+memory_cache = MemoryCache(
+    max_bytes=int(os.environ.get("HEALTH_TRACKER_MEMORY_CACHE_MB", 256)) * 1024**2
+)
@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+# port to serve the metrics on in Prometheus text format (at /metrics), off if unset
+exporter_port = os.environ.get("HEALTH_TRACKER_METRICS_PORT")
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+
+# type and description of every metric
+METRICS = {
+    "health_tracker_page_run_seconds": (
+        "histogram", "Time of a run of a page script, from start to finish"),
+    "health_tracker_sheet_load_seconds": (
+        "histogram", "Time to load a sheet, by cache result (hit, stale or miss)"),
+    "health_tracker_cache_requests_total": (
+        "counter", "Sheet loads by cache result (hit, stale or miss)"),
+    "health_tracker_sheet_refreshes_total": (
+        "counter", "Background refreshes of expired sheets, by result (unchanged, incremental or full)"),
+    "health_tracker_sheet_rows": (
+        "gauge", "Number of rows of a sheet when it was last loaded"),
+    "health_tracker_sheet_write_seconds": (
+        "histogram", "Time to write to a sheet, by operation"),
+    "health_tracker_api_bytes_total": (
+        "counter", "Bytes of cell values downloaded from or uploaded to Google Sheets"),
+    "health_tracker_api_requests_total": (
+        "counter", "Google Sheets API requests, by kind (calls, coalesced, throttled, retries)"),
+    "health_tracker_api_request_seconds": (
+        "histogram", "Time of a Google Sheets API request, including retries"),
+    "health_tracker_warmup_sheets": (
+        "gauge", "Sheets of the last cache warm-up, by state (total, done or failed)"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Counts of observed values per bucket, as in a Prometheus histogram.
+    """
+
+    def __init__(self, buckets:Tuple[float, ...]=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value:float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q:float) -> float:
+        """
+        Estimate a quantile (e.g. 0.95) by interpolating within its bucket,
+        the way Prometheus' histogram_quantile does.
+        """
+        if self.count == 0:
+            return float("nan")
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    Process-wide registry of counters, gauges and histograms.
+
+    Every metric is identified by its name (see METRICS) and labels, e.g.
+    metrics.inc("health_tracker_cache_requests_total", sheet="food_data",
+    result="hit"). Recording a value only takes a lock and updates a few
+    numbers, so it is cheap enough for every sheet load and page run.
+
+    The values can be read with snapshot (used by the Admin page) or in
+    Prometheus text format with prometheus (served by the exporter).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+
+    def inc(self, name:str, value:float=1., **labels) -> None:
+        """
+        Add value to a counter.
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.) + value
+
+    def set(self, name:str, value:float, **labels) -> None:
+        """
+        Set a gauge.
+        """
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = float(value)
+
+    def observe(self, name:str, value:float, **labels) -> None:
+        """
+        Add a value to a histogram.
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, name:str, **labels) -> Iterator[None]:
+        """
+        Add the duration of the block, in seconds, to a histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> Dict[str, List[dict]]:
+        """
+        The current values.
+
+        Returns:
+            snapshot (Dict[str, List[dict]]): Lists of counters, gauges and
+                histograms, each a dict with the name, the labels and the
+                value (for histograms: count, sum, p50, p95 and p99)
+        """
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, **dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                "gauges": [
+                    {"name": name, **dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._gauges.items())
+                ],
+                "histograms": [
+                    {
+                        "name": name, **dict(labels),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "p50": histogram.quantile(0.5),
+                        "p95": histogram.quantile(0.95),
+                        "p99": histogram.quantile(0.99),
+                    }
+                    for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0])
+                ],
+            }
+
+    def prometheus(self) -> str:
+        """
+        The current values in the Prometheus text exposition format.
+        """
+        samples: Dict[str, List[str]] = {}
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                samples.setdefault(name, []).append(f"{name}{_format(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                samples.setdefault(name, []).append(f"{name}{_format(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                lines = samples.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(_bounds(histogram), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_format(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format(labels)} {histogram.count}")
+
+        text = []
+        for name in sorted(samples):
+            kind, description = METRICS.get(name, ("untyped", name))
+            text.append(f"# HELP {name} {description}")
+            text.append(f"# TYPE {name} {kind}")
+            text.extend(samples[name])
+        return "\n".join(text) + "\n"
+
+    def reset(self) -> None:
+        """
+        Remove all recorded values.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+def _bounds(histogram:Histogram) -> List[str]:
+    return [repr(bound) for bound in histogram.buckets] + ["+Inf"]
+
+
+def _labels(labels:dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(labels:Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+metrics = Metrics()
+
+
+def start_exporter(port:int) -> None:
+    """
+    Serve the metrics at http://<host>:<port>/metrics on a background thread.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # scraped every few seconds, not worth a log line
+
+    try:
+        server = ThreadingHTTPServer(("", port), Handler)
+    except OSError as e:
+        # e.g. a second server process on the same machine
+        print(f"Could not start the metrics exporter on port {port}: {e}")
+        return
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+
+
+if exporter_port:
+    start_exporter(int(exporter_port))
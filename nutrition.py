@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from food_catalog import FoodCatalog
+
+
+def nutrition_facts(
+    entries:pd.DataFrame,
+    catalog:FoodCatalog,
+    food_column:str="name",
+    quantity_column:str="quantity",
+    serving_column:str="serving",
+) -> pd.DataFrame:
+    """
+    Weight and nutrients of food log entries or recipe ingredients.
+
+    An entry is a food, a quantity and a serving: "g" for a quantity in
+    grams, anything else for a number of servings of the food (of
+    "Single Serving (g)" each). Everything is computed on whole columns:
+    the foods are looked up in the catalog with one hash lookup per entry
+    and the rest are NumPy array operations, so a whole log costs about as
+    much as a few rows did with DataFrame.apply.
+
+    Entries of foods that are not in the catalog get NaN nutrients (and NaN
+    grams, unless their quantity is in grams).
+
+    Args:
+        entries (pd.DataFrame): The entries, e.g. a food log
+        catalog (FoodCatalog): The foods, see food_catalog
+        food_column (str): Column of entries with the food name ("ingredient"
+            for recipe ingredients)
+        quantity_column (str): Column of entries with the quantity
+        serving_column (str): Column of entries with the serving
+
+    Returns:
+        facts (pd.DataFrame): grams, kcal, fat, carbs and protein of every
+            entry, with the index of entries
+    """
+    positions = catalog.positions(entries[food_column])
+    found = positions >= 0
+    # unknown foods (position -1) point at an extra NaN element
+    positions = np.where(found, positions, len(catalog))
+
+    def lookup(values:np.ndarray) -> np.ndarray:
+        return np.append(values, np.nan)[positions]
+
+    quantity = pd.to_numeric(entries[quantity_column], errors="coerce").to_numpy(dtype=float)
+    in_grams = (entries[serving_column] == "g").to_numpy(dtype=bool)
+    grams = np.where(in_grams, quantity, quantity * lookup(catalog.serving_weights))
+
+    facts = {"grams": grams}
+    for nutrient, per_100g in catalog.nutrients.items():
+        facts[nutrient] = lookup(per_100g) * grams / 100
+    return pd.DataFrame(facts, index=entries.index)
@@ -0,0 +1,106 @@
+from instrumentation import page_finish, page_start
+import streamlit as st
+import pandas as pd
+from metrics import exporter_port, metrics
+from quota import governor
+from warmup import warmup
+
+page_start("Admin")
+st.set_page_config(page_title="Admin", page_icon="🛠️")
+
+st.markdown("# Admin 🛠️")
+st.sidebar.header("Admin")
+st.write(
+    """
+    Where the time goes: page runs, sheet loads and Google Sheets API usage since the server was started.
+    """
+)
+
+snapshot = metrics.snapshot()
+
+def timings(name:str, labels:list) -> pd.DataFrame:
+    """
+    The histograms of one metric, with the quantiles in milliseconds.
+    """
+    df = pd.DataFrame(
+        [row for row in snapshot["histograms"] if row["name"] == name],
+        columns=["name", *labels, "count", "sum", "p50", "p95", "p99"],
+    )
+    for column in ["p50", "p95", "p99"]:
+        df[f"{column} (ms)"] = (df[column] * 1000).round(1)
+    df["mean (ms)"] = (df["sum"] / df["count"] * 1000).round(1)
+    return df[[*labels, "count", "mean (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)"]]
+
+st.write("### Page runs")
+st.dataframe(timings("health_tracker_page_run_seconds", ["page"]), hide_index=True)
+
+st.write("### Sheet loads")
+loads = timings("health_tracker_sheet_load_seconds", ["sheet", "result"])
+rows = pd.DataFrame(
+    [row for row in snapshot["gauges"] if row["name"] == "health_tracker_sheet_rows"],
+    columns=["sheet", "value"],
+).rename(columns={"value": "rows"})
+st.dataframe(loads.merge(rows, on="sheet", how="left"), hide_index=True)
+
+hits = loads.pivot_table(index="sheet", columns="result", values="count", aggfunc="sum", fill_value=0)
+if not hits.empty:
+    hits["hit ratio"] = (hits.get("hit", 0) + hits.get("stale", 0)) / hits.sum(axis=1)
+    st.write("Cache results per sheet (stale data is served right away and refreshed in the background).")
+    st.dataframe(hits)
+
+refreshes = pd.DataFrame(
+    [row for row in snapshot["counters"] if row["name"] == "health_tracker_sheet_refreshes_total"],
+    columns=["sheet", "result", "value"],
+)
+if not refreshes.empty:
+    st.write("Background refreshes per sheet (unchanged: the spreadsheet revision did not change, incremental: only new rows were downloaded).")
+    st.dataframe(refreshes.pivot_table(index="sheet", columns="result", values="value", aggfunc="sum", fill_value=0))
+
+st.write("### Sheet writes")
+st.dataframe(timings("health_tracker_sheet_write_seconds", ["sheet", "op"]), hide_index=True)
+
+st.write("### Google Sheets API")
+col1, col2 = st.columns(2)
+with col1:
+    st.write("Requests")
+    st.write(governor.stats())
+with col2:
+    api_bytes = pd.DataFrame(
+        [row for row in snapshot["counters"] if row["name"] == "health_tracker_api_bytes_total"],
+        columns=["sheet", "direction", "value"],
+    )
+    st.write("Bytes of cell values")
+    st.dataframe(
+        api_bytes.pivot_table(index="sheet", columns="direction", values="value", aggfunc="sum", fill_value=0),
+    )
+st.dataframe(timings("health_tracker_api_request_seconds", []), hide_index=True)
+
+st.write("### Cache warm-up")
+status = warmup.status()
+if status["state"] == "idle":
+    st.write("No warm-up since the server was started.")
+else:
+    progress = status["done"] / status["total"] if status["total"] else 1.
+    text = f"{status['done']}/{status['total']} sheets"
+    if status["state"] == "done":
+        text += f" in {status['seconds']} s"
+    st.progress(progress, text=text)
+    if status["failed"]:
+        st.write(f"Failed: {', '.join(status['failed'])}")
+
+st.divider()
+st.write("### Prometheus")
+if exporter_port:
+    st.write(f"Served at `http://<host>:{exporter_port}/metrics`.")
+else:
+    st.write("Set `HEALTH_TRACKER_METRICS_PORT` to serve these metrics to Prometheus.")
+text = metrics.prometheus()
+st.download_button("Download metrics", text, file_name="metrics.txt", mime="text/plain")
+with st.expander("Metrics in Prometheus text format"):
+    st.code(text, language="text")
+
+if st.button("Reset metrics"):
+    metrics.reset()
+    st.rerun()
+
+page_finish()
@@ -1,25 +1,33 @@
+from instrumentation import page_finish, page_start
 import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from google_sheets import GoogleSheetsInterface
+from storage import StaleRowsError, get_storage
 from local_cache import LocalCacheInterface
+from food_catalog import food_catalog
+from food_search import ingredient_counts, search_index
+from quota import governor
+import warmup
 
-gsheets = GoogleSheetsInterface()
+page_start("Manage")
+gsheets = get_storage()
 local = LocalCacheInterface()
 
-df_food_data = gsheets.load_google_sheet_data(sheet_name="food_data")
-df_available_tags = gsheets.load_google_sheet_data(sheet_name="available_tags")
-
-df_info = gsheets.load_google_sheet_data(sheet_name="recipe_info")
-df_tags = gsheets.load_google_sheet_data(sheet_name="recipe_tags")
-df_ingredients = gsheets.load_google_sheet_data(sheet_name="recipe_ingredients")
-df_instructions = gsheets.load_google_sheet_data(sheet_name="recipe_instructions")
-df_food_data = gsheets.load_google_sheet_data(sheet_name="food_data")
-df_available_tags = gsheets.load_google_sheet_data(sheet_name="available_tags")
+sheets = gsheets.load_many([
+    "recipe_info",
+    "recipe_tags",
+    "recipe_ingredients",
+    "recipe_instructions",
+    "available_tags",
+])
+df_info = sheets["recipe_info"]
+df_tags = sheets["recipe_tags"]
+df_ingredients = sheets["recipe_ingredients"]
+df_instructions = sheets["recipe_instructions"]
+catalog = food_catalog(gsheets)
+df_available_tags = sheets["available_tags"]
 
-df_new_recipe_info = local.load_from_local_cache("new_recipe_info")
-df_new_recipe_tags = local.load_from_local_cache("new_recipe_tags")
 df_new_recipe_ingredients = local.load_from_local_cache("new_recipe_ingredients")
 df_new_recipe_instructions = local.load_from_local_cache("new_recipe_instructions")
 
@@ -28,6 +36,14 @@ st.set_page_config(page_title="Manage Data", page_icon="📋")
 
 st.markdown("# View & Edit Data 📋")
 st.sidebar.header("Manage")
+
+status = gsheets.pending_writes()
+pending_writes = sum(status["pending"].values())
+if pending_writes:
+    st.sidebar.caption(f"⏳ {pending_writes} change(s) not yet saved to Google Sheets")
+dead_letters = sum(status["dead_letters"].values())
+if dead_letters:
+    st.sidebar.warning(f"⚠️ {dead_letters} change(s) could not be saved to Google Sheets, see Google Sheets API Usage")
 st.write(
     """
     Manage the data in the Google Sheet.
@@ -37,7 +53,14 @@ st.write(
 if st.button("Clear Cache"):
     gsheets.clear_cache()
     local.clear_cache()
-    st.success("Cache cleared successfully!")
+    warmup.start(gsheets, force=True)
+    st.success("Cache cleared successfully! The sheets are downloaded again in the background.")
+
+with st.expander("Google Sheets API Usage"):
+    st.write("Requests since the server was started.")
+    st.write(governor.stats())
+    st.write("Writes waiting to be saved to Google Sheets, and writes that were given up on (dead_letters).")
+    st.write(status)
 
 st.divider()
 
@@ -53,7 +76,7 @@ if mode == "Add":
     with col1:
         name = st.text_input("Name", value="")
     with col2:
-        type = st.selectbox("Type", options=df_food_data["Type"].unique())
+        type = st.selectbox("Type", options=catalog.types)
 
     st.write("##### Nutritional Value per 100g")
     col1, col2, col3, col4 = st.columns(4)
@@ -75,8 +98,7 @@ if mode == "Add":
         serving_size = st.number_input("Single Serving Size (g)", value=100)
 
     if st.button("Add Food Item"):
-        names = df_food_data["Name"].to_list()
-        if name in names:
+        if name in catalog:
             st.error(f"A food item with the name '{name}' already exists! Please use a different name.")
             st.stop()
         new_row = {
@@ -89,19 +111,21 @@ if mode == "Add":
             "Single Serving (g)": serving_size,
             "Type": type,
         }
-        df_food_data = pd.concat([df_food_data, pd.DataFrame([new_row])], ignore_index=True)
-        gsheets.update_google_sheet(sheet_name="food_data", updated_data=df_food_data)
+        gsheets.append_rows(sheet_name="food_data", new_rows=pd.DataFrame([new_row]))
         st.success("Food item added successfully!")
         st.rerun()
 
 elif mode == "Remove":
-    food_items = df_food_data["Name"].unique()
-    food_item = st.selectbox("Select a food item", food_items)
-    st.write(df_food_data[df_food_data["Name"] == food_item])
+    food_item = st.selectbox("Select a food item", catalog.names)
+    df_remove = catalog.rows(food_item)
+    st.write(df_remove)
 
     if st.button("Remove Food Item"):
-        df_food_data = df_food_data[df_food_data["Name"] != food_item]
-        gsheets.update_google_sheet(sheet_name="food_data", updated_data=df_food_data)
+        try:
+            gsheets.delete_rows(sheet_name="food_data", indices=df_remove.index)
+        except StaleRowsError:
+            st.error("The sheet changed in Google Sheets since it was loaded, nothing was changed. Please try again.")
+            st.stop()
         st.success("Food item removed successfully!")
         st.rerun()
 
@@ -121,8 +145,7 @@ if mode == "Add":
         new_row = {
             "tag": tag
         }
-        df_available_tags = pd.concat([df_available_tags, pd.DataFrame([new_row])], ignore_index=True)
-        gsheets.update_google_sheet(sheet_name="available_tags", updated_data=df_available_tags)
+        gsheets.append_rows(sheet_name="available_tags", new_rows=pd.DataFrame([new_row]))
         st.success("Tag added successfully!")
         st.rerun()
 elif mode == "Remove":
@@ -130,8 +153,12 @@ elif mode == "Remove":
     tag = st.selectbox("Select a tag", tags)
 
     if st.button("Remove Tag"):
-        df_available_tags = df_available_tags[df_available_tags["tag"] != tag]
-        gsheets.update_google_sheet(sheet_name="available_tags", updated_data=df_available_tags)
+        df_remove = df_available_tags[df_available_tags["tag"] == tag]
+        try:
+            gsheets.delete_rows(sheet_name="available_tags", indices=df_remove.index)
+        except StaleRowsError:
+            st.error("The sheet changed in Google Sheets since it was loaded, nothing was changed. Please try again.")
+            st.stop()
         st.success("Tag removed successfully!")
         st.rerun()
 
@@ -159,13 +186,23 @@ if mode == "Add":
 
         col1, col2, col3 = st.columns(3)
         with col1:
-            ingredient = st.selectbox("Ingredient", df_food_data["Name"].unique())
+            query = st.text_input("Search Ingredient", placeholder="Search Ingredient")
+            # foods used in many recipes first
+            counts = ingredient_counts(gsheets)
+            options = search_index(catalog).search(query, counts)
+            if not options:
+                st.caption("No matching foods, showing the most used ones")
+                options = search_index(catalog).search("", counts)
+            ingredient = st.selectbox("Ingredient", options)
+            if ingredient is None:
+                st.warning("There are no foods yet, add one first.")
+                st.stop()
             # b1 = st.button("Add Ingredient")
         with col2:
             quantity = st.number_input("Quantity", min_value=0.0, step=0.1, value=1.0)
             # b2 = st.button("Clear Ingredients")
         with col3:
-            serving = st.selectbox("Serving", [df_food_data.loc[df_food_data["Name"] == ingredient, "Serving Name"].values[0], "g"])
+            serving = st.selectbox("Serving", [catalog.serving_name(ingredient), "g"])
 
 
         if st.button("Add Ingredient"):
@@ -174,12 +211,7 @@ if mode == "Add":
                 [[ingredient, quantity, serving]],
                 columns=["ingredient", "quantity", "serving"]
             )
-            if df_new_recipe_ingredients.empty:
-                df_new_recipe_ingredients = df_new_row
-            else:
-                df_new_recipe_ingredients = pd.concat([df_new_recipe_ingredients, df_new_row])
-
-            local.update_local_cache("new_recipe_ingredients", df_new_recipe_ingredients)
+            local.append_to_local_cache("new_recipe_ingredients", df_new_row)
             st.rerun()
 
 
@@ -214,15 +246,10 @@ if mode == "Add":
         df_new_recipe_ingredients = df_new_recipe_ingredients[["name", "ingredient", "quantity", "serving"]]
         df_new_recipe_instructions = df_new_recipe_instructions[["name", "instruction"]]
 
-        df_info = pd.concat([df_info, df_new_recipe_info])
-        df_tags = pd.concat([df_tags, df_new_recipe_tags])
-        df_ingredients = pd.concat([df_ingredients, df_new_recipe_ingredients])
-        df_instructions = pd.concat([df_instructions, df_new_recipe_instructions])
-
-        gsheets.update_google_sheet("recipe_info", df_info)
-        gsheets.update_google_sheet("recipe_tags", df_tags)
-        gsheets.update_google_sheet("recipe_ingredients", df_ingredients)
-        gsheets.update_google_sheet("recipe_instructions", df_instructions)
+        gsheets.append_rows("recipe_info", df_new_recipe_info)
+        gsheets.append_rows("recipe_tags", df_new_recipe_tags)
+        gsheets.append_rows("recipe_ingredients", df_new_recipe_ingredients)
+        gsheets.append_rows("recipe_instructions", df_new_recipe_instructions)
         st.success("Recipe saved successfully!")
 
 
@@ -231,15 +258,14 @@ elif mode == "Remove":
     recipe_name = st.selectbox("Select a recipe", recipe_names)
 
     if st.button("Remove Recipe"):
-        df_info = df_info[df_info["name"] != recipe_name]
-        df_tags = df_tags[df_tags["name"] != recipe_name]
-        df_ingredients = df_ingredients[df_ingredients["name"] != recipe_name]
-        df_instructions = df_instructions[df_instructions["name"] != recipe_name]
-
-        gsheets.update_google_sheet("recipe_info", df_info)
-        gsheets.update_google_sheet("recipe_tags", df_tags)
-        gsheets.update_google_sheet("recipe_ingredients", df_ingredients)
-        gsheets.update_google_sheet("recipe_instructions", df_instructions)
+        try:
+            gsheets.delete_rows("recipe_info", df_info[df_info["name"] == recipe_name].index)
+            gsheets.delete_rows("recipe_tags", df_tags[df_tags["name"] == recipe_name].index)
+            gsheets.delete_rows("recipe_ingredients", df_ingredients[df_ingredients["name"] == recipe_name].index)
+            gsheets.delete_rows("recipe_instructions", df_instructions[df_instructions["name"] == recipe_name].index)
+        except StaleRowsError:
+            st.error("The recipe changed in Google Sheets since it was loaded, it may be partly removed. Please try again.")
+            st.stop()
         st.success("Recipe removed successfully!")
         st.rerun()
 
@@ -260,5 +286,11 @@ data = gsheets.load_google_sheet_data(sheet_name=sheet_name)
 df = st.data_editor(data, num_rows="dynamic")
 
 if st.button("Save Changes"):
-    gsheets.update_google_sheet(sheet_name=sheet_name, updated_data=df)
+    try:
+        gsheets.sync_changes(sheet_name=sheet_name, original_data=data, updated_data=df)
+    except StaleRowsError:
+        st.error("The sheet changed in Google Sheets since it was loaded, not all changes were saved. Please try again.")
+        st.stop()
     st.success("Google Sheet updated successfully!")
+
+page_finish()
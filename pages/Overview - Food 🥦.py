@@ -1,11 +1,17 @@
+from instrumentation import page_finish, page_start
 import streamlit as st
 import pandas as pd
-from google_sheets import GoogleSheetsInterface
+from storage import StaleRowsError, get_storage
 from datetime import datetime
-import time
-from gspread.exceptions import APIError
+from quota import api_error
+from food_catalog import food_catalog
+from daily_aggregates import aggregates
+from nutrition import nutrition_facts
+from energy import allowances, energy_burned
+from food_search import food_counts, search_index
 
-gsheets = GoogleSheetsInterface()
+page_start("Food")
+gsheets = get_storage()
 
 st.set_page_config(
     page_title="Food Overview",
@@ -15,37 +21,38 @@ st.set_page_config(
 st.write("# Food Overview 🥦")
 st.write("View and Log Food and Calorie Intake")
 
+pending_writes = sum(gsheets.pending_writes()["pending"].values())
+if pending_writes:
+    st.sidebar.caption(f"⏳ {pending_writes} change(s) not yet saved to Google Sheets")
+
 who = st.pills("Who", options=["Bela", "Marleen"], default="Bela", selection_mode="single")
 date = st.date_input("Date", value=pd.to_datetime("today"))
 date = date.strftime("%Y-%m-%d")
 
 try:
-    df_food_data = gsheets.load_google_sheet_data(sheet_name="food_data")
-    df_food_log = gsheets.load_google_sheet_data(sheet_name=f"food_log_{who.lower()}")
-    df_weight_log = gsheets.load_google_sheet_data(sheet_name=f"weight_log_{who.lower()}")
-    df_info = gsheets.load_google_sheet_data(sheet_name=f"info_{who.lower()}")
-    df_target = gsheets.load_google_sheet_data(sheet_name=f"target_{who.lower()}")
-except APIError as e:
-    st.warning("Exceeded Google Sheets API quota. Please wait...")
-    time.sleep(10)
-
-
-def calc_weight(row):
-    if row["serving"]=="g":
-        return row["quantity"]
-    else:
-        return row["quantity"] * row["Single Serving (g)"]
-
-def calc_total_calories(row):
-    return round(row["weight"] * row["Calories (kcal)"]/100, 0)
-
-# filter for a single day
-df_day = df_food_log[(df_food_log["date"]==date)]
-
-# Add relevant food data
-df_day = df_day.merge(df_food_data, left_on="name", right_on="Name", how="left")
-df_day["weight"] = df_day.apply(calc_weight, axis=1)
-df_day["total_calories"] = df_day.apply(calc_total_calories, axis=1)
+    sheets = gsheets.load_many([
+        f"weight_log_{who.lower()}",
+        f"info_{who.lower()}",
+        f"target_{who.lower()}",
+    ])
+    catalog = food_catalog(gsheets)
+    counts = food_counts(gsheets, who.lower())
+    # only the selected day, the backend can filter it without loading the whole log
+    df_food_log = gsheets.query(f"food_log_{who.lower()}", date=date)
+    df_weight_log = sheets[f"weight_log_{who.lower()}"]
+    df_info = sheets[f"info_{who.lower()}"]
+    df_target = sheets[f"target_{who.lower()}"]
+except api_error() as e:
+    st.error("Exceeded Google Sheets API quota. Please try again in a minute.")
+    st.stop()
+
+
+df_day = df_food_log.copy()
+
+# Add weight and calories from the food data
+facts = nutrition_facts(df_day, catalog)
+df_day["weight"] = facts["grams"]
+df_day["total_calories"] = facts["kcal"].round(0)
 
 # rename columns to be displayed
 df_day = df_day.rename(columns={
@@ -67,25 +74,6 @@ calories_by_meal.columns = calories_by_meal.iloc[0]
 calories_by_meal = calories_by_meal[1:]
 calories_by_meal.reset_index(drop=True, inplace=True)
 
-def calculate_energy_burned(weight, height, birthday, exercise_level, sex):
-    exercise_map = {
-        0: 1.2,
-        1: 1.375,
-        2: 1.4625,
-        3: 1.55,
-        4: 1.725,
-        5: 1.9
-    }
-
-    sex_correction = {
-        "M": 5,
-        "F": -161
-    }
-
-    age = (datetime.today() - birthday).days / 365
-    BMR = 10 * weight + 6.25 * height - 5 * age
-    return (BMR + sex_correction[sex]) * exercise_map[exercise_level]
-
 height = df_info["height"].values[0]
 birthday = pd.to_datetime(df_info["birthday"].values[0])
 sex = df_info["sex"].values[0]
@@ -114,7 +102,7 @@ st.write("""
 # """)
 
 current_weight = float(df_weight_log["weight"].values[-1])
-capacity = calculate_energy_burned(current_weight, height, birthday, exercise_level, sex)
+capacity = energy_burned(current_weight, height, birthday, exercise_level, sex)
 target = df_target["target"].values[0]
 capacity = capacity - target
 
@@ -174,20 +162,23 @@ for icon, meal, df in meals:
             st.write("### Add Food")
             col1, col2, col3 = st.columns(3)
             with col1:
-                name = st.selectbox("Food Name", options=df_food_data.sort_values(by="Name")["Name"], key=f"name_{meal}", placeholder="Select Food", label_visibility="hidden")
+                # only the best matches are sent to the browser, not the whole catalog
+                query = st.text_input("Search Food", key=f"search_{meal}", placeholder="Search Food", label_visibility="hidden")
+                options = search_index(catalog).search(query, counts)
+                if not options:
+                    st.caption("No matching foods, showing the most logged ones")
+                    options = search_index(catalog).search("", counts)
+                name = st.selectbox("Food Name", options=options, key=f"name_{meal}", placeholder="Select Food", label_visibility="hidden")
+                if name is None:
+                    st.warning("There are no foods yet, add one on the Manage page first.")
+                    st.stop()
             with col2:
                 quantity = st.number_input("Servings", min_value=0., step=0.01, value=1.0, key=f"quantity_{meal}", label_visibility="hidden")
             with col3:
-                serving = st.selectbox("Serving Type", options=[df_food_data.loc[df_food_data["Name"] == name, "Serving Name"].values[0], "g"], key=f"serving+{meal}", label_visibility="hidden")
-            if serving == "g":
-                # quantity = st.number_input("Quantity (g)", min_value=0, step=1, value=100, key=f"quantity_{meal}")
-                weight = quantity
-            else:
-                # quantity = st.number_input("Servings", min_value=0., step=0.01, value=1.0, key=f"quantity_{meal}")
-                weight = (quantity * df_food_data[df_food_data["Name"]==name]["Single Serving (g)"]).values[0]
-
-            kcal_per_100g = df_food_data[df_food_data["Name"]==name]["Calories (kcal)"].values[0]
-            kcal = (kcal_per_100g * weight) / 100
+                serving = st.selectbox("Serving Type", options=[catalog.serving_name(name), "g"], key=f"serving+{meal}", label_visibility="hidden")
+            entry = nutrition_facts(pd.DataFrame([{"name": name, "quantity": quantity, "serving": serving}]), catalog)
+            weight = entry["grams"].values[0]
+            kcal = entry["kcal"].values[0]
             st.write(" ")
             # st.write(" ")
             st.write(f"**Weight: ", weight, " g**")
@@ -204,11 +195,11 @@ for icon, meal, df in meals:
                     "quantity": quantity,
                     "serving": serving,
                 }
-                df_food_log = pd.concat([df_food_log, pd.DataFrame([new_row])], ignore_index=True)
-
-                gsheets.update_google_sheet(
-                    sheet_name=f"food_log_{who.lower()}",
-                    updated_data=df_food_log
+                # also adds the entry to the daily totals
+                aggregates.append_rows(
+                    gsheets,
+                    user=who.lower(),
+                    new_rows=pd.DataFrame([new_row])
                 )
                 st.success("Food log added successfully!")
                 st.rerun()
@@ -221,15 +212,71 @@ for icon, meal, df in meals:
                 food_name = food_to_remove.split(":")[1].split(",")[0].strip()
                 food_quantity = float(food_to_remove.split(",")[1].split(" ")[1])
 
-                df_remove = df_food_log[df_food_log["date"]==date]
-                df_remove = df_remove[df_remove["meal"]==meal]
+                df_remove = df_food_log[df_food_log["meal"]==meal]
                 df_remove = df_remove[df_remove["name"]==food_name]
-                df_food_log = df_food_log.drop(df_remove.index)
 
-                gsheets.update_google_sheet(
-                    sheet_name=f"food_log_{who.lower()}",
-                    updated_data=df_food_log
-                )
+                try:
+                    aggregates.delete_rows(
+                        gsheets,
+                        user=who.lower(),
+                        rows=df_remove
+                    )
+                except StaleRowsError:
+                    st.error("The sheet changed in Google Sheets since it was loaded, nothing was changed. Please try again.")
+                    st.stop()
 
                 st.success("Food log removed successfully!")
                 st.rerun()
+
+st.divider()
+
+st.write("### 📅 Intake Over Time")
+period = st.pills("Period", options=["Last N Days", "Week", "Month", "Custom"], default="Last N Days", selection_mode="single", key="period")
+selected = pd.to_datetime(date)
+today = pd.to_datetime("today").normalize()
+if period == "Week":
+    start = selected - pd.Timedelta(days=selected.weekday())
+    end = start + pd.Timedelta(days=6)
+elif period == "Month":
+    start = selected.replace(day=1)
+    end = start + pd.offsets.MonthEnd(0)
+elif period == "Custom":
+    dates = st.date_input("Dates", value=(selected - pd.Timedelta(days=29), selected), key="range_dates")
+    start, end = (pd.to_datetime(dates[0]), pd.to_datetime(dates[-1])) if dates else (selected, selected)
+else:
+    n_days = st.number_input("Days", min_value=1, max_value=3650, value=7, step=1, key="range_days")
+    start, end = selected - pd.Timedelta(days=n_days - 1), selected
+end = min(end, max(today, selected))
+date_range = (start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+
+# one pass over the materialized totals of the range, see daily_aggregates.py
+df_range = aggregates.daily(gsheets, who.lower(), catalog, date_range)
+if df_range.empty:
+    st.write(f"No food logged from {date_range[0]} to {date_range[1]}.")
+else:
+    df_days = df_range.groupby(level="date").sum()
+    df_days["allowed"] = allowances(df_days.index, df_weight_log, df_info, target, exercise_level)
+    df_days["deficit"] = df_days["allowed"] - df_days["kcal"]
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Days Logged", len(df_days))
+    col2.metric("Average Intake", f"{round(df_days['kcal'].mean())} kcal")
+    col3.metric("Total Deficit", f"{round(df_days['deficit'].sum())} kcal")
+
+    df_meals = df_range["kcal"].unstack("meal").reindex(columns=["Breakfast", "Lunch", "Dinner", "Snack"]).fillna(0)
+    df_meals.columns = ["1. 🍌 Breakfast", "2. 🥗 Lunch", "3. 🥗 Dinner", "4. 🍙 Snack"]
+    st.bar_chart(df_meals, color=("#bababa", "#9f9f9f", "#616161", "#4b4b4b"))
+
+    st.write("Daily totals (days without entries are left out)")
+    df_days = df_days.rename(columns={
+        "entries": "Entries",
+        "kcal": "Calories (kcal)",
+        "fat": "Fat (g)",
+        "carbs": "Carbs (g)",
+        "protein": "Protein (g)",
+        "allowed": "Allowed (kcal)",
+        "deficit": "Deficit (kcal)",
+    })
+    st.dataframe(df_days.drop(columns="grams").round(0))
+
+page_finish()
@@ -1,18 +1,22 @@
+from instrumentation import page_finish, page_start
 import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from google_sheets import GoogleSheetsInterface
-import plotly.express as px
-from scipy.interpolate import make_interp_spline, splrep, splev
+from storage import StaleRowsError, get_storage
 
-gsheets = GoogleSheetsInterface()
+page_start("Weight")
+gsheets = get_storage()
 
 st.set_page_config(page_title="Weight Overview", page_icon="🐖")
 
 st.markdown("# Weight Overview 🐖")
 st.write("View and log your weight.")
 
+pending_writes = sum(gsheets.pending_writes()["pending"].values())
+if pending_writes:
+    st.sidebar.caption(f"⏳ {pending_writes} change(s) not yet saved to Google Sheets")
+
 who = st.pills("Who", options=["Bela", "Marleen"], default="Bela", selection_mode="single")
 df_weight_log = gsheets.load_google_sheet_data(sheet_name=f"weight_log_{who.lower()}")
 
@@ -25,10 +29,15 @@ df = df_weight_log.rename(columns={"date": "Date", "weight": "Weight (kg)", "mov
 df_weight_log_plot = df_weight_log.copy()
 df_weight_log_plot = df_weight_log_plot.sort_values(by="date")
 
-x = pd.to_datetime(df_weight_log_plot["date"])
+# nanoseconds, which splrep converts to floats (pandas 3 defaults to microseconds)
+x = pd.to_datetime(df_weight_log_plot["date"]).astype("datetime64[ns]")
 y = df_weight_log_plot["weight"]
 y_avg = df_weight_log_plot["moving_average"]
 
+# scipy and plotly are slow to import, only import them once there is data to plot
+from scipy.interpolate import splrep, splev
+import plotly.express as px
+
 tck = splrep(x, y_avg, s=3)
 x_smooth = x
 y_smooth = splev(x_smooth, tck, der=0)
@@ -51,7 +60,6 @@ st.write(df)
 st.write(f"### Log Weight")
 mode = st.pills("Mode", ["Add", "Remove"], default="Add", selection_mode="single")
 if mode == "Add":
-    df_weight_log = df_weight_log[["date", "weight"]]
     date = st.date_input("Date", value=datetime.today().date())
     weight = st.slider("Weight (kg)", min_value=current_weight-5, max_value=current_weight+5, value=current_weight, step=0.1)
     # weight = st.number_input("Weight (kg)", min_value=current_weight, step=0.1)
@@ -60,15 +68,15 @@ if mode == "Add":
         "date": date.strftime("%Y-%m-%d"),
         "weight": weight
     }
-    df_weight_log = pd.concat([df_weight_log, pd.DataFrame([new_row])], ignore_index=True)
+    df_new_row = pd.DataFrame([new_row])
 
     if st.button("Add Weight"):
         st.write("updated data:")
-        st.dataframe(df_weight_log.tail(1))
+        st.dataframe(df_new_row)
 
-        gsheets.update_google_sheet(
+        gsheets.append_rows(
             sheet_name=f"weight_log_{who.lower()}",
-            updated_data=df_weight_log
+            new_rows=df_new_row
         )
         st.success("Weight log added successfully!")
         st.rerun()
@@ -83,12 +91,18 @@ elif mode == "Remove":
     # weight = st.number_input("Weight (kg)", min_value=current_weight, step=0.1)
 
     if st.button("Remove Weight"):
-        df_weight_log = df_weight_log[~((df_weight_log["date"] == date.strftime("%Y-%m-%d")) & (df_weight_log["weight"] == weight))]
+        df_remove = df_weight_log[(df_weight_log["date"] == date.strftime("%Y-%m-%d")) & (df_weight_log["weight"] == weight)]
 
-        gsheets.update_google_sheet(
-            sheet_name=f"weight_log_{who.lower()}",
-            updated_data=df_weight_log
-        )
+        try:
+            gsheets.delete_rows(
+                sheet_name=f"weight_log_{who.lower()}",
+                indices=df_remove.index
+            )
+        except StaleRowsError:
+            st.error("The sheet changed in Google Sheets since it was loaded, nothing was changed. Please try again.")
+            st.stop()
 
         st.success("Weight log removed successfully!")
         st.rerun()
+
+page_finish()
@@ -1,25 +1,29 @@
+from instrumentation import page_finish, page_start
 import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from google_sheets import GoogleSheetsInterface
-from local_cache import LocalCacheInterface
+from storage import get_storage
+from food_catalog import food_catalog
+from nutrition import nutrition_facts
 import os
 
-gsheets = GoogleSheetsInterface()
-local = LocalCacheInterface()
+page_start("Recipes")
+gsheets = get_storage()
 
-df_info = gsheets.load_google_sheet_data(sheet_name="recipe_info")
-df_tags = gsheets.load_google_sheet_data(sheet_name="recipe_tags")
-df_ingredients = gsheets.load_google_sheet_data(sheet_name="recipe_ingredients")
-df_instructions = gsheets.load_google_sheet_data(sheet_name="recipe_instructions")
-df_food_data = gsheets.load_google_sheet_data(sheet_name="food_data")
-df_available_tags = gsheets.load_google_sheet_data(sheet_name="available_tags")
-
-df_new_recipe_info = local.load_from_local_cache("new_recipe_info")
-df_new_recipe_tags = local.load_from_local_cache("new_recipe_tags")
-df_new_recipe_ingredients = local.load_from_local_cache("new_recipe_ingredients")
-df_new_recipe_instructions = local.load_from_local_cache("new_recipe_instructions")
+sheets = gsheets.load_many([
+    "recipe_info",
+    "recipe_tags",
+    "recipe_ingredients",
+    "recipe_instructions",
+    "available_tags",
+])
+df_info = sheets["recipe_info"]
+df_tags = sheets["recipe_tags"]
+df_ingredients = sheets["recipe_ingredients"]
+df_instructions = sheets["recipe_instructions"]
+catalog = food_catalog(gsheets)
+df_available_tags = sheets["available_tags"]
 
 
 st.set_page_config(page_title="Recipes", page_icon="📖")
@@ -38,6 +42,9 @@ df_names = df_tags.groupby("name").filter(lambda x: set(tags).issubset(set(x["ta
 
 names = df_names["name"].unique()
 
+# weight and calories of every ingredient for one serving, scaled per recipe below
+df_ingredient_facts = nutrition_facts(df_ingredients, catalog, food_column="ingredient")
+
 for recipe_name in names:
     d1 = df_tags[df_tags["name"] == recipe_name]
     d2 = df_info[df_info["name"] == recipe_name]
@@ -74,18 +81,13 @@ for recipe_name in names:
         st.header("Ingredients")
         n_servings = st.slider("Number of servings", min_value=1, max_value=10, value=2, key=f"serving_{recipe_name}")
 
-        def calc_weight(row):
-            if row["serving"] == "g":
-                return row["quantity"]
-            else:
-                return row["quantity"] * row["Single Serving (g)"]
-
-        df3 = d3.merge(df_food_data, left_on="ingredient", right_on="Name", how="left")
+        facts = df_ingredient_facts.loc[d3.index] * n_servings
+        df3 = d3.copy()
         df3["quantity"] = df3["quantity"]*n_servings
-        df3["weight"] = df3.apply(calc_weight, axis=1)
-        df3["calories"] = df3["Calories (kcal)"] * df3["weight"] / 100
+        df3["weight"] = facts["grams"]
+        df3["calories"] = facts["kcal"]
 
-        df3 = df3[["ingredient", "quantity", "serving", "weight", "calories"]]
+        df3 = df3[["ingredient", "quantity", "serving", "weight", "calories"]].reset_index(drop=True)
         df3 = df3.rename(columns={"ingredient": "Ingredient", "quantity": "Quantity", "serving": "Serving", "weight": "Weight (g)", "calories": "Calories (kcal)"})
         st.write(df3)
 
@@ -97,3 +99,5 @@ for recipe_name in names:
         st.header("Instructions")
         instructions = d4["instruction"].to_list()
         st.write("".join(f"* {instruction} \n" for instruction in instructions))
+
+page_finish()
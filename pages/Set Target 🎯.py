@@ -1,10 +1,12 @@
+from instrumentation import page_finish, page_start
 import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from google_sheets import GoogleSheetsInterface
+from storage import get_storage
 
-gsheets = GoogleSheetsInterface()
+page_start("Set Target")
+gsheets = get_storage()
 
 
 
@@ -21,8 +23,9 @@ st.write(
 )
 who = st.selectbox("Who", options=["Bela", "Marleen"])
 
-df_target = gsheets.load_google_sheet_data(sheet_name=f"target_{who.lower()}")
-df_weight = gsheets.load_google_sheet_data(sheet_name=f"weight_log_{who.lower()}")
+sheets = gsheets.load_many([f"target_{who.lower()}", f"weight_log_{who.lower()}"])
+df_target = sheets[f"target_{who.lower()}"]
+df_weight = sheets[f"weight_log_{who.lower()}"]
 
 target = df_target["target"].values[0]
 st.write(f"#### Current Goal: {target} kcal deficit")
@@ -85,3 +88,5 @@ if st.button("Set Manual Calorie Goal"):
         updated_data=df_target
     )
     st.success("Calorie goal set successfully!")
+
+page_finish()
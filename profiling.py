@@ -0,0 +1,240 @@
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Dict, Optional, Tuple
+
+# profile every page run
+enabled = os.environ.get("HEALTH_TRACKER_PROFILE", "0") == "1"
+# directory the profiles are written to
+profile_path = os.environ.get("HEALTH_TRACKER_PROFILE_DIR", "profiles")
+
+REPOSITORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class PageProfile:
+    """
+    Profile of one run of a page.
+
+    Two profilers run while the page runs, both only looking at the thread
+    that runs the page:
+
+    * cProfile (deterministic), saved as a pstats file for
+      `python -m pstats` or snakeviz
+    * a sampler that records the call stack every interval seconds, saved
+      as collapsed stacks ("frame;frame;frame count" lines) for flamegraph
+      tools such as flamegraph.pl or speedscope
+
+    Frames are named after the module they are in: our modules by their
+    path in the repository (google_sheets, local_cache, pages/Recipes 📖),
+    other code by its package (streamlit, pandas). Stacks start at the page
+    script, the Streamlit frames that run it are left out. Every sample is
+    also attributed to the innermost of our modules on its stack, so time
+    spent in e.g. pandas is counted for the module that called it.
+    """
+
+    interval = 0.005
+
+    def __init__(self, page_name:str):
+        self.page_name = page_name
+        self.thread_id = threading.get_ident()
+        self.samples: Counter = Counter()
+        self.profiler = cProfile.Profile()
+        self.started = None
+        self.duration = None
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="page-profiler", daemon=True)
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self._sampler.start()
+        self.profiler.enable()
+
+    def stop(self) -> None:
+        self.profiler.disable()
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self.started
+
+    def save(self, directory:str) -> dict:
+        """
+        Write the profile to directory.
+
+        Returns:
+            summary (dict): The page, duration, the files written, the time
+                per module of ours (from the samples) and the functions of
+                our modules with the highest cumulative time (from cProfile)
+        """
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r"[^a-z0-9]+", "-", self.page_name.lower()).strip("-")
+        base = f"{directory}/{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{self.thread_id}"
+
+        self.profiler.dump_stats(f"{base}.pstats")
+        with open(f"{base}.collapsed", "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{';'.join(label for label, _ in stack)} {count}\n")
+
+        summary = {
+            "page": self.page_name,
+            "duration_s": round(self.duration, 3),
+            "samples": sum(self.samples.values()),
+            "pstats": f"{base}.pstats",
+            "collapsed": f"{base}.collapsed",
+            "modules_s": self.module_times(),
+            "functions_s": self.function_times(),
+        }
+        with open(f"{base}.json", "w") as file:
+            json.dump(summary, file, indent=2)
+        return summary
+
+    def module_times(self) -> Dict[str, float]:
+        """
+        Seconds per module of ours, attributing every sample to the
+        innermost of our modules on its stack.
+        """
+        total = sum(self.samples.values())
+        if total == 0:
+            return {}
+        times = Counter()
+        for stack, count in self.samples.items():
+            owner = next((module for _, module in reversed(stack) if module is not None), "(other)")
+            times[owner] += count
+        return {module: round(count / total * self.duration, 4) for module, count in times.most_common()}
+
+    def function_times(self, limit:int=20) -> Dict[str, float]:
+        """
+        Cumulative seconds of the functions in our modules, highest first.
+        """
+        import pstats
+        stats = pstats.Stats(self.profiler).stats
+        ours = [
+            (f"{_module(filename)}:{function}:{line}", cumulative)
+            for (filename, line, function), (_, _, _, cumulative, _) in stats.items()
+            if _module(filename) is not None
+        ]
+        ours.sort(key=lambda item: item[1], reverse=True)
+        return {name: round(cumulative, 4) for name, cumulative in ours[:limit]}
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_stack(frame)] += 1
+
+
+_active = threading.Lock()
+
+
+def requested() -> bool:
+    """
+    Whether the current page run should be profiled: always with
+    HEALTH_TRACKER_PROFILE=1, otherwise when the page url has ?profile=1.
+    """
+    if enabled:
+        return True
+    import streamlit as st
+    return st.query_params.get("profile") == "1"
+
+
+def start(page_name:str) -> Optional[PageProfile]:
+    """
+    Start profiling a page run.
+
+    Returns:
+        profile (PageProfile | None): The profile, or None if another page
+            run is being profiled (Python allows one profiler at a time)
+    """
+    if not _active.acquire(blocking=False):
+        print(f"Not profiling {page_name}, another page run is being profiled")
+        return None
+    profile = PageProfile(page_name)
+    profile.start()
+    return profile
+
+
+def finish(profile:PageProfile) -> dict:
+    """
+    Stop a profile, save it to profile_path and print where it went.
+
+    Returns:
+        summary (dict): See PageProfile.save
+    """
+    try:
+        profile.stop()
+    finally:
+        _active.release()
+    summary = profile.save(profile_path)
+    print(f"Page profile: {json.dumps(summary)}")
+    return summary
+
+
+def show(summary:dict) -> None:
+    """
+    Show where a profile was saved, and its time per module, in the sidebar.
+
+    A profile requested with ?profile=1 covers a single run, so the query
+    parameter is removed again.
+    """
+    import streamlit as st
+    if not enabled:
+        st.query_params.pop("profile", None)
+    with st.sidebar.expander("Profile"):
+        st.write(f"Saved to `{summary['pstats']}` and `{summary['collapsed']}`")
+        st.write("Seconds per module")
+        st.write(summary["modules_s"])
+
+
+def _stack(frame:FrameType) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """
+    The call stack of frame, outermost first, as (label, module of ours)
+    pairs, starting at the outermost frame of our modules (the page script).
+    """
+    stack = []
+    while frame is not None:
+        stack.append(_frame(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    first = next((i for i, (_, module) in enumerate(stack) if module is not None), 0)
+    return tuple(stack[first:])
+
+
+_frames: Dict[CodeType, Tuple[str, Optional[str]]] = {}
+
+
+def _frame(code:CodeType) -> Tuple[str, Optional[str]]:
+    frame = _frames.get(code)
+    if frame is None:
+        module = _module(code.co_filename)
+        frame = _frames[code] = (f"{module or _package(code.co_filename)}:{code.co_name}", module)
+    return frame
+
+
+def _module(filename:str) -> Optional[str]:
+    """
+    The name of one of our modules (e.g. google_sheets or pages/Recipes 📖),
+    or None if filename is not part of the repository.
+    """
+    path = os.path.abspath(filename)
+    if not path.startswith(REPOSITORY + os.sep) or not path.endswith(".py") or "site-packages" in path:
+        return None
+    return os.path.relpath(path, REPOSITORY)[:-len(".py")].replace(os.sep, "/")
+
+
+def _package(filename:str) -> str:
+    """
+    The top-level package of a file outside the repository, e.g. streamlit.
+    """
+    parts = filename.replace("\\", "/").split("/")
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            index = parts.index(marker)
+            if index + 1 < len(parts):
+                return parts[index + 1].removesuffix(".py")
+    if filename.startswith("<"):
+        return filename # e.g. <frozen importlib._bootstrap>
+    return parts[-1].removesuffix(".py") # standard library
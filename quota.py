@@ -0,0 +1,192 @@
+import os
+import random
+import threading
+import time
+from typing import Callable, Hashable, TypeVar
+from instrumentation import lazy_import
+from metrics import metrics
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Holds up to capacity tokens and gains refill_rate tokens per second.
+    Every request takes one token, waiting for it if the bucket is empty.
+    """
+
+    def __init__(self, capacity:float, refill_rate:float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Take a token, waiting until one is available.
+
+        Returns:
+            waited (float): Seconds spent waiting for the token
+        """
+        waited = 0.
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.refill_rate
+            time.sleep(delay)
+            waited += delay
+
+    def available(self) -> float:
+        """
+        The number of tokens in the bucket right now, without taking one.
+        """
+        with self._lock:
+            return min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.refill_rate)
+
+
+class _Flight:
+    """
+    A request that is in progress, shared by every caller asking for the same key.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RateGovernor:
+    """
+    Client-side quota handling for the Google Sheets API.
+
+    One governor is shared by every session of the process, and every API
+    request goes through it:
+
+    * a token bucket keeps the request rate below the per-minute quota
+    * requests rejected with 429 (quota exceeded) are retried with
+      exponential backoff and jitter
+    * concurrent requests with the same key (e.g. two sessions loading the
+      same sheet) are coalesced into a single request
+
+    The counters returned by stats() show how many requests were sent,
+    coalesced, throttled (had to wait for a token) and retried.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute:int=60,
+        max_retries:int=5,
+        base_delay:float=1.,
+        max_delay:float=32.,
+    ):
+        self.bucket = TokenBucket(capacity=requests_per_minute, refill_rate=requests_per_minute/60)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {"calls": 0, "coalesced": 0, "throttled": 0, "retries": 0}
+
+    def call(self, request:Callable[[], T], key:Hashable=None) -> T:
+        """
+        Send an API request.
+
+        Args:
+            request (Callable[[], T]): Function that sends the request
+            key (Hashable): Requests with equal keys that run at the same
+                time share one request and its result. Only use keys for
+                reads; writes must leave key as None.
+
+        Returns:
+            The return value of request
+        """
+        if key is None:
+            return self._send(request)
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            metrics.inc("health_tracker_api_requests_total", kind="coalesced")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._send(request)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self) -> dict:
+        """
+        Counters of the requests handled so far.
+
+        Returns:
+            stats (dict): calls (requests sent), coalesced (requests that
+                shared another request's result), throttled (requests that
+                waited for a token) and retries (resends after a 429)
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def _send(self, request:Callable[[], T]) -> T:
+        with metrics.time("health_tracker_api_request_seconds"):
+            return self._send_with_retries(request)
+
+    def _send_with_retries(self, request:Callable[[], T]) -> T:
+        for attempt in range(self.max_retries + 1):
+            if self.bucket.acquire() > 0:
+                self._count("throttled")
+            self._count("calls")
+            try:
+                return request()
+            except api_error() as e:
+                if e.response.status_code != 429 or attempt == self.max_retries:
+                    raise
+            self._count("retries")
+            delay = min(self.max_delay, self.base_delay * 2**attempt)
+            time.sleep(random.uniform(delay/2, delay))
+
+    def _count(self, counter:str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
+        metrics.inc("health_tracker_api_requests_total", kind=counter)
+
+
+def api_error() -> type:
+    """
+    gspread's APIError.
+
+    gspread is slow to import and not needed when all data comes from the
+    cache, so it is only imported when an exception has to be matched
+    against it (an except clause evaluates its expression only then):
+
+        except api_error() as e:
+            ...
+    """
+    return lazy_import("gspread.exceptions").APIError
+
+
+# the Sheets API allows 60 requests per minute per user by default
+governor = RateGovernor(
+    requests_per_minute=int(os.environ.get("HEALTH_TRACKER_SHEETS_REQUESTS_PER_MINUTE", 60))
+)
@@ -0,0 +1,678 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from file_lock import FileLock, file_lock
+from memory_cache import memory_cache
+
+
+class SheetCache:
+    """
+    On-disk cache of Google Sheets data.
+
+    Every sheet is stored as an uncompressed Arrow IPC (feather v2) file,
+    which keeps the column types and can be memory-mapped, so reading it
+    does not involve any parsing. Next to it a small json sidecar records:
+
+    * fetched_at: when the data was downloaded (ISO 8601, UTC), or last
+      known to be current (see touch)
+    * downloaded_at: when the whole sheet was last downloaded; unlike
+      fetched_at it is not reset by touch, so it bounds how long an edit
+      that an incremental refresh cannot see can stay in the cache
+    * rows: the number of rows
+    * schema_hash: hash of the column names and types
+    * revision: the revision of the spreadsheet the data was read from
+    * version: changes on every write, used as key for the memory cache
+    * columns: the column names
+    * file: the name of the data file
+
+    Sheets matching partitioned (the food logs) are stored in partitions by
+    month instead of a single file, so a page that needs one day of a
+    multi-year log only reads that month (see read), and logging an entry
+    only rewrites the partition of its month (see append). Their sidecar
+    has a partitions entry instead of file, with per month the data file,
+    the number of rows and the first and last position of its rows. The
+    partitions store the position of every row in the sheet in a _row
+    column, so reading all of them gives back the sheet as one log.
+
+    A write stores the data under a new file name and then atomically
+    replaces the sidecar, so a reader sees either the old or the new version
+    of a sheet, never a mix or a half-written file (this also makes
+    background refreshes safe to run while pages read the cache). Writes to
+    a sheet hold a lock file, so they are serialized across threads and
+    worker processes; see also fill_lock.
+
+    Csv files written by older versions of the app are converted the first
+    time they are read.
+    """
+
+    # sheets stored in monthly partitions, by name prefix, with the column
+    # holding the date (%Y-%m-%d) that decides the partition of a row
+    partitioned = {"food_log_": "date"}
+    # partition of rows without a valid date
+    undated = "undated"
+
+    def __init__(self, cache_path:str):
+        self.cache_path = cache_path
+
+    def read(self, sheet_name:str, max_age:float=None, partitions:List[str]=None) -> Optional[pd.DataFrame]:
+        """
+        Read a sheet from the cache.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            max_age (float): Maximum age of the data in seconds, use None to
+                accept data of any age
+            partitions (List[str]): Only read these partitions (months as
+                "%Y-%m", see partition_keys) of a partitioned sheet. The rows
+                are indexed by their position in the sheet. Ignored for other
+                sheets, which are always read in full.
+
+        Returns:
+            data (pd.DataFrame | None): The cached data, or None if the sheet
+                is not cached or the data is older than max_age
+        """
+        metadata = self.metadata(sheet_name)
+        if metadata is None:
+            return None
+        if max_age is not None and self.age(metadata) > max_age:
+            return None
+        if "partitions" in metadata:
+            try:
+                return self._read_partitions(sheet_name, metadata, partitions)
+            except FileNotFoundError:
+                if (self._load_metadata(sheet_name) or {}).get("version") == metadata["version"]:
+                    return None
+                return self.read(sheet_name, max_age, partitions)
+
+        data = memory_cache.get(sheet_name, metadata["version"])
+        if data is None:
+            try:
+                table = feather.read_table(f"{self.cache_path}/{metadata['file']}", memory_map=True)
+            except FileNotFoundError:
+                # replaced by a newer version after the sidecar was read
+                if (self._load_metadata(sheet_name) or {}).get("version") == metadata["version"]:
+                    return None
+                return self.read(sheet_name, max_age, partitions)
+            data = table.to_pandas()
+            memory_cache.put(sheet_name, metadata["version"], data)
+        return data
+
+    def write(
+        self,
+        sheet_name:str,
+        data:pd.DataFrame,
+        fetched_at:datetime=None,
+        revision:str=None,
+        if_version:int=None,
+        downloaded_at:datetime=None,
+    ) -> Optional[pd.DataFrame]:
+        """
+        Store sheet data in the cache.
+
+        Columns are normalized first (see normalize) and the returned frame
+        has the same column types as later reads will return.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            data (pd.DataFrame): The data to store
+            fetched_at (datetime): When the data was downloaded. Defaults to
+                now; pass the previous value when storing a local change to
+                downloaded data.
+            revision (str): Revision of the spreadsheet the data comes from
+            if_version (int): Only write if the cached version of the sheet
+                is still this version (use 0 for "not cached"). Used by
+                background refreshes, so they do not overwrite local changes
+                made while they were downloading.
+            downloaded_at (datetime): When the whole sheet was last
+                downloaded. Defaults to fetched_at.
+
+        Returns:
+            data (pd.DataFrame | None): The normalized data as stored, or
+                None if nothing was written because of if_version
+        """
+        data = self.normalize(data)
+        if fetched_at is None:
+            fetched_at = datetime.now(timezone.utc)
+        if downloaded_at is None:
+            downloaded_at = fetched_at
+
+        with self._write_lock(sheet_name):
+            previous = self._load_metadata(sheet_name)
+            if if_version is not None and if_version != (previous or {}).get("version", 0):
+                return None
+
+            version = time.time_ns()
+            table = pa.Table.from_pandas(data, preserve_index=False)
+            # same column types as a later read from disk
+            data = table.to_pandas()
+            metadata = {
+                "fetched_at": fetched_at.isoformat(),
+                "downloaded_at": downloaded_at.isoformat(),
+                "rows": len(data),
+                "schema_hash": self.schema_hash(data),
+                "revision": revision,
+                "version": version,
+                "columns": [str(column) for column in data.columns],
+            }
+
+            column = self.partition_column(sheet_name)
+            if column in data.columns:
+                # every partition gets the column types of the whole sheet
+                rows = data.assign(_row=np.arange(len(data), dtype="int64"))
+                schema = table.schema.append(pa.field("_row", pa.int64()))
+                metadata["partitions"] = {
+                    key: self._write_partition(sheet_name, key, partition, version, schema)
+                    for key, partition in rows.groupby(self.partition_of(rows[column]), sort=True)
+                }
+            else:
+                metadata["file"] = f"{sheet_name}.{version}.arrow"
+                feather.write_feather(table, f"{self.cache_path}/{metadata['file']}", compression="uncompressed")
+
+            self._write_metadata(sheet_name, metadata)
+            memory_cache.invalidate(sheet_name)
+            memory_cache.put(sheet_name, version, data)
+            if previous is not None:
+                self._remove_files(previous)
+        return data
+
+    def update(self, sheet_name:str, apply:Callable[[pd.DataFrame], pd.DataFrame]) -> None:
+        """
+        Apply a local change to a cached sheet.
+
+        The fetch time and revision of the cached data are kept, so changes
+        made by others are still picked up once it expires. Nothing happens
+        if the sheet is not cached.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            apply (Callable[[pd.DataFrame], pd.DataFrame]): Function that takes
+                the cached data and returns the changed data
+        """
+        with self._write_lock(sheet_name):
+            metadata = self.metadata(sheet_name)
+            if metadata is None:
+                return
+            self.write(
+                sheet_name,
+                apply(self.read(sheet_name)),
+                fetched_at=datetime.fromisoformat(metadata["fetched_at"]),
+                revision=metadata["revision"],
+                downloaded_at=datetime.fromisoformat(metadata.get("downloaded_at", metadata["fetched_at"])),
+            )
+
+    def append(self, sheet_name:str, rows:pd.DataFrame, if_version:int=None) -> Optional[int]:
+        """
+        Add rows to the end of a cached sheet, as a local change (see update).
+
+        For a partitioned sheet only the partitions of the new rows are
+        rewritten, which is usually just the current month.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            rows (pd.DataFrame): The new rows
+            if_version (int): Only append if the cached version of the sheet
+                is still this version
+
+        Returns:
+            version (int | None): The new version of the cached sheet, or
+                None if nothing was written (not cached, or because of
+                if_version)
+        """
+        with self._write_lock(sheet_name):
+            metadata = self._load_metadata(sheet_name)
+            if metadata is None or if_version not in (None, metadata["version"]):
+                return None
+            if "partitions" not in metadata:
+                self.update(sheet_name, lambda data: pd.concat([data, rows], ignore_index=True))
+                return self._load_metadata(sheet_name)["version"]
+
+            rows = self._with_positions(metadata, rows, np.arange(len(rows)) + metadata["rows"])
+            keys = self.partition_of(rows[self.partition_column(sheet_name)])
+            return self._rewrite_partitions(
+                sheet_name, metadata, set(keys),
+                lambda key, partition: pd.concat([partition, rows[keys == key]]),
+            )
+
+    def update_rows(self, sheet_name:str, rows:pd.DataFrame) -> None:
+        """
+        Overwrite rows of a cached sheet, as a local change (see update).
+
+        For a partitioned sheet only the partitions holding the rows (and
+        the partitions they move to if their date changed) are rewritten.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            rows (pd.DataFrame): The changed rows with all columns, indexed by
+                row position
+        """
+        with self._write_lock(sheet_name):
+            metadata = self._load_metadata(sheet_name)
+            if metadata is None or rows.empty:
+                return
+            if "partitions" not in metadata:
+                def apply(data):
+                    data = data.astype(object)
+                    data.loc[rows.index, rows.columns] = rows.astype(object).values
+                    return data.infer_objects()
+                self.update(sheet_name, apply)
+                return
+
+            positions = rows.index.to_numpy(dtype="int64")
+            rows = self._with_positions(metadata, rows, positions)
+            keys = self.partition_of(rows[self.partition_column(sheet_name)])
+            holding = {
+                key for key, partition in metadata["partitions"].items()
+                if partition["first_row"] <= positions.max() and partition["last_row"] >= positions.min()
+            }
+            self._rewrite_partitions(
+                sheet_name, metadata, holding | set(keys),
+                lambda key, partition: pd.concat([
+                    partition[~partition["_row"].isin(positions)],
+                    rows[keys == key],
+                ]),
+            )
+
+    def delete_rows(self, sheet_name:str, indices:List[int]) -> None:
+        """
+        Delete rows from a cached sheet, as a local change (see update). The
+        rows below a deleted row move up.
+
+        For a partitioned sheet only the partitions with rows at or below
+        the first deleted row are rewritten.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            indices (List[int]): Positions of the rows to delete
+        """
+        indices = np.array(sorted(set(int(index) for index in indices)), dtype="int64")
+        with self._write_lock(sheet_name):
+            metadata = self._load_metadata(sheet_name)
+            if metadata is None or len(indices) == 0:
+                return
+            if "partitions" not in metadata:
+                self.update(
+                    sheet_name,
+                    lambda data: data.drop(index=indices, errors="ignore").reset_index(drop=True)
+                )
+                return
+
+            def apply(key, partition):
+                partition = partition[~partition["_row"].isin(indices)]
+                # move up by the number of deleted rows above
+                return partition.assign(_row=partition["_row"] - np.searchsorted(indices, partition["_row"]))
+            self._rewrite_partitions(
+                sheet_name, metadata,
+                {key for key, partition in metadata["partitions"].items() if partition["last_row"] >= indices[0]},
+                apply,
+            )
+
+    def tail(self, sheet_name:str, n:int) -> Optional[pd.DataFrame]:
+        """
+        Read the last n rows of a cached sheet, indexed by position.
+
+        For a partitioned sheet only the partitions holding those rows are
+        read.
+
+        Returns:
+            data (pd.DataFrame | None): The rows, or None if the sheet is not cached
+        """
+        metadata = self.metadata(sheet_name)
+        if metadata is None:
+            return None
+        first = metadata["rows"] - n
+        partitions = [
+            key for key, partition in metadata.get("partitions", {}).items()
+            if partition["last_row"] >= first
+        ]
+        data = self.read(sheet_name, partitions=partitions)
+        if data is None:
+            return None
+        # sorted by position in both storage formats
+        return data.iloc[len(data) - min(n, len(data)):]
+
+    def columns(self, sheet_name:str) -> Optional[List[str]]:
+        """
+        Get the column names of a cached sheet, or None if it is not cached.
+        """
+        metadata = self.metadata(sheet_name)
+        if metadata is None:
+            return None
+        if "columns" in metadata:
+            return metadata["columns"]
+        data = self.read(sheet_name) # cached by an older version of the app
+        return None if data is None else list(data.columns)
+
+    def partition_column(self, sheet_name:str) -> Optional[str]:
+        """
+        The column that decides the partition of a row, or None if the sheet
+        is not partitioned.
+        """
+        for prefix, column in self.partitioned.items():
+            if sheet_name.startswith(prefix):
+                return column
+        return None
+
+    @classmethod
+    def partition_of(cls, dates:pd.Series) -> np.ndarray:
+        """
+        The partition key of every row of a partitioned sheet, from its date
+        (see partition_column): the month ("%Y-%m"), or undated.
+        """
+        months = dates.astype(str).str[:7]
+        return np.where(months.str.fullmatch(r"\d{4}-\d{2}"), months, cls.undated)
+
+    @staticmethod
+    def partition_keys(start:str, end:str) -> List[str]:
+        """
+        The partitions (months, as "%Y-%m") that hold the dates from start to
+        end (inclusive, as "%Y-%m-%d").
+        """
+        return list(pd.period_range(start[:7], end[:7], freq="M").strftime("%Y-%m"))
+
+    def touch(self, sheet_name:str, if_version:int=None, revision:str=None) -> None:
+        """
+        Mark a cached sheet as just downloaded, without changing its data.
+
+        Used when the sheet is known to be unchanged in Google Sheets.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            if_version (int): Only touch the sheet if the cached version is
+                still this version
+            revision (str): New revision of the spreadsheet the data is
+                known to match. Keeps the current revision if None.
+        """
+        with self._write_lock(sheet_name):
+            metadata = self._load_metadata(sheet_name)
+            if metadata is None or if_version not in (None, metadata["version"]):
+                return
+            metadata["fetched_at"] = datetime.now(timezone.utc).isoformat()
+            if revision is not None:
+                metadata["revision"] = revision
+            self._write_metadata(sheet_name, metadata)
+
+    def fill_lock(self, sheet_name:str) -> FileLock:
+        """
+        Lock to hold while downloading a sheet into the cache.
+
+        Only one thread or process at a time should download a sheet that is
+        missing or stale; the others can wait for the lock and then read the
+        downloaded data from the cache, or keep using their stale copy.
+        """
+        return file_lock(f"{self.cache_path}/{sheet_name}.fill.lock")
+
+    def metadata(self, sheet_name:str) -> Optional[dict]:
+        """
+        Get the sidecar metadata of a cached sheet.
+
+        Returns:
+            metadata (dict | None): The metadata, or None if the sheet is not cached
+        """
+        if not os.path.exists(self._metadata_file(sheet_name)) and os.path.exists(self._csv_file(sheet_name)):
+            self._upgrade_csv(sheet_name)
+        return self._load_metadata(sheet_name)
+
+    @staticmethod
+    def age(metadata:dict) -> float:
+        """
+        Seconds since the data described by metadata was downloaded.
+        """
+        fetched_at = datetime.fromisoformat(metadata["fetched_at"])
+        return (datetime.now(timezone.utc) - fetched_at).total_seconds()
+
+    @staticmethod
+    def download_age(metadata:dict) -> float:
+        """
+        Seconds since the whole sheet described by metadata was downloaded.
+        """
+        # sidecars written by older versions of the app only have fetched_at
+        downloaded_at = datetime.fromisoformat(metadata.get("downloaded_at", metadata["fetched_at"]))
+        return (datetime.now(timezone.utc) - downloaded_at).total_seconds()
+
+    def remove(self, sheet_name:str) -> None:
+        """
+        Remove a sheet from the cache.
+        """
+        with self._write_lock(sheet_name):
+            metadata = self._load_metadata(sheet_name)
+            if metadata is not None:
+                self._remove_file(f"{sheet_name}.json")
+                self._remove_files(metadata)
+            self._remove_file(f"{sheet_name}.csv")
+            memory_cache.invalidate(sheet_name)
+
+    def clear(self) -> None:
+        """
+        Remove all sheets from the cache.
+        """
+        # lock files are kept, other processes may be holding them
+        for file in os.listdir(self.cache_path):
+            if file.endswith((".arrow", ".json", ".csv", ".tmp")):
+                self._remove_file(file)
+        memory_cache.invalidate()
+
+    @staticmethod
+    def normalize(data:pd.DataFrame) -> pd.DataFrame:
+        """
+        Give every column a single type that Arrow can store.
+
+        Values from Google Sheets are numbers or strings, with "" for empty
+        cells. Empty cells become missing values (as they did in the csv
+        cache), columns that only hold numbers become numeric and all other
+        columns become strings.
+        """
+        data = data.reset_index(drop=True)
+        for column in data.columns:
+            if pd.api.types.is_numeric_dtype(data[column]) or pd.api.types.is_bool_dtype(data[column]):
+                continue
+            values = data[column].astype(object).replace("", None)
+            numeric = pd.to_numeric(values, errors="coerce")
+            if numeric.notna().sum() == values.notna().sum():
+                data[column] = numeric
+            else:
+                data[column] = values.where(values.isna(), values.astype(str))
+        return data
+
+    @staticmethod
+    def schema_hash(data:pd.DataFrame) -> str:
+        """
+        Short hash of the column names and types of data.
+        """
+        schema = [[str(column), str(dtype)] for column, dtype in data.dtypes.items()]
+        return hashlib.sha1(json.dumps(schema).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def rows_checksum(data:pd.DataFrame) -> str:
+        """
+        Hash of the values of data, which does not depend on the column
+        types (e.g. 1 and 1.0 hash the same), so rows read at different
+        times can be compared.
+        """
+        digest = hashlib.sha1()
+        for row in data.astype(object).itertuples(index=False):
+            for value in row:
+                if value is None or (isinstance(value, float) and value != value):
+                    value = ""
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    value = repr(float(value))
+                digest.update(f"{value}\x1f".encode())
+            digest.update(b"\x1e")
+        return digest.hexdigest()[:16]
+
+    def _read_partitions(self, sheet_name:str, metadata:dict, keys:Optional[List[str]]) -> pd.DataFrame:
+        """
+        Read partitions of a partitioned sheet, or all of them if keys is
+        None, as one frame indexed by position.
+
+        The whole sheet is kept in the memory cache under the sheet's name
+        and version; a set of partitions under the sheet name and their keys,
+        with the partitions' versions as version.
+        """
+        partitions = metadata["partitions"]
+        if keys is None:
+            keys, name, version = list(partitions), sheet_name, metadata["version"]
+        else:
+            keys = [key for key in dict.fromkeys(keys) if key in partitions]
+            name = f"{sheet_name}/{','.join(keys)}"
+            version = tuple(partitions[key]["version"] for key in keys)
+        data = memory_cache.get(name, version)
+        if data is not None:
+            return data
+
+        tables = [
+            feather.read_table(f"{self.cache_path}/{partitions[key]['file']}", memory_map=True)
+            for key in keys
+        ]
+        if not tables:
+            data = pd.DataFrame(columns=metadata["columns"] + ["_row"])
+        else:
+            try:
+                # concatenated and sorted by Arrow, much faster than pandas
+                # for logs with many partitions
+                data = pa.concat_tables(tables, promote_options="permissive").sort_by("_row").to_pandas()
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # partitions with incompatible column types
+                data = pd.concat([table.to_pandas() for table in tables]).sort_values("_row")
+        data.index = pd.Index(data.pop("_row").to_numpy(), dtype="int64")
+
+        memory_cache.put(name, version, data)
+        return data
+
+    def _read_partition(self, partition:dict) -> pd.DataFrame:
+        return feather.read_table(f"{self.cache_path}/{partition['file']}", memory_map=True).to_pandas()
+
+    def _write_partition(self, sheet_name:str, key:str, rows:pd.DataFrame, version:int, schema:pa.Schema=None) -> dict:
+        """
+        Store the rows (with their _row column) of one partition.
+
+        Returns:
+            partition (dict): The entry of the partition in the sidecar
+        """
+        table = pa.Table.from_pandas(rows, schema=schema, preserve_index=False)
+        file_name = f"{sheet_name}.{key}.{version}.arrow"
+        feather.write_feather(table, f"{self.cache_path}/{file_name}", compression="uncompressed")
+        return {
+            "file": file_name,
+            "rows": len(rows),
+            "first_row": int(rows["_row"].min()),
+            "last_row": int(rows["_row"].max()),
+            "version": version,
+        }
+
+    def _rewrite_partitions(
+        self,
+        sheet_name:str,
+        metadata:dict,
+        keys:set,
+        apply:Callable[[str, pd.DataFrame], pd.DataFrame],
+    ) -> int:
+        """
+        Replace some partitions of a partitioned sheet, keeping the others
+        as they are. Call with the write lock held.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            metadata (dict): The current metadata of the sheet
+            keys (set): The partitions to rewrite (can include new ones)
+            apply (Callable[[str, pd.DataFrame], pd.DataFrame]): Function that
+                takes a partition's key and rows (with _row) and returns its
+                new rows
+
+        Returns:
+            version (int): The new version of the sheet
+        """
+        version = time.time_ns()
+        partitions = metadata["partitions"]
+        replaced = []
+        for key in sorted(keys):
+            if key in partitions:
+                rows = self._read_partition(partitions[key])
+            else:
+                rows = pd.DataFrame(columns=metadata["columns"] + ["_row"])
+            rows = apply(key, rows)
+            if key in partitions:
+                replaced.append(partitions.pop(key))
+            if not rows.empty:
+                partitions[key] = self._write_partition(
+                    sheet_name, key, self.normalize(rows).astype({"_row": "int64"}), version
+                )
+
+        metadata["rows"] = sum(partition["rows"] for partition in partitions.values())
+        metadata["version"] = version
+        self._write_metadata(sheet_name, metadata)
+        memory_cache.invalidate(sheet_name)
+        for partition in replaced:
+            self._remove_file(partition["file"])
+        return version
+
+    def _with_positions(self, metadata:dict, rows:pd.DataFrame, positions:np.ndarray) -> pd.DataFrame:
+        """
+        Rows in the column order of the sheet, with their positions as _row.
+        """
+        rows = self.normalize(rows.reindex(columns=metadata["columns"]))
+        rows["_row"] = np.asarray(positions, dtype="int64")
+        return rows
+
+    def _remove_files(self, metadata:dict) -> None:
+        """
+        Remove the data files of a version of a sheet.
+        """
+        if "partitions" not in metadata:
+            self._remove_file(metadata["file"])
+            return
+        for partition in metadata["partitions"].values():
+            self._remove_file(partition["file"])
+
+    def _load_metadata(self, sheet_name:str) -> Optional[dict]:
+        try:
+            with open(self._metadata_file(sheet_name)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _write_metadata(self, sheet_name:str, metadata:dict) -> None:
+        # write to a temporary file first, so readers never see a partial file
+        with open(f"{self._metadata_file(sheet_name)}.tmp", "w") as file:
+            json.dump(metadata, file)
+        os.replace(f"{self._metadata_file(sheet_name)}.tmp", self._metadata_file(sheet_name))
+
+    def _upgrade_csv(self, sheet_name:str) -> None:
+        """
+        Convert a csv file from the old cache format, keeping its age.
+        Unreadable (empty) csv files are removed.
+        """
+        with self._write_lock(sheet_name):
+            if not os.path.exists(self._csv_file(sheet_name)):
+                return # converted by another process
+            fetched_at = datetime.fromtimestamp(os.path.getmtime(self._csv_file(sheet_name)), tz=timezone.utc)
+            try:
+                self.write(sheet_name, pd.read_csv(self._csv_file(sheet_name)), fetched_at=fetched_at)
+            except pd.errors.EmptyDataError:
+                pass
+            os.remove(self._csv_file(sheet_name))
+
+    def _remove_file(self, file_name:str) -> None:
+        """
+        Remove a file from the cache directory, ignoring files that are
+        already gone or still in use (e.g. memory-mapped on Windows).
+        """
+        try:
+            os.remove(f"{self.cache_path}/{file_name}")
+        except OSError:
+            pass
+
+    def _write_lock(self, sheet_name:str) -> FileLock:
+        return file_lock(f"{self.cache_path}/{sheet_name}.lock")
+
+    def _metadata_file(self, sheet_name:str) -> str:
+        return f"{self.cache_path}/{sheet_name}.json"
+
+    def _csv_file(self, sheet_name:str) -> str:
+        return f"{self.cache_path}/{sheet_name}.csv"
@@ -0,0 +1,375 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import pandas as pd
+from instrumentation import lazy_import
+from sheet_cache import SheetCache
+from storage import StorageBackend
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Storage backend that keeps every sheet in a local SQLite database.
+
+    Each sheet is a table with the same columns as the sheet, plus a _row
+    column with the position of the row (so positions keep the meaning they
+    have in Google Sheets). Tables with date, name or date and meal columns
+    get an index on them, so query can select e.g. one day of a food log
+    without reading the rest of it.
+
+    With a sync backend (a GoogleSheetsInterface), the database is a mirror
+    of Google Sheets: sheets are imported from it when its cached data
+    changes, and every write is applied to the database and then forwarded
+    to it (if forwarding fails, the sheet is imported again on its next
+    load, see _forward). Without one, the app runs fully offline; sheets
+    that are not in the database yet are imported from the Google Sheets
+    cache on disk.
+
+    The table _sheets records the columns of every sheet and the version of
+    the sync backend's cached data it was imported from.
+    """
+
+    database_path = "cache/storage.sqlite3"
+    # columns that get an index, if a sheet has all of them
+    indexes = [("date",), ("name",), ("date", "meal")]
+
+    def __init__(self, sync:StorageBackend=None, database_path:str=None):
+        self.sync = sync
+        if database_path is not None:
+            self.database_path = database_path
+        os.makedirs(os.path.dirname(self.database_path) or ".", exist_ok=True)
+
+    def load_google_sheet_data(self, sheet_name:str) -> pd.DataFrame:
+        """
+        Load all rows of a sheet.
+        """
+        self._ensure([sheet_name])
+        return self._select(sheet_name, {})
+
+    def load_many(self, sheet_names:List[str]) -> Dict[str, pd.DataFrame]:
+        """
+        Load all rows of several sheets.
+
+        Returns:
+            data (Dict[str, pd.DataFrame]): The data of each sheet, by sheet name
+        """
+        sheet_names = list(dict.fromkeys(sheet_names))
+        self._ensure(sheet_names)
+        return {sheet_name: self._select(sheet_name, {}) for sheet_name in sheet_names}
+
+    def query(self, sheet_name:str, date_range:Tuple[str, str]=None, **filters) -> pd.DataFrame:
+        """
+        Load the rows of a sheet whose columns equal the given values, and
+        whose date is within date_range.
+
+        The filters are part of the SQL query, so only the matching rows are
+        read (using an index where there is one).
+        """
+        self._ensure([sheet_name])
+        return self._select(sheet_name, filters, date_range)
+
+    def version(self, sheet_name:str) -> Optional[int]:
+        """
+        The version of the sync backend's cached data the table was imported
+        from or last synced with. None without a sync backend, since the
+        table is changed without a version.
+        """
+        if self.sync is None:
+            return None
+        return self._versions().get(sheet_name)
+
+    def update_google_sheet(self, sheet_name:str, updated_data:pd.DataFrame) -> None:
+        """
+        Replace all rows of a sheet.
+        """
+        with self._transaction() as connection:
+            self._import(connection, sheet_name, updated_data, version=None)
+        self._forward(sheet_name, lambda: self.sync.update_google_sheet(sheet_name, updated_data))
+
+    def append_rows(self, sheet_name:str, new_rows:pd.DataFrame) -> None:
+        """
+        Append rows to the end of a sheet.
+        """
+        self._ensure([sheet_name])
+        columns = self._columns(sheet_name)
+        new_rows = new_rows.reindex(columns=columns)
+
+        with self._transaction() as connection:
+            start = connection.execute(
+                f"SELECT COALESCE(MAX(_row) + 1, 0) FROM {_quote(sheet_name)}"
+            ).fetchone()[0]
+            self._insert(connection, sheet_name, columns, new_rows, start)
+
+        self._forward(sheet_name, lambda: self.sync.append_rows(sheet_name, new_rows))
+
+    def update_rows(self, sheet_name:str, rows:pd.DataFrame) -> None:
+        """
+        Overwrite existing rows, given with all columns and indexed by position.
+        """
+        if rows.empty:
+            return
+        self._ensure([sheet_name])
+        columns = self._columns(sheet_name)
+        rows = rows.reindex(columns=columns)
+
+        assignments = ", ".join(f"{_quote(column)} = ?" for column in columns)
+        with self._transaction() as connection:
+            connection.executemany(
+                f"UPDATE {_quote(sheet_name)} SET {assignments} WHERE _row = ?",
+                [values + [int(index)] for index, values in zip(rows.index, _to_values(rows))]
+            )
+
+        self._forward(sheet_name, lambda: self.sync.update_rows(sheet_name, rows))
+
+    def delete_rows(self, sheet_name:str, indices:List[int]) -> None:
+        """
+        Delete the rows at the given positions.
+
+        The rows below a deleted row move up, as they do in Google Sheets.
+        """
+        indices = sorted(set(int(index) for index in indices), reverse=True)
+        if not indices:
+            return
+        self._ensure([sheet_name])
+
+        table = _quote(sheet_name)
+        first = indices[-1]
+        with self._transaction() as connection:
+            connection.executemany(f"DELETE FROM {table} WHERE _row = ?", [(index,) for index in indices])
+            # number the rows below the first deleted one again in a single pass
+            connection.execute(
+                f"UPDATE {table} SET _row = renumbered.position FROM ("
+                f"SELECT rowid AS id, ? + ROW_NUMBER() OVER (ORDER BY _row) - 1 AS position "
+                f"FROM {table} WHERE _row > ?"
+                f") AS renumbered WHERE {table}.rowid = renumbered.id",
+                (first, first),
+            )
+
+        self._forward(sheet_name, lambda: self.sync.delete_rows(sheet_name, indices))
+
+    def pending_writes(self) -> dict:
+        """
+        Writes that were not saved to the sync backend yet.
+        """
+        if self.sync is None:
+            return super().pending_writes()
+        return self.sync.pending_writes()
+
+    def clear_cache(self) -> None:
+        """
+        Import all sheets again from the sync backend on their next load.
+
+        Without a sync backend the database is the only copy of the data,
+        so nothing is cleared.
+        """
+        if self.sync is None:
+            return
+        self.sync.clear_cache()
+        with self._transaction() as connection:
+            connection.execute("UPDATE _sheets SET version = NULL")
+
+    def _ensure(self, sheet_names:List[str]) -> None:
+        """
+        Make sure the database has an up to date copy of the sheets.
+
+        With a sync backend, a sheet is imported again whenever the version
+        of its cached data differs from the version it was imported from.
+        Reading the version only reads the cache's metadata; the sheets are
+        loaded from the sync backend (which may download them) only when
+        the cached data is missing or expired.
+        """
+        known = self._versions()
+        if self.sync is None:
+            missing = [sheet_name for sheet_name in sheet_names if sheet_name not in known]
+            if missing:
+                self._import_offline(missing)
+            return
+
+        outdated = []
+        for sheet_name in sheet_names:
+            metadata = self.sync.cache.metadata(sheet_name)
+            if (
+                metadata is None
+                or self.sync.cache.age(metadata) > self.sync.cache_ttl
+                or known.get(sheet_name, -1) != metadata["version"]
+            ):
+                outdated.append(sheet_name)
+        if not outdated:
+            return
+
+        data = self.sync.load_many(outdated)
+        with self._transaction() as connection:
+            known = self._versions(connection)
+            for sheet_name in outdated:
+                version = self._sync_version(sheet_name)
+                if sheet_name not in known or known[sheet_name] != version:
+                    self._import(connection, sheet_name, data[sheet_name], version)
+
+    def _import_offline(self, sheet_names:List[str]) -> None:
+        """
+        Import sheets from the Google Sheets cache on disk.
+
+        Raises:
+            WorksheetNotFound: If a sheet was never downloaded
+        """
+        from google_sheets import GoogleSheetsInterface
+        cache = SheetCache(GoogleSheetsInterface.cache_path)
+        with self._transaction() as connection:
+            known = self._versions(connection)
+            for sheet_name in sheet_names:
+                if sheet_name in known:
+                    continue
+                data = cache.read(sheet_name) if os.path.isdir(cache.cache_path) else None
+                if data is None:
+                    raise lazy_import("gspread.exceptions").WorksheetNotFound(sheet_name)
+                self._import(connection, sheet_name, data, version=None)
+
+    def _import(self, connection:sqlite3.Connection, sheet_name:str, data:pd.DataFrame, version:Optional[int]) -> None:
+        """
+        Replace the table of a sheet with data.
+        """
+        table = _quote(sheet_name)
+        columns = [str(column) for column in data.columns]
+        connection.execute(f"DROP TABLE IF EXISTS {table}")
+        # no column types, so every value keeps the type it was stored with
+        connection.execute(
+            f"CREATE TABLE {table} (_row INTEGER NOT NULL, {', '.join(_quote(column) for column in columns)})"
+        )
+        self._insert(connection, sheet_name, columns, data, start=0)
+
+        connection.execute(f"CREATE INDEX {_quote(sheet_name + '__row')} ON {table} (_row)")
+        for index_columns in self.indexes:
+            if set(index_columns) <= set(columns):
+                connection.execute(
+                    f"CREATE INDEX {_quote(sheet_name + '__' + '_'.join(index_columns))} "
+                    f"ON {table} ({', '.join(_quote(column) for column in index_columns)})"
+                )
+        connection.execute(
+            "INSERT OR REPLACE INTO _sheets (name, columns, version) VALUES (?, ?, ?)",
+            (sheet_name, json.dumps(columns), version)
+        )
+
+    @staticmethod
+    def _insert(connection:sqlite3.Connection, sheet_name:str, columns:List[str], rows:pd.DataFrame, start:int) -> None:
+        placeholders = ", ".join("?" * (len(columns) + 1))
+        connection.executemany(
+            f"INSERT INTO {_quote(sheet_name)} (_row, {', '.join(_quote(column) for column in columns)}) "
+            f"VALUES ({placeholders})",
+            [[start + position] + values for position, values in enumerate(_to_values(rows))]
+        )
+
+    def _select(self, sheet_name:str, filters:dict, date_range:Tuple[str, str]=None) -> pd.DataFrame:
+        columns = self._columns(sheet_name)
+        sql = f"SELECT _row, {', '.join(_quote(column) for column in columns)} FROM {_quote(sheet_name)}"
+        conditions = [f"{_quote(column)} = ?" for column in filters]
+        parameters = [_to_value(value) for value in filters.values()]
+        if date_range is not None:
+            conditions.append('"date" BETWEEN ? AND ?')
+            parameters += list(date_range)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY _row"
+        rows = self._connection().execute(sql, parameters).fetchall()
+
+        data = SheetCache.normalize(pd.DataFrame([row[1:] for row in rows], columns=columns))
+        data.index = pd.Index([row[0] for row in rows], dtype="int64")
+        return data
+
+    def _columns(self, sheet_name:str) -> List[str]:
+        row = self._connection().execute("SELECT columns FROM _sheets WHERE name = ?", (sheet_name,)).fetchone()
+        if row is None:
+            raise lazy_import("gspread.exceptions").WorksheetNotFound(sheet_name)
+        return json.loads(row[0])
+
+    def _versions(self, connection:sqlite3.Connection=None) -> Dict[str, Optional[int]]:
+        connection = connection or self._connection()
+        return dict(connection.execute("SELECT name, version FROM _sheets").fetchall())
+
+    def _sync_version(self, sheet_name:str) -> Optional[int]:
+        return (self.sync.cache.metadata(sheet_name) or {}).get("version")
+
+    def _forward(self, sheet_name:str, write) -> None:
+        """
+        Send a write that was applied to the table to the sync backend.
+
+        If the sync backend fails, the table has a change that the sheet may
+        not have. Its version is cleared, so the next load imports the sheet
+        again (see _ensure) instead of keeping the two apart, and the error
+        is raised for the page to report.
+        """
+        if self.sync is None:
+            return
+        try:
+            write()
+        except BaseException:
+            with self._transaction() as connection:
+                connection.execute("UPDATE _sheets SET version = NULL WHERE name = ?", (sheet_name,))
+            raise
+        self._mark_synced(sheet_name)
+
+    def _mark_synced(self, sheet_name:str) -> None:
+        """
+        Record that the table matches the sync backend's cached data again,
+        after the same write was applied to both.
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE _sheets SET version = ? WHERE name = ?",
+                (self._sync_version(sheet_name), sheet_name)
+            )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # IMMEDIATE takes the write lock up front, so concurrent writers
+        # (other sessions or processes) wait instead of failing halfway
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        The connection of the current thread (sqlite3 connections can not
+        be shared between threads).
+        """
+        connections = _local.__dict__.setdefault("connections", {})
+        connection = connections.get(self.database_path)
+        if connection is None:
+            connection = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+            # readers do not block the writer (and the other way around)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS _sheets (name TEXT PRIMARY KEY, columns TEXT NOT NULL, version INTEGER)"
+            )
+            connections[self.database_path] = connection
+        return connection
+
+
+_local = threading.local()
+
+
+def _quote(identifier:str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _to_value(value):
+    """
+    Convert a value to a type sqlite3 can store (numpy numbers and missing
+    values are not).
+    """
+    if value is None or (isinstance(value, float) and value != value) or value is pd.NA:
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def _to_values(data:pd.DataFrame) -> List[list]:
+    return [[_to_value(value) for value in row] for row in data.astype(object).itertuples(index=False)]
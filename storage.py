@@ -0,0 +1,222 @@
+import os
+from typing import Dict, Hashable, List, Optional, Tuple
+import pandas as pd
+from instrumentation import step
+
+
+class StaleRowsError(Exception):
+    """
+    Raised by update_rows and delete_rows when the rows they address by
+    position may have moved since the data was loaded (e.g. rows were added
+    or removed in Google Sheets by someone else), so nothing was written.
+    Load the sheet again and retry.
+    """
+
+
+class StorageBackend:
+    """
+    Interface shared by the places the app can keep its data.
+
+    Data is organised in sheets (named tables with a header row), as in the
+    Google Sheets document the app started with. Rows are addressed by their
+    position: index 0 is the first row below the header, and the DataFrames
+    returned by the load methods are indexed that way.
+
+    Implementations:
+
+    * GoogleSheetsInterface (google_sheets.py): the Google Sheets document,
+      with an on-disk cache
+    * SQLiteStorage (sqlite_storage.py): a local SQLite database, optionally
+      kept in sync with Google Sheets
+
+    Use get_storage to get the backend the app is configured to use.
+    """
+
+    def load_google_sheet_data(self, sheet_name:str) -> pd.DataFrame:
+        """
+        Load all rows of a sheet.
+        """
+        raise NotImplementedError
+
+    def load_many(self, sheet_names:List[str]) -> Dict[str, pd.DataFrame]:
+        """
+        Load all rows of several sheets.
+
+        Returns:
+            data (Dict[str, pd.DataFrame]): The data of each sheet, by sheet name
+        """
+        return {
+            sheet_name: self.load_google_sheet_data(sheet_name)
+            for sheet_name in dict.fromkeys(sheet_names)
+        }
+
+    def query(self, sheet_name:str, date_range:Tuple[str, str]=None, **filters) -> pd.DataFrame:
+        """
+        Load the rows of a sheet whose columns equal the given values, e.g.
+        query("food_log_bela", date="2024-01-31", meal="Lunch"), and whose
+        date is within date_range, e.g.
+        query("food_log_bela", date_range=("2024-01-01", "2024-01-31")).
+
+        The rows keep their position in the sheet as index, so the result
+        can be passed to update_rows and delete_rows. Backends that can
+        filter without loading the whole sheet override this.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            date_range (Tuple[str, str]): First and last date ("%Y-%m-%d") to
+                select, both inclusive
+            **filters: Column names and the values to select
+
+        Returns:
+            data (pd.DataFrame): The matching rows
+        """
+        return self._filter(self.load_google_sheet_data(sheet_name), date_range, filters)
+
+    @staticmethod
+    def _filter(data:pd.DataFrame, date_range:Optional[Tuple[str, str]], filters:dict) -> pd.DataFrame:
+        if date_range is not None:
+            data = data[data["date"].astype(str).between(*date_range)]
+        for column, value in filters.items():
+            data = data[data[column] == value]
+        return data
+
+    def version(self, sheet_name:str) -> Optional[Hashable]:
+        """
+        An identifier of the current data of a sheet, which changes whenever
+        the data changes. Used to cache what is derived from a sheet (e.g.
+        the FoodCatalog) for as long as the sheet does not change.
+
+        Returns:
+            version (Hashable | None): The version, or None if the backend
+                cannot tell (or the sheet was not loaded yet)
+        """
+        return None
+
+    def partitions(self, sheet_name:str) -> Optional[Dict[str, Hashable]]:
+        """
+        The version of each partition of a sheet, for backends that store
+        long logs in monthly partitions (the food logs in the Google Sheets
+        cache, see SheetCache). A partition's version changes whenever one
+        of its rows changes, so what is derived from a log can be updated
+        from the months that changed instead of the whole log (see
+        DailyAggregates).
+
+        Returns:
+            versions (Dict[str, Hashable] | None): The version of each
+                partition by key (see SheetCache.partition_of), or None if
+                the backend does not partition the sheet (or the sheet was
+                not loaded yet)
+        """
+        return None
+
+    def load_partitions(self, sheet_name:str, keys:List[str]) -> pd.DataFrame:
+        """
+        Load the rows of some partitions of a sheet (see partitions),
+        indexed by position.
+        """
+        raise NotImplementedError
+
+    def update_google_sheet(self, sheet_name:str, updated_data:pd.DataFrame) -> None:
+        """
+        Replace all rows of a sheet.
+        """
+        raise NotImplementedError
+
+    def append_rows(self, sheet_name:str, new_rows:pd.DataFrame) -> None:
+        """
+        Append rows to the end of a sheet.
+        """
+        raise NotImplementedError
+
+    def update_rows(self, sheet_name:str, rows:pd.DataFrame) -> None:
+        """
+        Overwrite existing rows, given with all columns and indexed by position.
+        Raises StaleRowsError if the backend finds the positions may have
+        moved since the data was loaded.
+        """
+        raise NotImplementedError
+
+    def delete_rows(self, sheet_name:str, indices:List[int]) -> None:
+        """
+        Delete the rows at the given positions. Raises StaleRowsError like
+        update_rows.
+        """
+        raise NotImplementedError
+
+    def sync_changes(self, sheet_name:str, original_data:pd.DataFrame, updated_data:pd.DataFrame) -> None:
+        """
+        Write only the differences between two versions of a sheet.
+
+        Meant for editors (e.g. st.data_editor) that return an edited copy of
+        the data from load_google_sheet_data. Rows are matched on the index:
+        rows that only exist in updated_data are appended, rows that are
+        missing from updated_data are deleted and rows with different values
+        are overwritten.
+
+        Args:
+            sheet_name (str): The name of the sheet
+            original_data (pd.DataFrame): The data as loaded from the sheet
+            updated_data (pd.DataFrame): The edited data
+        """
+        updated_data = updated_data.reindex(columns=original_data.columns)
+        common = original_data.index.intersection(updated_data.index)
+        added = updated_data.index.difference(original_data.index)
+        removed = original_data.index.difference(updated_data.index)
+
+        before = original_data.loc[common].astype(str)
+        after = updated_data.loc[common].astype(str)
+        changed = common[(before != after).any(axis=1).values]
+
+        # updates first, while the original row positions are still valid
+        if len(changed) > 0:
+            self.update_rows(sheet_name, updated_data.loc[changed])
+        if len(added) > 0:
+            self.append_rows(sheet_name, updated_data.loc[added])
+        if len(removed) > 0:
+            self.delete_rows(sheet_name, list(removed))
+
+    def pending_writes(self) -> dict:
+        """
+        Writes that were not saved yet, see WriteBehindQueue.status.
+        """
+        return {"pending": {}, "failures": {}, "last_error": {}, "dead_letters": {}}
+
+    def clear_cache(self) -> None:
+        """
+        Drop cached data, so it is loaded again from its source.
+        """
+
+
+def get_storage() -> StorageBackend:
+    """
+    Get the storage backend selected by the HEALTH_TRACKER_STORAGE
+    environment variable:
+
+    * sheets (default): Google Sheets
+    * sqlite: a local SQLite database that is kept in sync with Google Sheets
+    * offline: a local SQLite database only, seeded from the Google Sheets
+      cache on disk
+    """
+    with step("get_storage"):
+        backend = os.environ.get("HEALTH_TRACKER_STORAGE", "sheets")
+        storage = _create_storage(backend)
+    # the first page run after the server started warms up the cache; the
+    # offline database is local, there is nothing to download
+    if backend != "offline":
+        import warmup
+        warmup.start(storage)
+    return storage
+
+
+def _create_storage(backend:str) -> StorageBackend:
+    if backend == "sheets":
+        from google_sheets import GoogleSheetsInterface
+        return GoogleSheetsInterface()
+    if backend == "sqlite":
+        from google_sheets import GoogleSheetsInterface
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(sync=GoogleSheetsInterface())
+    if backend == "offline":
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -1,10 +1,11 @@
+from instrumentation import page_finish, page_start
 import streamlit as st
 import pandas as pd
-from google_sheets import GoogleSheetsInterface
+from storage import get_storage
 from datetime import datetime
-import plotly.express as px
 
-gsheets = GoogleSheetsInterface()
+page_start("Home")
+gsheets = get_storage()
 
 
 st.set_page_config(
@@ -13,18 +14,20 @@ st.set_page_config(
 )
 
 st.write("# Gettin Healthay! 🍎")
-weight_log_bela = gsheets.load_google_sheet_data(sheet_name="weight_log_bela")
+sheets = gsheets.load_many(["weight_log_bela", "weight_log_marleen"])
+
+weight_log_bela = sheets["weight_log_bela"]
 weight_log_bela = weight_log_bela.sort_values(by="date")
 start_bela = weight_log_bela["weight"].values[0]
 weight_log_bela["delta"] = weight_log_bela["weight"] - start_bela
 
-weight_log_marleen = gsheets.load_google_sheet_data(sheet_name="weight_log_marleen")
+weight_log_marleen = sheets["weight_log_marleen"]
 weight_log_marleen = weight_log_marleen.sort_values(by="date")
 start_marleen = weight_log_marleen["weight"].values[0]
 weight_log_marleen["delta"] = weight_log_marleen["weight"] - start_marleen
 
 df = weight_log_bela.merge(weight_log_marleen, on="date", suffixes=("_bela", "_marleen"), how="outer")
-df = df.fillna(method='ffill')
+df = df.ffill()
 
 if df['delta_bela'].values[-1] < df['delta_marleen'].values[-1]:
     winner = "Bela"
@@ -43,6 +46,8 @@ df = df.rename(columns={
     "delta_marleen": "Delta Marleen (kg)"
 }).sort_values(by="Date", ascending=False)
 
+# plotly is slow to import, only import it once the data is loaded
+import plotly.express as px
 fig = px.line(df, x="Date", y=["Delta Bela (kg)", "Delta Marleen (kg)"], title="Weight Loss Over Time", range_y=[-12, 2], labels={"value": "Weight Lost (kg)"})
 fig.update_layout(legend=dict(
     x=0.15,
@@ -53,3 +58,5 @@ fig.update_layout(legend=dict(
 st.plotly_chart(fig)
 
 st.write(df)
+
+page_finish()
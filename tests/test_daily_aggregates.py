@@ -0,0 +1,99 @@
+import pandas as pd
+import pytest
+from benchmarks import synthetic
+from daily_aggregates import DailyAggregates, _aggregate
+from food_catalog import FoodCatalog
+from google_sheets import GoogleSheetsInterface
+from sheet_cache import SheetCache
+
+SHEET = "food_log_bela"
+
+
+@pytest.fixture
+def sheets(tmp_path, monkeypatch):
+    """
+    A GoogleSheetsInterface with a cached food log of a few months, that
+    records which partitions are read from the cache.
+    """
+    data = synthetic.sheets(log_rows=1000, n_foods=100, n_recipes=5)
+    interface = object.__new__(GoogleSheetsInterface)
+    interface.cache = SheetCache(str(tmp_path))
+    interface.cache.write(SHEET, data[SHEET])
+
+    reads = []
+    read = interface.cache.read
+    def recording_read(sheet_name, max_age=None, partitions=None):
+        reads.append(partitions)
+        return read(sheet_name, max_age, partitions)
+    monkeypatch.setattr(interface.cache, "read", recording_read)
+    return interface, FoodCatalog(data["food_data"]), reads
+
+
+def check(aggregates:DailyAggregates, interface:GoogleSheetsInterface, catalog:FoodCatalog) -> None:
+    expected = _aggregate(interface.cache.read(SHEET), catalog).sort_index()
+    pd.testing.assert_frame_equal(aggregates.daily(interface, "bela", catalog), expected, check_dtype=False)
+
+
+def test_only_changed_months_are_read(sheets):
+    interface, catalog, reads = sheets
+    aggregates = DailyAggregates()
+    check(aggregates, interface, catalog)
+    months = list(interface.partitions(SHEET))
+
+    # e.g. new rows downloaded in the background
+    new_rows = interface.cache.read(SHEET).iloc[:2].assign(date=["2020-01-15", "2020-01-16"])
+    interface.cache.append(SHEET, new_rows)
+    reads.clear()
+    aggregates.daily(interface, "bela", catalog)
+    assert reads == [["2020-01"]]
+    check(aggregates, interface, catalog)
+
+    # a row moved to another month
+    moved = interface.cache.read(SHEET).iloc[[3]].assign(date=f"{months[-1]}-01")
+    interface.cache.update_rows(SHEET, moved)
+    reads.clear()
+    aggregates.daily(interface, "bela", catalog)
+    assert reads == [sorted([months[0], months[-1]])]
+    check(aggregates, interface, catalog)
+
+    # a whole month removed
+    log = interface.cache.read(SHEET)
+    interface.cache.delete_rows(SHEET, list(log.index[log["date"].str.startswith("2020-01")]))
+    aggregates.daily(interface, "bela", catalog)
+    check(aggregates, interface, catalog)
+
+
+def test_writes_through_aggregates(sheets):
+    interface, catalog, reads = sheets
+    interface.append_rows = lambda sheet_name, new_rows: interface.cache.append(sheet_name, new_rows)
+    aggregates = DailyAggregates()
+    aggregates.daily(interface, "bela", catalog)
+
+    aggregates.append_rows(interface, "bela", interface.cache.read(SHEET).iloc[-3:])
+    reads.clear()
+    check(aggregates, interface, catalog)
+    # the aggregates and the partitions they were built from are up to date
+    assert reads == [None]
+
+
+def test_new_food_data_is_applied_once(sheets, monkeypatch):
+    interface, catalog, reads = sheets
+    aggregates = DailyAggregates()
+    aggregates.daily(interface, "bela", catalog)
+    data = catalog.data.copy()
+    data["Calories (kcal)"] = data["Calories (kcal)"] * 2
+    new_catalog = FoodCatalog(data)
+
+    # another session applies the same food_data while this one loads the log
+    load_partitions = interface.load_partitions
+    def concurrent_load(sheet_name, keys):
+        monkeypatch.setattr(interface, "load_partitions", load_partitions)
+        aggregates.daily(interface, "bela", new_catalog)
+        return load_partitions(sheet_name, keys)
+    monkeypatch.setattr(interface, "load_partitions", concurrent_load)
+    reads.clear()
+
+    aggregates.daily(interface, "bela", new_catalog)
+    # read by partition, not as the whole sheet
+    assert None not in reads
+    check(aggregates, interface, new_catalog)
@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+import food_search
+from benchmarks import synthetic
+from benchmarks.fake_sheets import FakeSheetsInterface
+from food_catalog import FoodCatalog
+from food_search import FoodSearchIndex, food_counts, ingredient_counts
+from google_sheets import GoogleSheetsInterface
+from sheet_cache import SheetCache
+
+SHEET = "food_log_bela"
+
+
+@pytest.fixture
+def data():
+    food_search._counts.clear()
+    yield synthetic.sheets(log_rows=1000, n_foods=100, n_recipes=20)
+    food_search._counts.clear()
+
+
+def test_counts_are_kept_until_the_sheet_changes(data):
+    storage = FakeSheetsInterface(data)
+    counts = ingredient_counts(storage)
+    assert counts == data["recipe_ingredients"]["ingredient"].value_counts().to_dict()
+    assert ingredient_counts(storage) is counts
+    assert storage.calls["load"] == 1
+
+    storage.append_rows("recipe_ingredients", data["recipe_ingredients"].iloc[:1])
+    assert ingredient_counts(storage) is not counts
+
+
+def test_popularity_of_several_counts_is_kept(data):
+    storage = FakeSheetsInterface(data)
+    index = FoodSearchIndex(FoodCatalog(data["food_data"]))
+    counts = [food_counts(storage, "bela"), food_counts(storage, "marleen"), ingredient_counts(storage)]
+    popularity = [index._popularity(c) for c in counts]
+    # e.g. the Food and Manage pages, one after the other
+    for c, p in zip(counts, popularity):
+        assert index._popularity(c) is p
+
+
+def test_food_counts_only_count_changed_months(data, tmp_path, monkeypatch):
+    interface = object.__new__(GoogleSheetsInterface)
+    interface.cache = SheetCache(str(tmp_path))
+    interface.cache.write(SHEET, data[SHEET])
+    counts = food_counts(interface, "bela")
+    assert counts == data[SHEET]["name"].value_counts().to_dict()
+
+    loaded = []
+    load_partitions = interface.load_partitions
+    def recording_load(sheet_name, keys):
+        loaded.append(keys)
+        return load_partitions(sheet_name, keys)
+    monkeypatch.setattr(interface, "load_partitions", recording_load)
+
+    new_rows = data[SHEET].iloc[:3].assign(date="2020-01-15")
+    interface.cache.append(SHEET, new_rows)
+    counts = food_counts(interface, "bela")
+    assert loaded == [["2020-01"]]
+    expected = pd.concat([data[SHEET], new_rows])["name"].value_counts().to_dict()
+    assert counts == expected
+
+    log = interface.cache.read(SHEET)
+    interface.cache.delete_rows(SHEET, list(log.index[log["date"] == "2020-01-15"]))
+    assert food_counts(interface, "bela") == data[SHEET]["name"].value_counts().to_dict()
@@ -0,0 +1,175 @@
+import itertools
+import random
+import re
+from datetime import datetime, timedelta, timezone
+import pytest
+import google_sheets
+from metrics import metrics
+from google_sheets import GoogleSheetsInterface
+from storage import StaleRowsError
+from sheet_cache import SheetCache
+
+
+def apply_deletes(rows:list, requests:list) -> list:
+    """
+    Apply deleteDimension requests one after the other, as the Sheets API
+    does within a batch update. rows includes the header row.
+    """
+    rows = list(rows)
+    for request in requests:
+        range_ = request["deleteDimension"]["range"]
+        assert range_["dimension"] == "ROWS"
+        del rows[range_["startIndex"]:range_["endIndex"]]
+    return rows
+
+
+def test_delete_runs():
+    requests = GoogleSheetsInterface._op_requests(7, {"op": "delete", "indices": [3, 9, 8, 7]})
+    ranges = [(r["deleteDimension"]["range"]["startIndex"], r["deleteDimension"]["range"]["endIndex"]) for r in requests]
+    # contiguous rows in one request, bottom-up, shifted below the header
+    assert ranges == [(8, 11), (4, 5)]
+    assert all(r["deleteDimension"]["range"]["sheetId"] == 7 for r in requests)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_delete_runs_match_reference(seed):
+    random_ = random.Random(seed)
+    data = [f"row {i}" for i in range(30)]
+    indices = random_.sample(range(len(data)), random_.randint(1, len(data)))
+
+    requests = GoogleSheetsInterface._op_requests(0, {"op": "delete", "indices": indices})
+
+    sheet = apply_deletes(["header"] + data, requests)
+    assert sheet == ["header"] + [row for i, row in enumerate(data) if i not in set(indices)]
+    assert len(requests) <= len(indices)
+
+
+def test_update_and_append_requests():
+    update = GoogleSheetsInterface._op_requests(1, {"op": "update", "indices": [0, 4], "rows": [["a", 1], ["b", 2.5]]})
+    assert [r["updateCells"]["start"]["rowIndex"] for r in update] == [1, 5]
+    assert update[1]["updateCells"]["rows"] == [{"values": [
+        {"userEnteredValue": {"stringValue": "b"}},
+        {"userEnteredValue": {"numberValue": 2.5}},
+    ]}]
+
+    append = GoogleSheetsInterface._op_requests(1, {"op": "append", "rows": [["c", "", True]]})
+    assert append[0]["appendCells"]["rows"] == [{"values": [
+        {"userEnteredValue": {"stringValue": "c"}},
+        {},
+        {"userEnteredValue": {"boolValue": True}},
+    ]}]
+
+
+class FakeSpreadsheet:
+    """
+    Serves values_batch_get from lists of rows (header first), like the
+    Sheets API does for A1 ranges of whole rows.
+    """
+
+    def __init__(self, sheets:dict):
+        self.sheets = sheets
+
+    def values_batch_get(self, ranges):
+        value_ranges = []
+        for range_name in ranges:
+            sheet_name, _, cells = range_name.partition("!")
+            values = self.sheets[sheet_name.strip("'")]
+            if cells == "1:1":
+                values = values[:1]
+            elif cells:
+                first_row, last_row = re.fullmatch(r"[A-Z]+(\d+):[A-Z]+(\d*)", cells).groups()
+                values = values[int(first_row) - 1:int(last_row) if last_row else None]
+            value_ranges.append({"values": [[str(value) for value in row] for row in values]})
+        return {"valueRanges": value_ranges}
+
+
+@pytest.fixture
+def sheets(tmp_path, monkeypatch):
+    """
+    A GoogleSheetsInterface on a fake spreadsheet, with a cached food log
+    that expired a while ago. Every refresh sees a new revision.
+    """
+    values = {"food_log_bela": [["date", "name", "quantity"]] + [
+        [f"2024-01-{day:02d}", f"f{day}", day] for day in range(1, 11)
+    ]}
+    interface = object.__new__(GoogleSheetsInterface)
+    interface.cache = SheetCache(str(tmp_path))
+    revisions = itertools.count()
+    monkeypatch.setattr(interface, "_revision", lambda: str(next(revisions)))
+    monkeypatch.setattr(google_sheets.handles, "spreadsheet", lambda client, url: FakeSpreadsheet(values))
+    monkeypatch.setattr(GoogleSheetsInterface, "client", None)
+    interface.url = "https://example.com"
+
+    half_an_hour_ago = datetime.now(timezone.utc) - timedelta(minutes=30)
+    _, frames = interface._fetch_many(["food_log_bela"])
+    interface.cache.write("food_log_bela", frames["food_log_bela"], fetched_at=half_an_hour_ago, revision="old")
+    return interface, values["food_log_bela"]
+
+
+def test_refresh_downloads_new_rows_only(sheets):
+    interface, values = sheets
+    values.append(["2024-02-01", "f11", 11])
+    values[9][1] = "EDITED" # within the compared tail
+
+    interface._refresh(["food_log_bela"])
+
+    data = interface.cache.read("food_log_bela")
+    assert list(data["name"].iloc[-3:]) == ["EDITED", "f10", "f11"]
+
+
+def refreshes(result:str) -> int:
+    return sum(
+        row["value"] for row in metrics.snapshot()["counters"]
+        if row["name"] == "health_tracker_sheet_refreshes_total" and row["result"] == result
+    )
+
+
+def test_refresh_downloads_edited_sheet_in_full_after_a_while(sheets):
+    interface, values = sheets
+    incremental, full = refreshes("incremental"), refreshes("full")
+    values.append(["2024-02-01", "f11", 11])
+    values[2][1] = "EDITED" # before the compared tail, not seen incrementally
+    interface._refresh(["food_log_bela"])
+    assert interface.cache.read("food_log_bela")["name"].iloc[1] == "f2"
+    assert len(interface.cache.read("food_log_bela")) == 11
+    assert (refreshes("incremental"), refreshes("full")) == (incremental + 1, full)
+
+    # touch (revision unchanged) does not delay the full download
+    interface.cache.touch("food_log_bela")
+    metadata = interface.cache.metadata("food_log_bela")
+    metadata["fetched_at"] = (datetime.now(timezone.utc) - timedelta(minutes=2)).isoformat()
+    interface.cache._write_metadata("food_log_bela", metadata)
+    interface.full_refresh_interval = 60
+
+    interface._refresh(["food_log_bela"])
+
+    data = interface.cache.read("food_log_bela")
+    assert list(data["name"].iloc[:3]) == ["f1", "EDITED", "f3"]
+    assert len(data) == 11
+    assert (refreshes("incremental"), refreshes("full")) == (incremental + 1, full + 1)
+    assert interface.cache.download_age(interface.cache.metadata("food_log_bela")) < 60
+
+
+@pytest.mark.parametrize("revision, edit, stale", [
+    ("old", None, False), # unchanged spreadsheet, the rows are not read
+    ("new", None, False), # changed elsewhere, the rows are still in place
+    ("new", lambda values: values.insert(2, ["2024-01-01", "inserted", 1]), True),
+    ("new", lambda values: values.__setitem__(4, ["2024-01-04", "EDITED", 4]), True),
+])
+def test_positional_writes_check_the_rows(sheets, monkeypatch, revision, edit, stale):
+    interface, values = sheets
+    monkeypatch.setattr(interface, "_revision", lambda: revision)
+    sent = []
+    monkeypatch.setattr(interface, "_send_ops", lambda sheet_name, ops: sent.extend(ops))
+    if edit is not None:
+        edit(values)
+
+    if stale:
+        with pytest.raises(StaleRowsError):
+            interface.delete_rows("food_log_bela", [3, 5])
+        assert sent == []
+        assert interface.cache.metadata("food_log_bela") is None
+    else:
+        interface.delete_rows("food_log_bela", [3, 5])
+        assert sent == [{"op": "delete", "indices": [5, 3]}]
+        assert list(interface.cache.read("food_log_bela")["name"].iloc[2:5]) == ["f3", "f5", "f7"]
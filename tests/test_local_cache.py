@@ -0,0 +1,18 @@
+from local_cache import DraftStore
+
+
+def test_idle_sessions_are_evicted(tmp_path, monkeypatch):
+    store = DraftStore(str(tmp_path), idle_time=60, max_sessions=2)
+    now = [0.]
+    monkeypatch.setattr("local_cache.time.monotonic", lambda: now[0])
+    store.append("a", "new_recipe_ingredients", [["food 1", 100, "g"]])
+    store.append("b", "new_recipe_ingredients", [["food 2", 1, None]])
+    store.append("c", "new_recipe_ingredients", [["food 3", 2.5, "g"]])
+    # the least recently used session beyond max_sessions
+    assert list(store._sessions) == ["b", "c"]
+
+    now[0] = 120.
+    assert store.rows("c", "new_recipe_ingredients") == [["food 3", 2.5, "g"]]
+    assert list(store._sessions) == ["c"]
+    # replayed from the journal
+    assert store.rows("a", "new_recipe_ingredients") == [["food 1", 100, "g"]]
@@ -0,0 +1,95 @@
+import random
+import pandas as pd
+import pytest
+from memory_cache import MemoryCache
+from sheet_cache import SheetCache
+
+DATES = ["2023-12-30", "2024-01-05", "2024-01-31", "2024-02-01", "2024-02-29", "2024-03-10", ""]
+
+
+def rows(random_:random.Random, n:int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "date": [random_.choice(DATES) for _ in range(n)],
+        "name": [f"food {random_.randint(0, 999)}" for _ in range(n)],
+        "quantity": [random_.randint(1, 5) for _ in range(n)],
+    })
+
+
+def compare(actual:pd.DataFrame, reference:pd.DataFrame) -> None:
+    # empty cells are read back as missing values, see SheetCache.normalize
+    pd.testing.assert_frame_equal(
+        actual.reset_index(drop=True).astype(str),
+        reference.replace("", None).reset_index(drop=True).astype(str),
+    )
+
+
+@pytest.fixture
+def cache(tmp_path) -> SheetCache:
+    return SheetCache(str(tmp_path))
+
+
+@pytest.mark.parametrize("sheet_name", ["food_log_bela", "weight_log_bela"])
+@pytest.mark.parametrize("seed", range(10))
+def test_writes_match_reference(cache, sheet_name, seed):
+    random_ = random.Random(seed)
+    reference = rows(random_, 20)
+    cache.write(sheet_name, reference)
+
+    for _ in range(15):
+        change = random_.choice(["append", "update", "delete"])
+        if change == "append":
+            new_rows = rows(random_, random_.randint(1, 4))
+            cache.append(sheet_name, new_rows)
+            reference = pd.concat([reference, new_rows], ignore_index=True)
+        elif change == "update" and len(reference):
+            positions = random_.sample(range(len(reference)), random_.randint(1, min(3, len(reference))))
+            # can move rows to another month
+            changed = rows(random_, len(positions)).set_axis(positions)
+            cache.update_rows(sheet_name, changed)
+            reference.loc[positions, changed.columns] = changed.values
+        elif change == "delete" and len(reference):
+            positions = random_.sample(range(len(reference)), random_.randint(1, min(4, len(reference))))
+            cache.delete_rows(sheet_name, positions)
+            reference = reference.drop(index=positions).reset_index(drop=True)
+
+        compare(cache.read(sheet_name), reference)
+        assert cache.metadata(sheet_name)["rows"] == len(reference)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_partitions_match_reference(cache, seed):
+    random_ = random.Random(seed)
+    reference = rows(random_, 40)
+    cache.write("food_log_bela", reference)
+    cache.delete_rows("food_log_bela", [0, 7, 8])
+    reference = reference.drop(index=[0, 7, 8]).reset_index(drop=True)
+
+    assert set(cache.metadata("food_log_bela")["partitions"]) <= {
+        "2023-12", "2024-01", "2024-02", "2024-03", SheetCache.undated
+    }
+    for keys in (["2024-01"], ["2024-02", "2024-03"], SheetCache.partition_keys("2023-12-01", "2024-01-31")):
+        data = cache.read("food_log_bela", partitions=keys)
+        expected = reference[reference["date"].str[:7].isin(keys)]
+        # indexed by position in the sheet
+        assert list(data.index) == list(expected.index)
+        compare(data, expected)
+
+
+def test_tail(cache):
+    reference = rows(random.Random(0), 30)
+    cache.write("food_log_bela", reference)
+    tail = cache.tail("food_log_bela", 5)
+    assert list(tail.index) == list(range(25, 30))
+    compare(tail, reference.iloc[25:])
+
+
+def test_invalidate_drops_partitions():
+    memory = MemoryCache(max_bytes=1024**2)
+    data = pd.DataFrame({"name": ["food 1"]})
+    memory.put("food_log_bela", 1, data)
+    memory.put("food_log_bela/2024-01", (1,), data)
+    memory.put("food_log_bela_2", 1, data)
+    memory.invalidate("food_log_bela")
+    assert memory.get("food_log_bela", 1) is None
+    assert memory.get("food_log_bela/2024-01", (1,)) is None
+    assert memory.get("food_log_bela_2", 1) is not None
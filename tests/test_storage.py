@@ -0,0 +1,164 @@
+import pandas as pd
+import pytest
+from benchmarks.fake_sheets import FakeSheetsInterface
+from sqlite_storage import SQLiteStorage
+
+SHEET = "food_log_bela"
+
+
+def food_log() -> pd.DataFrame:
+    return pd.DataFrame({
+        "date": ["2024-01-01", "2024-01-01", "2024-01-02", "2024-01-02", "2024-01-03", "2024-01-03"],
+        "meal": ["Breakfast", "Lunch", "Breakfast", "Dinner", "Lunch", "Snack"],
+        "name": ["Oats", "Rice", "Oats", "Pasta", "Bread", "Apple"],
+        "quantity": [1, 2, 1, 3, 2, 1],
+        "serving": ["g", "g", "g", "g", "g", "g"],
+    })
+
+
+def edit(original:pd.DataFrame) -> pd.DataFrame:
+    """
+    What a data editor returns after changing, adding and removing rows.
+    """
+    updated = original.copy()
+    updated.loc[1, "quantity"] = 5 # changed
+    updated.loc[4, "name"] = "Bagel" # changed
+    updated = updated.drop(index=[0, 3, 5]) # deleted, not contiguous
+    added = pd.DataFrame({
+        "date": ["2024-01-04", "2024-01-04"],
+        "meal": ["Dinner", "Snack"],
+        "name": ["Soup", "Pear"],
+        "quantity": [1, 1],
+        "serving": ["g", "g"],
+    }, index=[6, 7])
+    return pd.concat([updated, added])
+
+
+def expected(original:pd.DataFrame) -> pd.DataFrame:
+    """
+    The sheet after sync_changes(original, edit(original)): updated rows
+    stay in place, appended rows go to the end and deleted rows close up.
+    """
+    updated = edit(original)
+    kept = updated.loc[updated.index.isin(original.index)]
+    return pd.concat([kept, updated.loc[~updated.index.isin(original.index)]]).reset_index(drop=True)
+
+
+def compare(actual:pd.DataFrame, reference:pd.DataFrame) -> None:
+    pd.testing.assert_frame_equal(
+        actual.reset_index(drop=True).astype(str), reference.reset_index(drop=True).astype(str)
+    )
+
+
+def sqlite(tmp_path) -> SQLiteStorage:
+    storage = SQLiteStorage(database_path=str(tmp_path / "storage.sqlite3"))
+    storage.update_google_sheet(SHEET, food_log())
+    return storage
+
+
+@pytest.mark.parametrize("backend", ["fake", "sqlite"])
+def test_sync_changes(tmp_path, backend):
+    storage = FakeSheetsInterface({SHEET: food_log()}) if backend == "fake" else sqlite(tmp_path)
+    original = storage.load_google_sheet_data(SHEET)
+
+    storage.sync_changes(SHEET, original, edit(original))
+
+    compare(storage.load_google_sheet_data(SHEET), expected(original))
+
+
+def test_sync_changes_without_changes(tmp_path):
+    storage = FakeSheetsInterface({SHEET: food_log()})
+    original = storage.load_google_sheet_data(SHEET)
+    storage.sync_changes(SHEET, original, original.copy())
+    assert storage.writes[SHEET] == 0
+
+
+def test_sync_changes_only_writes_differences():
+    storage = FakeSheetsInterface({SHEET: food_log()})
+    original = storage.load_google_sheet_data(SHEET)
+    storage.sync_changes(SHEET, original, edit(original))
+    # one call each, instead of replacing the whole sheet
+    assert storage.calls["update_rows"] == 1
+    assert storage.calls["append"] == 1
+    assert storage.calls["delete"] == 1
+    assert storage.calls["update"] == 0
+
+
+class FailingSync(FakeSheetsInterface):
+    """
+    A sync backend whose writes can be made to fail, with a stand-in for
+    the sheet cache SQLiteStorage reads versions from.
+    """
+
+    cache_ttl = 60
+
+    def __init__(self, sheets):
+        super().__init__(sheets)
+        self.cache = self
+        self.fail = False
+
+    def metadata(self, sheet_name):
+        return {"version": self.writes[sheet_name]}
+
+    def age(self, metadata):
+        return 0
+
+    def load_many(self, sheet_names):
+        return {sheet_name: self.load_google_sheet_data(sheet_name) for sheet_name in sheet_names}
+
+    def append_rows(self, sheet_name, new_rows):
+        if self.fail:
+            raise ConnectionError("Sheets is down")
+        super().append_rows(sheet_name, new_rows)
+
+    def delete_rows(self, sheet_name, indices):
+        if self.fail:
+            raise ConnectionError("Sheets is down")
+        super().delete_rows(sheet_name, indices)
+
+
+@pytest.mark.parametrize("write", [
+    lambda storage: storage.append_rows(SHEET, food_log().iloc[:1]),
+    lambda storage: storage.delete_rows(SHEET, [0, 2]),
+])
+def test_failed_sync_imports_the_sheet_again(tmp_path, write):
+    sync = FailingSync({SHEET: food_log()})
+    storage = SQLiteStorage(sync=sync, database_path=str(tmp_path / "storage.sqlite3"))
+    compare(storage.load_google_sheet_data(SHEET), food_log())
+    assert storage.version(SHEET) == 0
+
+    sync.fail = True
+    with pytest.raises(ConnectionError):
+        write(storage)
+    # the table has the write, the sheet does not
+    assert storage.version(SHEET) is None
+
+    sync.fail = False
+    compare(storage.load_google_sheet_data(SHEET), food_log())
+    assert storage.version(SHEET) == 0
+
+
+def test_synced_write_keeps_the_table(tmp_path):
+    sync = FailingSync({SHEET: food_log()})
+    storage = SQLiteStorage(sync=sync, database_path=str(tmp_path / "storage.sqlite3"))
+    storage.load_google_sheet_data(SHEET)
+
+    storage.delete_rows(SHEET, [0, 2])
+    assert storage.version(SHEET) == 1
+    compare(storage.load_google_sheet_data(SHEET), food_log().drop(index=[0, 2]))
+    compare(sync.sheets[SHEET], food_log().drop(index=[0, 2]))
+
+
+def test_delete_rows_renumbers_the_rows(tmp_path):
+    storage = sqlite(tmp_path)
+    log = pd.concat([food_log()] * 5, ignore_index=True)
+    storage.update_google_sheet(SHEET, log)
+    storage.delete_rows(SHEET, [3, 29, 0, 17, 18, 4])
+    compare(storage.load_google_sheet_data(SHEET), log.drop(index=[0, 3, 4, 17, 18, 29]))
+
+    # rows are addressed by position, as in Google Sheets
+    storage.update_rows(SHEET, food_log().iloc[[1]].set_axis([20]))
+    storage.delete_rows(SHEET, [22])
+    reference = log.drop(index=[0, 3, 4, 17, 18, 29]).reset_index(drop=True)
+    reference.loc[20] = food_log().iloc[1]
+    compare(storage.load_google_sheet_data(SHEET), reference.drop(index=[22]))
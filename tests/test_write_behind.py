@@ -0,0 +1,172 @@
+import os
+import subprocess
+import sys
+import pytest
+from write_behind import WriteBehindQueue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def queue(path, owner, **kwargs) -> WriteBehindQueue:
+    # a long interval, so the background thread never flushes during a test
+    return WriteBehindQueue(str(path), interval=3600, owner=owner, **kwargs)
+
+
+class Recorder:
+
+    def __init__(self, fail=lambda op: False):
+        self.sent = []
+        self.fail = fail
+
+    def __call__(self, sheet_name, ops):
+        if any(self.fail(op) for op in ops):
+            raise RuntimeError("rejected")
+        self.sent.append((sheet_name, ops))
+
+
+def test_replay_after_restart(tmp_path):
+    first = queue(tmp_path, "first")
+    first.start(Recorder(fail=lambda op: True))
+    first.enqueue("food_log_bela", {"op": "append", "rows": [["a"]]})
+    first.enqueue("food_log_bela", {"op": "delete", "indices": [3]})
+    with pytest.raises(RuntimeError):
+        first.flush()
+    first.close()
+
+    send = Recorder()
+    second = queue(tmp_path, "second")
+    second.start(send)
+    try:
+        assert second.status()["pending"] == {"food_log_bela": 2}
+        assert not os.path.exists(tmp_path / "first")
+
+        second.flush()
+        assert send.sent == [("food_log_bela", [
+            {"op": "append", "rows": [["a"]]},
+            {"op": "delete", "indices": [3]},
+        ])]
+        assert second.status()["pending"] == {}
+    finally:
+        second.close()
+
+    # nothing is left to replay
+    third = queue(tmp_path, "third")
+    third.start(Recorder())
+    try:
+        assert third.status()["pending"] == {}
+    finally:
+        third.close()
+
+
+def test_restart_with_same_owner(tmp_path):
+    first = queue(tmp_path, "worker")
+    first.start(Recorder())
+    first.enqueue("weight_log_bela", {"op": "append", "rows": [[80]]})
+    first.close()
+
+    send = Recorder()
+    second = queue(tmp_path, "worker")
+    second.start(send)
+    try:
+        second.flush("weight_log_bela")
+        assert send.sent == [("weight_log_bela", [{"op": "append", "rows": [[80]]}])]
+    finally:
+        second.close()
+
+
+def test_claimed_ops_go_first(tmp_path):
+    first = queue(tmp_path, "first")
+    first.start(Recorder())
+    first.enqueue("food_log_bela", {"op": "append", "rows": [["old"]]})
+    first.close()
+
+    send = Recorder()
+    second = queue(tmp_path, "second")
+    second.start(send)
+    try:
+        second.enqueue("food_log_bela", {"op": "append", "rows": [["new"]]})
+        second.flush()
+        assert [op["rows"] for op in send.sent[0][1]] == [[["old"]], [["new"]]]
+    finally:
+        second.close()
+
+
+def test_failing_op_is_dead_lettered(tmp_path):
+    send = Recorder(fail=lambda op: op["rows"] == [["bad"]])
+    dropped = []
+    writer = queue(tmp_path, "writer", max_attempts=2)
+    writer.start(send, on_dead_letter=dropped.append)
+    try:
+        writer.enqueue("food_log_bela", {"op": "append", "rows": [["bad"]]})
+        writer.enqueue("food_log_bela", {"op": "append", "rows": [["good"]]})
+
+        # the batch fails max_attempts times
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                writer.flush("food_log_bela")
+        assert writer.status()["failures"] == {"food_log_bela": 2}
+        assert dropped == []
+
+        # then the first op is sent on its own, fails again and is set aside
+        with pytest.raises(RuntimeError):
+            writer.flush("food_log_bela")
+        assert dropped == ["food_log_bela"]
+        status = writer.status()
+        assert status["pending"] == {"food_log_bela": 1}
+        assert status["dead_letters"] == {"food_log_bela": 1}
+        dead = writer.dead_letters()["food_log_bela"][0]
+        assert dead["op"] == {"op": "append", "rows": [["bad"]]}
+        assert dead["error"] == "rejected"
+
+        # the writes behind it are no longer stuck
+        writer.flush("food_log_bela")
+        assert send.sent == [("food_log_bela", [{"op": "append", "rows": [["good"]]}])]
+        assert writer.status()["pending"] == {}
+        assert writer.status()["failures"] == {}
+    finally:
+        writer.close()
+
+    # dead letters survive a restart, and are not replayed
+    send = Recorder()
+    restarted = queue(tmp_path, "writer")
+    restarted.start(send)
+    try:
+        restarted.flush()
+        assert send.sent == []
+        assert restarted.status()["dead_letters"] == {"food_log_bela": 1}
+    finally:
+        restarted.close()
+
+
+def test_running_process_keeps_its_journal(tmp_path):
+    script = (
+        "import sys\n"
+        "from write_behind import WriteBehindQueue\n"
+        f"queue = WriteBehindQueue({str(tmp_path)!r}, interval=3600, owner='live')\n"
+        "queue.start(lambda sheet_name, ops: None)\n"
+        "queue.enqueue('food_log_bela', {'op': 'append', 'rows': [['a']]})\n"
+        "print('ready', flush=True)\n"
+        "sys.stdin.read()\n"
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-c", script], cwd=ROOT,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        assert process.stdout.readline().strip() == "ready"
+        send = Recorder()
+        other = queue(tmp_path, "other")
+        other.start(send)
+        try:
+            assert other.status()["pending"] == {}
+
+            # the process stops without flushing, its journal is claimed
+            process.stdin.close()
+            process.wait(timeout=30)
+            other._claim_orphans()
+            other.flush()
+            assert send.sent == [("food_log_bela", [{"op": "append", "rows": [["a"]]}])]
+        finally:
+            other.close()
+    finally:
+        process.kill()
@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from metrics import metrics
+from quota import governor
+
+# prefetch all sheets on the first page run after the server started, and
+# after the cache is cleared
+enabled = os.environ.get("HEALTH_TRACKER_WARMUP", "1") == "1"
+
+USERS = ["bela", "marleen"]
+
+
+def known_sheets() -> List[str]:
+    """
+    Every sheet the pages load: the food data, recipes and tags, and the
+    logs, info and target of each user.
+    """
+    sheet_names = [
+        "food_data",
+        "recipe_info",
+        "recipe_tags",
+        "recipe_ingredients",
+        "recipe_instructions",
+        "available_tags",
+    ]
+    for user in USERS:
+        sheet_names += [f"food_log_{user}", f"weight_log_{user}", f"info_{user}", f"target_{user}"]
+    return sheet_names
+
+
+class CacheWarmup:
+    """
+    Loads every known sheet in the background, so the first visitor to a
+    page after a deploy or a cache clear is served from a warm cache instead
+    of waiting for several downloads in a row.
+
+    The sheets are loaded on a background thread with a single load_many
+    call on the storage backend, so the ones that are not cached yet are
+    downloaded with one batched request (see
+    GoogleSheetsInterface.load_many). A sheet that a page asks for while it
+    is being downloaded is not downloaded twice, the page waits for the
+    warm-up's download (see SheetCache.fill_lock).
+
+    The download goes through the rate governor. On top of that, warm-up
+    waits while fewer than reserve requests are left in the governor's token
+    bucket, so it never uses up the quota that page views need.
+    """
+
+    reserve = 10 # requests left in the token bucket for page views
+    poll_interval = 0.5 # seconds between checks of the token bucket
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-warmup")
+        self._lock = threading.Lock()
+        self._started = False
+        self._run = 0
+        self._status = {"state": "idle", "total": 0, "done": 0, "failed": [], "seconds": None}
+
+    def start(self, storage, sheet_names:List[str]=None) -> bool:
+        """
+        Warm up the cache of storage. A warm-up that is still running is
+        superseded: it still finishes, before the new one starts, but
+        progress is only reported for the new one.
+
+        Args:
+            storage (StorageBackend): The backend to load the sheets with
+            sheet_names (List[str]): The sheets to load, all known sheets
+                by default
+
+        Returns:
+            started (bool): Always True
+        """
+        sheet_names = list(dict.fromkeys(sheet_names or known_sheets()))
+        with self._lock:
+            self._started = True
+            self._run += 1
+            run = self._run
+            self._status = {"state": "running", "total": len(sheet_names), "done": 0, "failed": [], "seconds": None}
+        self._report()
+        print(f"Cache warm-up: loading {len(sheet_names)} sheets")
+
+        self._executor.submit(self._load, storage, sheet_names, run)
+        return True
+
+    def start_once(self, storage) -> bool:
+        """
+        Warm up the cache of storage if this process did not do so yet,
+        i.e. on the first page run after the server started.
+        """
+        with self._lock:
+            if self._started:
+                return False
+            self._started = True
+        return self.start(storage)
+
+    def status(self) -> dict:
+        """
+        Progress of the last warm-up.
+
+        Returns:
+            status (dict): state (idle, running or done), total (sheets to
+                load), done (sheets loaded or failed), failed (the sheets
+                that could not be loaded) and seconds (duration, once done)
+        """
+        with self._lock:
+            return {**self._status, "failed": list(self._status["failed"])}
+
+    def _load(self, storage, sheet_names:List[str], run:int) -> None:
+        start = time.perf_counter()
+        failed = []
+        try:
+            self._wait_for_quota()
+            storage.load_many(sheet_names)
+        except Exception:
+            print("Cache warm-up failed:")
+            traceback.print_exc()
+            failed = sheet_names
+        seconds = round(time.perf_counter() - start, 3)
+        with self._lock:
+            if run != self._run:
+                return
+            self._status.update(state="done", done=len(sheet_names), failed=list(failed), seconds=seconds)
+        self._report()
+        print(f"Cache warm-up: {'failed' if failed else 'done'} in {seconds} s")
+
+    def _wait_for_quota(self) -> None:
+        reserve = min(self.reserve, governor.bucket.capacity / 2)
+        while governor.bucket.available() < reserve + 1:
+            time.sleep(self.poll_interval)
+
+    def _report(self) -> None:
+        status = self.status()
+        metrics.set("health_tracker_warmup_sheets", status["total"], state="total")
+        metrics.set("health_tracker_warmup_sheets", status["done"], state="done")
+        metrics.set("health_tracker_warmup_sheets", len(status["failed"]), state="failed")
+
+
+warmup = CacheWarmup()
+
+
+def start(storage, force:bool=False) -> Optional[bool]:
+    """
+    Warm up the cache of storage in the background: once per process, or
+    again if force (e.g. after the cache was cleared). Does nothing if
+    warm-up is disabled with HEALTH_TRACKER_WARMUP=0.
+
+    Returns:
+        started (bool | None): Whether a warm-up was started, None if
+            warm-up is disabled
+    """
+    if not enabled:
+        return None
+    return warmup.start(storage) if force else warmup.start_once(storage)
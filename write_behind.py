@@ -0,0 +1,333 @@
+import json
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List
+from file_lock import FileLock, file_lock
+
+
+class WriteBehindQueue:
+    """
+    Durable queue of pending Google Sheets writes.
+
+    In write-behind mode GoogleSheetsInterface does not wait for the API on
+    every write. Instead each write (an "op") is appended to a journal file
+    per sheet and applied to the cached data right away. A background thread
+    flushes the journal every few seconds, sending all pending ops of a
+    sheet in a single API call. Ops that fail to flush stay in the journal
+    and are retried with a growing delay; ops left in the journal when the
+    server stops are flushed after the next start.
+
+    Every process has a journal directory of its own (named after its owner,
+    the process id by default), locked with a FileLock for as long as the
+    process runs. Processes only ever flush their own journal, so a write is
+    sent once even if the app runs in several worker processes. The journal
+    of a process that stopped is no longer locked; the first process that
+    notices (on start, and then on every flush round) claims its ops by
+    moving them into its own journal under that lock.
+
+    If a sheet fails to flush max_attempts times in a row, its ops are sent
+    one at a time, and an op that still fails on its own is moved to a
+    dead-letter file (dead/<sheet>.jsonl, shared by all processes), so it no
+    longer holds up the writes behind it. Dead letters are reported by
+    status, and the on_dead_letter callback lets the owner of the cache
+    download the sheet again, since the cache still contains the dropped op.
+
+    Ops are dicts that can be stored as json, e.g.
+    {"op": "append", "rows": [[...], ...]}. Row indices in ops refer to the
+    sheet as it is after all earlier ops were applied, so ops must be sent
+    in order.
+    """
+
+    def __init__(self, journal_path:str, interval:float=5., max_attempts:int=10, owner:str=None):
+        self.journal_path = journal_path
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.owner = owner if owner is not None else str(os.getpid())
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[str, List[dict]] = {}
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._last_error: Dict[str, str] = {}
+        self._send = None
+        self._on_dead_letter = None
+        self._owner_lock: FileLock = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(
+        self,
+        send:Callable[[str, List[dict]], None],
+        on_dead_letter:Callable[[str], None]=None,
+    ) -> None:
+        """
+        Take the journal of this process, claim the ops of stopped
+        processes and start the background flusher (only the first call has
+        an effect).
+
+        Args:
+            send (Callable[[str, List[dict]], None]): Function that writes a
+                list of ops to a sheet in one API call, raising on failure
+            on_dead_letter (Callable[[str], None]): Called with the name of
+                a sheet after one of its ops was moved to the dead letters
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._send = send
+            self._on_dead_letter = on_dead_letter
+            os.makedirs(self._owner_path(self.owner), exist_ok=True)
+            os.makedirs(f"{self.journal_path}/dead", exist_ok=True)
+            self._owner_lock = file_lock(f"{self.journal_path}/{self.owner}.lock")
+            self._owner_lock.acquire()
+            # ops left by an earlier process with the same owner name
+            for sheet_name, ops in self._read_journals(self._owner_path(self.owner)).items():
+                self._pending[sheet_name] = ops
+            # journals of versions that kept one directory for all processes
+            self._claim(self.journal_path, f"{self.journal_path}/shared.lock")
+            self._claim_orphans()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        """
+        Stop the background flusher and release the journal, so that other
+        processes can claim the ops that are left in it. Call it from the
+        thread that called start, which holds the journal's FileLock.
+        """
+        with self._lock:
+            if self._thread is None:
+                return
+            self._stopped.set()
+            thread, self._thread = self._thread, None
+        thread.join()
+        with self._lock:
+            self._pending.clear()
+            self._failures.clear()
+            self._retry_at.clear()
+            self._last_error.clear()
+            self._owner_lock.release()
+            self._owner_lock = None
+
+    def enqueue(self, sheet_name:str, op:dict) -> None:
+        """
+        Add an op to the journal of a sheet.
+        """
+        with self._lock:
+            if self._thread is None:
+                raise RuntimeError("The write-behind queue was not started")
+            with open(self._journal_file(sheet_name), "a") as journal:
+                journal.write(json.dumps(op) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._pending.setdefault(sheet_name, []).append(op)
+
+    def flush(self, sheet_name:str=None) -> None:
+        """
+        Send pending ops now, waiting for the result.
+
+        Args:
+            sheet_name (str): Only flush this sheet. If None, all sheets
+                are flushed.
+
+        Raises:
+            Exception: Whatever the send function raised
+        """
+        with self._lock:
+            sheet_names = [sheet_name] if sheet_name is not None else list(self._pending)
+        for name in sheet_names:
+            self._flush_sheet(name)
+
+    def has_pending(self, sheet_name:str) -> bool:
+        """
+        Whether a sheet has writes that were not flushed yet.
+        """
+        with self._lock:
+            return bool(self._pending.get(sheet_name))
+
+    def status(self) -> dict:
+        """
+        Overview of the unflushed writes.
+
+        Returns:
+            status (dict): pending (number of unflushed ops per sheet),
+                failures (failed flush attempts per sheet), last_error
+                (message of the last failed flush per sheet) and
+                dead_letters (number of ops per sheet that were given up on,
+                by any process)
+        """
+        with self._lock:
+            status = {
+                "pending": {name: len(ops) for name, ops in self._pending.items() if ops},
+                "failures": dict(self._failures),
+                "last_error": dict(self._last_error),
+            }
+        status["dead_letters"] = {
+            sheet_name: len(ops) for sheet_name, ops in self.dead_letters().items()
+        }
+        return status
+
+    def dead_letters(self) -> Dict[str, List[dict]]:
+        """
+        The ops that were given up on, by sheet name. Each is a dict with
+        the op, the error it failed with and when (failed_at, unix time).
+        """
+        path = f"{self.journal_path}/dead"
+        if not os.path.isdir(path):
+            return {}
+        with file_lock(f"{path}.lock"):
+            return {
+                file[:-len(".jsonl")]: self._read_file(f"{path}/{file}")
+                for file in sorted(os.listdir(path)) if file.endswith(".jsonl")
+            }
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self._claim_orphans()
+            except Exception:
+                print("Write-behind could not claim the journal of a stopped process:")
+                traceback.print_exc()
+            with self._lock:
+                sheet_names = [
+                    name for name, ops in self._pending.items()
+                    if ops and self._retry_at.get(name, 0) <= time.monotonic()
+                ]
+            for sheet_name in sheet_names:
+                try:
+                    self._flush_sheet(sheet_name)
+                except Exception:
+                    print(f"Write-behind flush of {sheet_name} failed:")
+                    traceback.print_exc()
+
+    def _flush_sheet(self, sheet_name:str) -> None:
+        # one flush at a time, without blocking enqueue while the API is busy
+        with self._flush_lock:
+            with self._lock:
+                ops = list(self._pending.get(sheet_name, []))
+                # failed too often: find the op that fails by sending them one by one
+                isolate = self._failures.get(sheet_name, 0) >= self.max_attempts
+            if isolate:
+                ops = ops[:1]
+            if not ops:
+                return
+            try:
+                self._send(sheet_name, ops)
+            except Exception as e:
+                with self._lock:
+                    failures = self._failures.get(sheet_name, 0) + 1
+                    self._failures[sheet_name] = failures
+                    self._retry_at[sheet_name] = time.monotonic() + min(300, self.interval * 2**failures)
+                    self._last_error[sheet_name] = str(e)
+                    if isolate:
+                        self._dead_letter(sheet_name, ops[0], str(e))
+                if isolate and self._on_dead_letter is not None:
+                    self._on_dead_letter(sheet_name)
+                raise
+
+            with self._lock:
+                self._pending[sheet_name] = self._pending[sheet_name][len(ops):]
+                self._failures.pop(sheet_name, None)
+                self._retry_at.pop(sheet_name, None)
+                self._last_error.pop(sheet_name, None)
+                # rewrite the journal with the ops that were added during the flush
+                self._write_journal(sheet_name)
+
+    def _dead_letter(self, sheet_name:str, op:dict, error:str) -> None:
+        """
+        Move the first pending op of a sheet to its dead-letter file.
+        """
+        path = f"{self.journal_path}/dead"
+        with file_lock(f"{path}.lock"):
+            with open(f"{path}/{sheet_name}.jsonl", "a") as dead:
+                dead.write(json.dumps({"op": op, "error": error, "failed_at": time.time()}) + "\n")
+                dead.flush()
+                os.fsync(dead.fileno())
+        self._pending[sheet_name] = self._pending[sheet_name][1:]
+        self._write_journal(sheet_name)
+
+    def _claim_orphans(self) -> None:
+        """
+        Move the ops of processes that stopped into this process' journal.
+        """
+        for owner in os.listdir(self.journal_path):
+            if owner in (self.owner, "dead") or not os.path.isdir(self._owner_path(owner)):
+                continue
+            if self._claim(self._owner_path(owner), f"{self.journal_path}/{owner}.lock"):
+                # lock files are kept, other processes may be holding them
+                os.rmdir(self._owner_path(owner))
+
+    def _claim(self, path:str, lock_path:str) -> bool:
+        """
+        Move the ops of the journals in path into this process' journal,
+        unless another process holds lock_path. The claimed ops go before
+        the ones of this process, they are older.
+
+        Returns:
+            claimed (bool): Whether the journals were claimed
+        """
+        lock = file_lock(lock_path)
+        # still running
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            claimed = self._read_journals(path)
+            with self._lock:
+                for sheet_name, ops in claimed.items():
+                    self._pending[sheet_name] = ops + self._pending.get(sheet_name, [])
+                    self._write_journal(sheet_name)
+            for file in os.listdir(path):
+                if file.endswith((".jsonl", ".tmp")):
+                    os.remove(f"{path}/{file}")
+        finally:
+            lock.release()
+        if claimed:
+            print(f"Write-behind claimed the pending writes in {path}: {', '.join(claimed)}")
+        return True
+
+    @staticmethod
+    def _read_journals(path:str) -> Dict[str, List[dict]]:
+        journals = {}
+        for file in os.listdir(path):
+            if file.endswith(".jsonl"):
+                ops = WriteBehindQueue._read_file(f"{path}/{file}")
+                if ops:
+                    journals[file[:-len(".jsonl")]] = ops
+        return journals
+
+    @staticmethod
+    def _read_file(path:str) -> List[dict]:
+        with open(path) as journal:
+            # a line cut off by a crash is the only one that does not parse
+            lines = [line for line in journal if line.strip()]
+        ops = []
+        for line in lines:
+            try:
+                ops.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Skipped a partially written line in {path}")
+        return ops
+
+    def _write_journal(self, sheet_name:str) -> None:
+        journal_file = self._journal_file(sheet_name)
+        with open(f"{journal_file}.tmp", "w") as journal:
+            journal.writelines(json.dumps(op) + "\n" for op in self._pending.get(sheet_name, []))
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(f"{journal_file}.tmp", journal_file)
+
+    def _owner_path(self, owner:str) -> str:
+        return f"{self.journal_path}/{owner}"
+
+    def _journal_file(self, sheet_name:str) -> str:
+        return f"{self._owner_path(self.owner)}/{sheet_name}.jsonl"
+
+
+write_queue = WriteBehindQueue(
+    journal_path="cache/journal",
+    interval=float(os.environ.get("HEALTH_TRACKER_WRITE_BEHIND_INTERVAL", 5)),
+    max_attempts=int(os.environ.get("HEALTH_TRACKER_WRITE_BEHIND_MAX_ATTEMPTS", 10)),
+)